@@ -2,17 +2,76 @@ from django.contrib import admin
 
 # Register your models here.
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ORDER_VAR, PAGE_VAR, ChangeList
+from django.core.exceptions import PermissionDenied
+from django.db.models import Q
+from django.template.response import TemplateResponse
+from django.urls import path
 from leaflet.admin import LeafletGeoAdmin
 
 from portfolio.models import Profile, Expertise
+from project.db_router import read_from_replica
+from users.models import CustomUser
+from users.paginators import EstimatedCountPaginator
 
 admin.site.site_header = 'GIS Portfolio Admin'
 
+# Query parameter of keyset pagination, id of the last Profile of the previous page
+CURSOR_VAR = 'after'
+
+
+class KeysetChangeList(ChangeList):
+    """
+    ChangeList that pages through Profile by id instead of OFFSET, so every page is as fast as the first one.
+    Only used with the default ordering, sorting by a column falls back to page numbers.
+    """
+
+    def __init__(self, request, *args, **kwargs):
+        self.cursor = request.GET.get(CURSOR_VAR)
+        self.next_cursor = None
+        super().__init__(request, *args, **kwargs)
+
+    @property
+    def keyset(self):
+        return ORDER_VAR not in self.params
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_results(self, request):
+        if self.keyset:
+            self.page_num = 0
+        # result count is estimated from every row of the filters, before the cursor is applied,
+        # so it does not shrink on every page
+        super().get_results(request)
+        if self.cursor and self.keyset:
+            try:
+                queryset = self.queryset.filter(pk__lt=int(self.cursor))
+            except ValueError:
+                raise IncorrectLookupParameters('Invalid cursor {}'.format(self.cursor))
+            self.result_list = queryset if self.show_all and self.can_show_all else queryset[:self.list_per_page]
+        if self.keyset and not self.show_all and len(self.result_list) == self.list_per_page:
+            self.next_cursor = self.result_list[len(self.result_list) - 1].pk
+
+    def next_page_url(self):
+        return self.get_query_string({CURSOR_VAR: self.next_cursor}, [PAGE_VAR])
+
+    def first_page_url(self):
+        return self.get_query_string(remove=[CURSOR_VAR, PAGE_VAR])
+
+
 @admin.register(Profile)
 class ProfileAdmin(LeafletGeoAdmin):
     model = Profile
     list_display = ['first_name', 'last_name', 'get_email', 'phone']
+    list_select_related = ['user']
     search_fields = ['first_name', 'last_name', 'phone', 'user__email']
+    ordering = ['-pk']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     def get_email(self, obj):
         return obj.user.email
@@ -29,6 +88,38 @@ class ProfileAdmin(LeafletGeoAdmin):
         else:
             return self.model.objects.filter(user=request.user)
 
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def changelist_view(self, request, extra_context=None):
+        with read_from_replica(request):
+            return super().changelist_view(request, extra_context)
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Search Profile name and phone, and user email with a subquery instead of a join,
+        so each condition can use its trigram index and the result needs no DISTINCT.
+        """
+        for term in search_term.split():
+            users = CustomUser.objects.filter(email__icontains=term).values('pk')
+            queryset = queryset.filter(Q(first_name__icontains=term) | Q(last_name__icontains=term) |
+                                       Q(phone__icontains=term) | Q(user__in=users))
+        return queryset, False
+
+    def get_urls(self):
+        return [
+            path('map/', self.admin_site.admin_view(self.map_view), name='portfolio_profile_map'),
+        ] + super().get_urls()
+
+    def map_view(self, request):
+        """
+        Map of every Profile, loaded from the map API as the map moves instead of rendering a widget per Profile
+        """
+        if not self.has_view_or_change_permission(request):
+            raise PermissionDenied
+        context = dict(self.admin_site.each_context(request), opts=self.model._meta, title='Profile map')
+        return TemplateResponse(request, 'admin/portfolio/profile/map.html', context)
+
     def get_readonly_fields(self, request, obj=None):
         """
             Set user field as readonly, based on user status.
@@ -40,4 +131,4 @@ class ProfileAdmin(LeafletGeoAdmin):
             return self.readonly_fields + ('user',)
         return self.readonly_fields
 
-admin.site.register(Expertise)
\ No newline at end of file
+admin.site.register(Expertise)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class PagesConfig(AppConfig):
     name = 'portfolio'
+
+    def ready(self):
+        # registers system checks
+        from portfolio import checks  # noqa: F401
@@ -0,0 +1,397 @@
+"""
+Benchmark of the hot views, used by `manage.py bench`.
+
+Synthetic users and Profile are generated around weighted city clusters, with a random set of Expertise each, and
+stored with ProfileImporter like a real import. Generation is seeded, so the same seed and row count always give
+the same data. Bench users have emails at EMAIL_DOMAIN, so they can be counted, grown and removed without touching
+real users.
+
+Every scenario is requested in process with the test Client. Latency, throughput and SQL query count are measured
+around each request, so a run can be saved as JSON and compared with the run of a previous version.
+
+compare_concurrency() serves many simultaneous clients that download slowly, once with a fixed number of sync
+workers like WSGI, and once with the ASGI handler, to show how many map clients a process can keep up with.
+"""
+import asyncio
+import math
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from io import BytesIO
+
+from django.apps import apps
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+
+from portfolio import importers
+from project.asgi_handler import WSGIToASGIHandler, build_environ, close
+from project.instrumentation import QueryRecorder
+from users.models import CustomUser
+
+EMAIL_DOMAIN = 'bench.example.com'
+ADMIN_EMAIL = 'admin@{}'.format(EMAIL_DOMAIN)
+# Password of the bench user and bench admin
+PASSWORD = 'bench-password'
+
+# (name, longitude, latitude, spread in km, weight) of Profile clusters
+CITIES = (
+    ('Jakarta', 106.8456, -6.2088, 25, 30),
+    ('Surabaya', 112.7521, -7.2575, 15, 10),
+    ('Bandung', 107.6191, -6.9175, 12, 9),
+    ('Yogyakarta', 110.3695, -7.7956, 10, 8),
+    ('Medan', 98.6722, 3.5952, 12, 6),
+    ('Denpasar', 115.2126, -8.6705, 8, 5),
+    ('Makassar', 119.4327, -5.1477, 10, 4),
+    ('Singapore', 103.8198, 1.3521, 12, 8),
+    ('Kuala Lumpur', 101.6869, 3.1390, 15, 6),
+    ('Bangkok', 100.5018, 13.7563, 20, 6),
+    ('Manila', 120.9842, 14.5995, 20, 5),
+    ('Tokyo', 139.6917, 35.6895, 30, 6),
+    ('Bengaluru', 77.5946, 12.9716, 20, 5),
+    ('London', -0.1276, 51.5072, 25, 4),
+    ('Berlin', 13.4050, 52.5200, 15, 3),
+    ('New York', -74.0060, 40.7128, 25, 4),
+    ('Sao Paulo', -46.6333, -23.5505, 25, 2),
+    ('Nairobi', 36.8219, -1.2921, 12, 1),
+    ('Sydney', 151.2093, -33.8688, 20, 2),
+)
+# Share of Profile placed uniformly at random outside of clusters, and without location
+NOISE = 0.05
+NO_LOCATION = 0.05
+# Expertise from the most to the least common, picked with weight 1 / rank
+EXPERTISE = ('Python', 'JavaScript', 'Django', 'SQL', 'HTML', 'CSS', 'React', 'PostgreSQL', 'GIS', 'QGIS', 'Docker',
+             'Linux', 'Java', 'Go', 'PostGIS', 'Vue', 'Flask', 'Kotlin', 'Swift', 'Rust', 'Leaflet', 'OpenLayers',
+             'GDAL', 'Remote Sensing', 'Cartography', 'Kubernetes', 'Terraform', 'Redis', 'Celery', 'TypeScript')
+MAX_EXPERTISE = 5
+FIRST_NAMES = ('Budi', 'Siti', 'Agus', 'Dewi', 'Andi', 'Putri', 'Rizky', 'Ayu', 'Eko', 'Sri', 'Hendra', 'Wati',
+               'Joko', 'Rina', 'Fajar', 'Lina', 'Bayu', 'Indah', 'Dimas', 'Maya', 'John', 'Maria', 'Wei', 'Yuki')
+LAST_NAMES = ('Santoso', 'Wijaya', 'Saputra', 'Hidayat', 'Pratama', 'Kusuma', 'Lestari', 'Setiawan', 'Nugroho',
+              'Siregar', 'Gunawan', 'Halim', 'Tan', 'Lim', 'Smith', 'Garcia', 'Chen', 'Sato', 'Istiadi', 'Rahman')
+STREETS = ('Jl. Sudirman', 'Jl. Thamrin', 'Jl. Gatot Subroto', 'Jl. Diponegoro', 'Jl. Malioboro', 'Main Street',
+           'Jl. Ahmad Yani', 'Jl. Merdeka', 'Station Road', 'Jl. Pemuda')
+KM_PER_DEGREE = 111.32
+
+# (name, method, URL name, URL kwargs, query string, client) of benchmarked requests. Client is None for an
+# anonymous client, 'user' for a client logged in as the bench user, and 'admin' for the bench admin.
+SCENARIOS = (
+    ('home', 'get', 'home', {}, '', None),
+    ('map_geojson', 'get', 'profile_geojson', {}, 'bbox=95,-11,141,6', None),
+    ('profile', 'get', 'profile', {}, '', 'user'),
+    ('profile_edit', 'get', 'profile_edit', {}, '', 'user'),
+    ('profile_edit_save', 'post', 'profile_edit', {}, '', 'user'),
+    ('login', 'post', 'account_login', {}, '', None),
+    ('admin_profile_changelist', 'get', 'admin:portfolio_profile_changelist', {}, '', 'admin'),
+    ('admin_profile_search', 'get', 'admin:portfolio_profile_changelist', {}, 'q=Budi', 'admin'),
+    ('admin_user_changelist', 'get', 'admin:users_customuser_changelist', {}, '', 'admin'),
+    ('admin_log_entry_changelist', 'get', 'admin:users_logentry_changelist', {}, '', 'admin'),
+)
+SCENARIO_NAMES = [scenario[0] for scenario in SCENARIOS]
+
+
+def email(number):
+    return 'user{}@{}'.format(number, EMAIL_DOMAIN)
+
+
+def bench_users():
+    """
+    :return: QuerySet of generated users, without the bench admin
+    """
+    return CustomUser.objects.filter(email__endswith='@' + EMAIL_DOMAIN).exclude(email=ADMIN_EMAIL)
+
+
+def cluster_point(rng, centers, weights):
+    """
+    :return: (lon, lat) around a random city, or anywhere on land-ish latitudes for noise
+    """
+    if rng.random() < NOISE:
+        return rng.uniform(-180, 180), rng.uniform(-60, 70)
+    name, lon, lat, spread, weight = rng.choices(centers, weights)[0]
+    # Normal distribution makes dense city centres and sparse outskirts
+    dlat = rng.gauss(0, spread) / KM_PER_DEGREE
+    dlon = rng.gauss(0, spread) / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+    return max(-180.0, min(180.0, lon + dlon)), max(-85.0, min(85.0, lat + dlat))
+
+
+def synthetic_records(start, stop, seed=1):
+    """
+    Generate importer records of bench users
+    :param start: number of the first user
+    :param stop: number after the last user
+    :param seed: random seed, records of a number only depend on the seed and the start of its range
+    :return: iterator of record dictionary for ProfileImporter
+    """
+    rng = random.Random('{}-{}'.format(seed, start))
+    weights = [city[4] for city in CITIES]
+    expertise_weights = [1 / rank for rank in range(1, len(EXPERTISE) + 1)]
+    for number in range(start, stop):
+        record = {
+            'email': email(number),
+            'username': email(number),
+            'first_name': rng.choice(FIRST_NAMES),
+            'last_name': rng.choice(LAST_NAMES),
+            'address': '{} No. {}'.format(rng.choice(STREETS), rng.randint(1, 300)),
+            'expertise': rng.choices(EXPERTISE, expertise_weights, k=rng.randint(0, MAX_EXPERTISE)),
+        }
+        if rng.random() >= NO_LOCATION:
+            record['lon'], record['lat'] = cluster_point(rng, CITIES, weights)
+        yield record
+
+
+def seed_profiles(count, seed=1, batch_size=5000):
+    """
+    Grow bench users and Profile to `count` rows. Existing bench users are kept, so a run at 1k rows followed by
+    100k only generates the 99k missing ones.
+    :return: number of created Profile
+    """
+    existing = bench_users().count()
+    if existing >= count:
+        return 0
+
+    importer = importers.ProfileImporter(batch_size=batch_size)
+    importer.run(synthetic_records(existing, count, seed))
+    return importer.created
+
+
+def setup_users():
+    """
+    Give the first bench user a password, and create the bench admin
+    :return: tuple of (bench user, bench admin)
+    """
+    user = bench_users().get(email=email(0))
+    user.set_password(PASSWORD)
+    user.save(update_fields=['password'])
+
+    admin = CustomUser.objects.filter(email=ADMIN_EMAIL).first()
+    if admin is None:
+        admin = CustomUser.objects.create_superuser(username=ADMIN_EMAIL, email=ADMIN_EMAIL, password=PASSWORD)
+    return user, admin
+
+
+def remove_profiles(batch_size=10000):
+    """
+    Remove bench users, their Profile and the bench admin
+    :return: number of removed users
+    """
+    Profile = apps.get_model('portfolio', 'Profile')
+    users = CustomUser.objects.filter(email__endswith='@' + EMAIL_DOMAIN)
+    count = 0
+    while True:
+        user_ids = list(users.values_list('pk', flat=True)[:batch_size])
+        if not user_ids:
+            break
+        # Rows of Profile are deleted without a signal each, like they are imported, and refreshed once at the end
+        profiles = Profile.objects.filter(user_id__in=user_ids)
+        Profile.expertise.through.objects.filter(profile_id__in=profiles.values('pk'))._raw_delete(using='default')
+        profiles._raw_delete(using='default')
+        CustomUser.objects.filter(pk__in=user_ids).delete()
+        count += len(user_ids)
+    importers.ProfileImporter().refresh()
+    return count
+
+
+def request_data(name, user):
+    """
+    :return: POST data of a scenario
+    """
+    if name == 'login':
+        return {'login': user.email, 'password': PASSWORD}
+    if name == 'profile_edit_save':
+        # Save the Profile unchanged, so every request does the same work
+        profile = apps.get_model('portfolio', 'Profile').objects.get(user=user)
+        data = {'first_name': profile.first_name, 'last_name': profile.last_name, 'address': profile.address,
+                'expertise': list(profile.expertise.values_list('pk', flat=True))}
+        if profile.location is not None:
+            data['location'] = profile.location.geojson
+        return data
+    return None
+
+
+def percentile(values, fraction):
+    """
+    :param values: sorted list
+    """
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def measure(send, path, data=None, requests=50):
+    """
+    Request a path repeatedly, after one warm up request
+    :param send: request method of a Client, e.g. client.get
+    :return: dictionary of throughput, latency percentiles in milliseconds and query counts
+    """
+    send(path, data or {})
+
+    timings, queries = [], []
+    total_start = time.perf_counter()
+    for _ in range(requests):
+        recorder = QueryRecorder()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(recorder))
+            start = time.perf_counter()
+            response = send(path, data or {})
+            timings.append((time.perf_counter() - start) * 1000)
+        if response.status_code >= 400:
+            raise ValueError('{} answered {}'.format(path, response.status_code))
+        queries.append(recorder.count)
+    total = time.perf_counter() - total_start
+
+    return dict(summarize(timings, total), queries={'mean': round(sum(queries) / len(queries), 2),
+                                                    'max': max(queries)})
+
+
+def summarize(timings, total):
+    """
+    :param timings: latency of every request in milliseconds
+    :param total: seconds taken by all requests
+    :return: dictionary of request count, throughput and latency percentiles
+    """
+    timings = sorted(timings)
+    return {
+        'requests': len(timings),
+        'throughput': round(len(timings) / total, 2) if total else None,
+        'latency_ms': {
+            'mean': round(sum(timings) / len(timings), 3),
+            'p50': round(percentile(timings, 0.5), 3),
+            'p95': round(percentile(timings, 0.95), 3),
+            'p99': round(percentile(timings, 0.99), 3),
+            'max': round(timings[-1], 3),
+        },
+    }
+
+
+def run_scenarios(names=None, requests=50):
+    """
+    Benchmark scenarios against the bench data currently in database
+    :param names: names of scenarios to run, default is every scenario
+    :return: dictionary of {scenario name: measure() result}
+    """
+    user, admin = setup_users()
+    clients = {None: Client(), 'user': Client(), 'admin': Client()}
+    clients['user'].force_login(user)
+    clients['admin'].force_login(admin)
+
+    results = {}
+    for name, method, url_name, kwargs, query, client in SCENARIOS:
+        if names and name not in names:
+            continue
+        path = reverse(url_name, kwargs=kwargs) + ('?' + query if query else '')
+        if name == 'login':
+            # a new client per request, so every login checks the password instead of finding a session
+            send = lambda path, data: Client().post(path, data)
+        else:
+            send = getattr(clients[client], method)
+        results[name] = measure(send, path, request_data(name, user), requests)
+    return results
+
+
+def request_scope(path, query=''):
+    """
+    :return: ASGI scope of an anonymous GET request
+    """
+    return {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query.encode(), 'http_version': '1.1',
+            'scheme': 'http', 'server': ('testserver', 80), 'client': ('127.0.0.1', 0),
+            'headers': [(b'host', b'testserver'), (b'accept-encoding', b'gzip')]}
+
+
+def run_wsgi_clients(application, scope, clients, workers, download_time):
+    """
+    Serve clients with `workers` sync workers, each busy until its client has downloaded the response
+    :return: tuple of (latency of each client in milliseconds, total seconds)
+    """
+
+    def serve(submitted):
+        response = {}
+        iterable = application(build_environ(scope, BytesIO()),
+                               lambda status, headers, exc_info=None: response.update(status=status))
+        try:
+            b''.join(iterable)
+        finally:
+            # sends request_finished, which closes the database connection of this thread
+            close(iterable)
+        if not response['status'].startswith('200'):
+            raise ValueError('{} answered {}'.format(scope['path'], response['status']))
+        time.sleep(download_time)
+        return (time.perf_counter() - submitted) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(serve, time.perf_counter()) for _ in range(clients)]
+        timings = [future.result() for future in futures]
+    return timings, time.perf_counter() - start
+
+
+def run_asgi_clients(application, scope, clients, threads, download_time):
+    """
+    Serve clients with WSGIToASGIHandler and `threads` pool threads
+    :return: tuple of (latency of each client in milliseconds, total seconds)
+    """
+    handler = WSGIToASGIHandler(application, threads)
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def client():
+        submitted = time.perf_counter()
+
+        async def send(message):
+            if message['type'] == 'http.response.start' and message['status'] != 200:
+                raise ValueError('{} answered {}'.format(scope['path'], message['status']))
+            if message['type'] == 'http.response.body' and not message.get('more_body'):
+                await asyncio.sleep(download_time)
+
+        await handler(scope, receive, send)
+        return (time.perf_counter() - submitted) * 1000
+
+    loop = asyncio.new_event_loop()
+    try:
+        start = time.perf_counter()
+        timings = loop.run_until_complete(asyncio.gather(*[client() for _ in range(clients)]))
+        return timings, time.perf_counter() - start
+    finally:
+        handler.get_executor().shutdown()
+        loop.close()
+
+
+def compare_concurrency(application, path, query='', clients=1000, workers=8, threads=16, download_time=0.5):
+    """
+    Serve simultaneous clients that take `download_time` seconds to receive a response, through WSGI sync workers
+    and through the ASGI handler
+    :param application: WSGI application
+    :return: dictionary of {'wsgi': summarize() result, 'asgi': summarize() result}
+    """
+    scope = request_scope(path, query)
+    # warm up caches, so both runs serve the same cached response
+    run_wsgi_clients(application, scope, 1, 1, 0)
+    return {
+        'wsgi': dict(summarize(*run_wsgi_clients(application, scope, clients, workers, download_time)),
+                     workers=workers),
+        'asgi': dict(summarize(*run_asgi_clients(application, scope, clients, threads, download_time)),
+                     threads=threads),
+    }
+
+
+def compare(baseline, current, tolerance=0.2):
+    """
+    Find regressions of a run against a baseline run
+    :param baseline: results of the previous run, as written by `manage.py bench`
+    :param current: results of this run
+    :param tolerance: allowed relative increase of p95 latency
+    :return: list of regression messages
+    """
+    regressions = []
+    baseline_rows = {run['rows']: run['scenarios'] for run in baseline.get('runs', [])}
+    for run in current['runs']:
+        for name, result in run['scenarios'].items():
+            previous = baseline_rows.get(run['rows'], {}).get(name)
+            if previous is None:
+                continue
+            if result['queries']['max'] > previous['queries']['max']:
+                regressions.append('{} at {} rows: {} queries, was {}'.format(
+                    name, run['rows'], result['queries']['max'], previous['queries']['max']))
+            if result['latency_ms']['p95'] > previous['latency_ms']['p95'] * (1 + tolerance):
+                regressions.append('{} at {} rows: p95 {} ms, was {} ms'.format(
+                    name, run['rows'], result['latency_ms']['p95'], previous['latency_ms']['p95']))
+    return regressions
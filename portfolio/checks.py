@@ -0,0 +1,22 @@
+"""
+System checks of portfolio settings, run by `manage.py check` and before runserver and migrate.
+"""
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+
+@register(Tags.caches)
+def check_map_cache(app_configs, **kwargs):
+    """
+    Map payload, cluster grids and profile pages are invalidated by signal receivers, which can only remove
+    entries of a local memory cache in their own process
+    """
+    if settings.SETTINGS_PROFILE == 'prod' and settings.PROFILE_MAP_CACHE_LOCAL:
+        return [Warning(
+            'PROFILE_MAP_CACHE uses a local memory cache, so other worker processes serve the old map and '
+            'profile page for up to PROFILE_MAP_CACHE_TIMEOUT ({} s) after a Profile changes.'.format(
+                settings.PROFILE_MAP_CACHE_TIMEOUT),
+            hint='Set CACHE_BACKEND to a cache shared by every process, e.g. file-based, memcached or redis.',
+            id='portfolio.W001',
+        )]
+    return []
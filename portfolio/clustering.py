@@ -0,0 +1,253 @@
+"""
+Server-side, zoom-aware clustering of Profile location.
+
+Profile locations are grouped into a grid of PROFILE_CLUSTER_CELL_SIZE pixel square cells
+of the Web Mercator world at each zoom level. For every cell, a grid keeps the number of Profile
+and the sum of their coordinates, so the cluster centroid is their average.
+
+Grids are aggregated by the database with GROUP BY on the cell of each location, so only one row
+per non-empty cell leaves the database. Zoom levels up to PROFILE_CLUSTER_CACHE_MAX_ZOOM show most of
+the world at once, and have few cells, so their grids are cached in PROFILE_MAP_CACHE, split into blocks
+of BLOCK_SIZE x BLOCK_SIZE cells. Saving or deleting a Profile only removes the blocks that contain its
+old and new location, and a request aggregates its missing blocks in one query limited to them.
+Higher zoom levels and filtered clusters are aggregated inside the bbox on every request.
+"""
+import math
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.gis.geos import MultiPolygon
+from django.db import connections
+
+from portfolio.geo import bbox_to_polygon
+from portfolio.map_cache import get_cache
+from project.db_router import read_from_primary
+
+TILE_SIZE = 256
+# Web Mercator can not represent the poles, latitude is clamped to this value
+MAX_LATITUDE = 85.0511287798
+# Number of cells on each axis of a cached block, the whole world up to zoom 2 with 64 pixel cells
+BLOCK_SIZE = 16
+# Blocks are widened by this many degrees when aggregated, so rounding never drops a location on their edge.
+# Locations of the neighbour blocks are dropped by their cell afterwards.
+BLOCK_MARGIN = 1e-9
+VERSION_KEY = 'profile-clusters:version'
+
+
+def block_key(zoom, block, version):
+    return 'profile-clusters:v{}:{}:{}/{}'.format(version, zoom, *block)
+
+
+def lonlat_to_cell(lon, lat, zoom):
+    """
+    Get grid cell that contains a coordinate
+    :param lon: longitude
+    :param lat: latitude
+    :param zoom: map zoom level
+    :return: tuple of (column, row) of the cell, counted from top left of the world
+    """
+    cells = cells_per_axis(zoom)
+    lat = max(min(lat, MAX_LATITUDE), -MAX_LATITUDE)
+    x = (lon + 180.0) / 360.0
+    sin_lat = math.sin(math.radians(lat))
+    y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return max(min(int(x * cells), cells - 1), 0), max(min(int(y * cells), cells - 1), 0)
+
+
+def cells_per_axis(zoom):
+    """
+    Number of grid cells on each axis of the world at a zoom level
+    """
+    return max(TILE_SIZE * (2 ** zoom) // settings.PROFILE_CLUSTER_CELL_SIZE, 1)
+
+
+def build_grid(zoom, queryset=None, bbox=None):
+    """
+    Build cluster grid of a zoom level from database
+    :param zoom: map zoom level
+    :param queryset: Profile queryset to be clustered, default is every Profile
+    :param bbox: tuple of (west, south, east, north), only cluster Profile inside it
+    :return: dictionary of {(column, row): (count, sum of longitude, sum of latitude)}
+    """
+    if queryset is None:
+        queryset = apps.get_model('portfolio', 'Profile').objects.all()
+    queryset = queryset.exclude(location=None)
+    if bbox is not None:
+        queryset = queryset.filter(location__intersects=bbox_to_polygon(bbox))
+
+    if connections[queryset.db].vendor == 'postgresql':
+        return build_grid_postgis(zoom, queryset)
+    return build_grid_python(zoom, queryset)
+
+
+def build_grid_postgis(zoom, queryset):
+    # Same cell as lonlat_to_cell, computed for every location and grouped by the database
+    sql = """
+        SELECT col, row_, count(*), sum(lon), sum(lat) FROM (
+            SELECT GREATEST(LEAST(FLOOR((ST_X(location) + 180.0) / 360.0 * %(cells)s), %(cells)s - 1), 0) AS col,
+                   GREATEST(LEAST(FLOOR((0.5 - LN((1 + SIN(lat_)) / (1 - SIN(lat_))) / (4 * PI())) * %(cells)s),
+                                  %(cells)s - 1), 0) AS row_,
+                   ST_X(location) AS lon, ST_Y(location) AS lat
+            FROM (
+                SELECT location, RADIANS(GREATEST(LEAST(ST_Y(location), %(max_lat)s), -%(max_lat)s)) AS lat_
+                FROM {table} WHERE {pk} IN ({subquery})
+            ) AS profile
+        ) AS cell
+        GROUP BY col, row_
+    """
+    Profile = queryset.model
+    connection = connections[queryset.db]
+    subquery, params = queryset.order_by().values('pk').query.sql_with_params()
+    # the subquery has positional parameters, named ones are inlined as they are numbers
+    sql = sql.replace('%(cells)s', str(cells_per_axis(zoom))).replace('%(max_lat)s', repr(MAX_LATITUDE))
+    sql = sql.format(table=connection.ops.quote_name(Profile._meta.db_table),
+                     pk=connection.ops.quote_name(Profile._meta.pk.column), subquery=subquery)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return {(int(column), int(row)): (count, lon, lat) for column, row, count, lon, lat in cursor.fetchall()}
+
+
+def build_grid_python(zoom, queryset):
+    grid = dict()
+    for location in queryset.values_list('location', flat=True).iterator():
+        cell = lonlat_to_cell(location.x, location.y, zoom)
+        count, lon, lat = grid.get(cell, (0, 0.0, 0.0))
+        grid[cell] = (count + 1, lon + location.x, lat + location.y)
+    return grid
+
+
+def get_version():
+    """
+    Get current version of cached grids
+    """
+    map_cache = get_cache()
+    version = map_cache.get(VERSION_KEY)
+    if version is None:
+        # add() does nothing if another process has just set the version
+        map_cache.add(VERSION_KEY, 1, None)
+        version = map_cache.get(VERSION_KEY, 1)
+    return version
+
+
+def cell_to_block(cell):
+    """
+    Get cached block that contains a grid cell
+    :param cell: tuple of (column, row) of the cell
+    :return: tuple of (column, row) of the block
+    """
+    return cell[0] // BLOCK_SIZE, cell[1] // BLOCK_SIZE
+
+
+def block_bbox(zoom, block):
+    """
+    Get bbox that covers every cell of a block
+    :param zoom: map zoom level
+    :param block: tuple of (column, row) of the block
+    :return: tuple of (west, south, east, north)
+    """
+    cells = cells_per_axis(zoom)
+
+    def latitude(row):
+        # first and last rows also contain latitudes beyond MAX_LATITUDE
+        if row <= 0:
+            return 90.0
+        if row >= cells:
+            return -90.0
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2.0 * row / cells))))
+
+    column, row = block[0] * BLOCK_SIZE, block[1] * BLOCK_SIZE
+    return (max(column * 360.0 / cells - 180.0 - BLOCK_MARGIN, -180.0),
+            max(latitude(row + BLOCK_SIZE) - BLOCK_MARGIN, -90.0),
+            min((column + BLOCK_SIZE) * 360.0 / cells - 180.0 + BLOCK_MARGIN, 180.0),
+            min(latitude(row) + BLOCK_MARGIN, 90.0))
+
+
+def build_blocks(zoom, blocks):
+    """
+    Build cluster grids of some blocks of a zoom level with one query
+    :param zoom: map zoom level
+    :param blocks: list of (column, row) of blocks
+    :return: dictionary of {block: grid of the cells inside the block}
+    """
+    area = MultiPolygon([bbox_to_polygon(block_bbox(zoom, block)) for block in blocks], srid=4326)
+    queryset = apps.get_model('portfolio', 'Profile').objects.filter(location__intersects=area)
+
+    grids = {block: dict() for block in blocks}
+    for cell, entry in build_grid(zoom, queryset).items():
+        grid = grids.get(cell_to_block(cell))
+        if grid is not None:
+            grid[cell] = entry
+    return grids
+
+
+def get_blocks(zoom, blocks):
+    """
+    Get cluster grids of some blocks of a zoom level up to PROFILE_CLUSTER_CACHE_MAX_ZOOM, build and cache
+    the ones that do not exist yet
+    :param zoom: map zoom level
+    :param blocks: list of (column, row) of blocks
+    :return: list of grids of the blocks
+    """
+    map_cache = get_cache()
+    version = get_version()
+    keys = {block: block_key(zoom, block, version) for block in blocks}
+    grids = map_cache.get_many(list(keys.values()))
+
+    missing = [block for block in blocks if keys[block] not in grids]
+    if missing:
+        # blocks are shared by every client, so they must not come from a lagging replica
+        with read_from_primary():
+            built = {keys[block]: grid for block, grid in build_blocks(zoom, missing).items()}
+        map_cache.set_many(built, settings.PROFILE_MAP_CACHE_TIMEOUT)
+        grids.update(built)
+    return [grids[keys[block]] for block in blocks]
+
+
+def get_clusters(bbox, zoom, queryset=None):
+    """
+    Get clusters inside a bbox
+    :param bbox: tuple of (west, south, east, north)
+    :param zoom: map zoom level
+    :param queryset: filtered Profile queryset. Clusters of a filtered queryset are aggregated on every
+                     request instead of taken from cache.
+    :return: list of (longitude, latitude, count) of cluster centroids
+    """
+    if queryset is not None or zoom > settings.PROFILE_CLUSTER_CACHE_MAX_ZOOM:
+        grid = build_grid(zoom, queryset, bbox)
+        return [(lon / count, lat / count, count) for count, lon, lat in grid.values()]
+
+    west, south, east, north = bbox
+    min_column, min_row = lonlat_to_cell(west, north, zoom)
+    max_column, max_row = lonlat_to_cell(east, south, zoom)
+    min_block, max_block = cell_to_block((min_column, min_row)), cell_to_block((max_column, max_row))
+    blocks = [(column, row) for column in range(min_block[0], max_block[0] + 1)
+              for row in range(min_block[1], max_block[1] + 1)]
+
+    return [(lon / count, lat / count, count)
+            for grid in get_blocks(zoom, blocks)
+            for cell, (count, lon, lat) in grid.items()
+            if min_column <= cell[0] <= max_column and min_row <= cell[1] <= max_row]
+
+
+def invalidate_location(location):
+    """
+    Remove cached blocks that contain a location, e.g. the old and new location of a moved Profile
+    :param location: Point in EPSG:4326
+    """
+    version = get_version()
+    keys = [block_key(zoom, cell_to_block(lonlat_to_cell(location.x, location.y, zoom)), version)
+            for zoom in range(settings.PROFILE_CLUSTER_CACHE_MAX_ZOOM + 1)]
+    get_cache().delete_many(keys)
+
+
+def invalidate_clusters():
+    """
+    Make every process rebuild cached blocks, e.g. after many Profile are imported
+    """
+    map_cache = get_cache()
+    try:
+        map_cache.incr(VERSION_KEY)
+    except ValueError:
+        # version does not exist yet, nothing is cached with it
+        map_cache.add(VERSION_KEY, 1, None)
@@ -0,0 +1,147 @@
+"""
+Streaming export of Profile as GeoJSON, CSV or FlatGeobuf.
+
+Profile are read with QuerySet.iterator(), so only one chunk of rows is in memory at a time, and every
+format is written as a generator of chunks, to be sent with StreamingHttpResponse or written to a file.
+"""
+import csv
+import json
+from itertools import islice
+
+from django.apps import apps
+from django.contrib.gis.db.models.functions import GeoHash
+from django.db import connections
+
+from portfolio import flatgeobuf
+from portfolio.geo import bbox_to_polygon
+
+FORMATS = {
+    'geojson': 'application/geo+json',
+    'csv': 'text/csv',
+    'fgb': 'application/octet-stream',
+}
+# Exported Profile fields, with their FlatGeobuf column type
+FIELDS = (
+    ('id', flatgeobuf.LONG),
+    ('first_name', flatgeobuf.STRING),
+    ('last_name', flatgeobuf.STRING),
+    ('email', flatgeobuf.STRING),
+    ('phone', flatgeobuf.STRING),
+    ('address', flatgeobuf.STRING),
+    ('expertise', flatgeobuf.STRING),
+)
+LAYER_NAME = 'profiles'
+# Number of rows written per yielded chunk of GeoJSON and CSV
+ROWS_PER_CHUNK = 100
+
+
+def export_queryset(bbox=None, expertise=None, spatial_order=False):
+    """
+    Get Profile to export
+    :param bbox: tuple of (west, south, east, north), only export Profile inside it
+    :param expertise: list of Expertise id, only export Profile which has any of them
+    :param spatial_order: sort Profile by geohash, so nearby Profile are next to each other
+    """
+    Profile = apps.get_model('portfolio', 'Profile')
+    queryset = Profile.objects.exclude(location=None)
+    if bbox is not None:
+        queryset = queryset.filter(location__intersects=bbox_to_polygon(bbox))
+    if expertise:
+        queryset = queryset.with_expertise(expertise)
+
+    queryset = queryset.map_listing()
+    if spatial_order and 'GeoHash' not in connections[queryset.db].ops.unsupported_functions:
+        return queryset.annotate(geohash=GeoHash('location')).order_by('geohash', 'pk')
+    return queryset.order_by('pk')
+
+
+def iter_rows(queryset, chunk_size=2000):
+    """
+    Read exported Profile as dictionaries
+    :param queryset: QuerySet from export_queryset()
+    :param chunk_size: number of rows fetched from database at once
+    :return: generator of (lon, lat, properties dictionary)
+    """
+    Profile = apps.get_model('portfolio', 'Profile')
+    profiles = queryset.iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(profiles, chunk_size))
+        if not chunk:
+            return
+
+        if not hasattr(chunk[0], 'expertise_names'):
+            # iterator() does not prefetch, so get Expertise names of the whole chunk in one query
+            names = {}
+            rows = (Profile.expertise.through.objects.filter(profile_id__in=[profile.pk for profile in chunk])
+                    .order_by('expertise__name').values_list('profile_id', 'expertise__name'))
+            for profile_id, name in rows:
+                names.setdefault(profile_id, []).append(name)
+            for profile in chunk:
+                profile.expertise_names = ', '.join(names.get(profile.pk, []))
+
+        for profile in chunk:
+            yield profile.location.x, profile.location.y, {
+                'id': profile.pk,
+                'first_name': profile.first_name,
+                'last_name': profile.last_name,
+                'email': profile.user.email,
+                'phone': str(profile.phone),
+                'address': profile.address,
+                'expertise': profile.expertise_names or '',
+            }
+
+
+def write_geojson(rows):
+    """
+    Write rows as GeoJSON FeatureCollection, one chunk of Features at a time
+    """
+    yield '{"type": "FeatureCollection", "features": ['
+    separator = ''
+    while True:
+        features = [json.dumps({
+            'type': 'Feature',
+            'id': properties['id'],
+            'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+            'properties': properties,
+        }) for lon, lat, properties in islice(rows, ROWS_PER_CHUNK)]
+        if not features:
+            break
+        yield separator + ',\n'.join(features)
+        separator = ',\n'
+    yield ']}\n'
+
+
+class Echo(object):
+    """
+    File-like object that returns what is written, so csv.writer can write to a generator
+    """
+
+    def write(self, value):
+        return value
+
+
+def write_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow([field for field, field_type in FIELDS] + ['lon', 'lat'])
+    while True:
+        lines = [writer.writerow([properties[field] for field, field_type in FIELDS] + [lon, lat])
+                 for lon, lat, properties in islice(rows, ROWS_PER_CHUNK)]
+        if not lines:
+            return
+        yield ''.join(lines)
+
+
+def write_flatgeobuf(rows):
+    return flatgeobuf.write_flatgeobuf(LAYER_NAME, FIELDS, rows)
+
+
+def export(export_format, bbox=None, expertise=None, chunk_size=2000):
+    """
+    Export Profile in a format
+    :param export_format: key of FORMATS
+    :return: generator of str (GeoJSON and CSV) or bytes (FlatGeobuf) chunks
+    """
+    queryset = export_queryset(bbox, expertise, spatial_order=export_format == 'fgb')
+    rows = iter_rows(queryset, chunk_size)
+    writer = {'geojson': write_geojson, 'csv': write_csv, 'fgb': write_flatgeobuf}[export_format]
+    return writer(rows)
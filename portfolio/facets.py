@@ -0,0 +1,108 @@
+"""
+Per-Expertise Profile counts for the map viewport.
+
+ExpertiseCount keeps the number of Profile per Expertise in each cell of the tile grid at the zoom
+levels of PROFILE_FACET_ZOOMS. Signal receivers update it incrementally, so the counts of a viewport
+are a sum over a few rows instead of a COUNT(*) over the Profile-Expertise join table.
+
+Counts are per cell, so cells on the edge of the viewport are counted whole. The finest zoom level that
+covers the viewport with at most PROFILE_FACET_MAX_CELLS cells is used, which keeps that error small.
+"""
+from collections import Counter
+from functools import reduce
+from operator import or_
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q, Sum
+
+from portfolio.tiles import lonlat_to_tile
+
+
+def location_cells(location):
+    """
+    Get cells that contain a location at every zoom level
+    :return: list of (zoom, x, y)
+    """
+    return [(zoom,) + lonlat_to_tile(location.x, location.y, zoom) for zoom in settings.PROFILE_FACET_ZOOMS]
+
+
+def update_counts(expertise_ids, location, delta):
+    """
+    Add delta to count of Expertise in the cells that contain a location
+    :param expertise_ids: list of Expertise id
+    :param location: Point in EPSG:4326, nothing is counted if None
+    :param delta: 1 when Profile is added, -1 when Profile is removed
+    """
+    if not expertise_ids or location is None:
+        return
+
+    ExpertiseCount = apps.get_model('portfolio', 'ExpertiseCount')
+    cells = location_cells(location)
+    with transaction.atomic():
+        if delta > 0:
+            # make sure every row exists, so one UPDATE is enough
+            ExpertiseCount.objects.bulk_create([
+                ExpertiseCount(expertise_id=expertise_id, zoom=zoom, x=x, y=y, count=0)
+                for expertise_id in expertise_ids for zoom, x, y in cells
+            ], ignore_conflicts=True)
+
+        in_cells = reduce(or_, (Q(zoom=zoom, x=x, y=y) for zoom, x, y in cells))
+        ExpertiseCount.objects.filter(in_cells, expertise_id__in=expertise_ids).update(count=F('count') + delta)
+
+
+def move_profile(expertise_ids, old_location, new_location):
+    """
+    Move counts of a Profile's Expertise when the Profile moves
+    """
+    update_counts(expertise_ids, old_location, -1)
+    update_counts(expertise_ids, new_location, 1)
+
+
+def facet_zoom(bbox):
+    """
+    Get the finest zoom level which covers bbox with at most PROFILE_FACET_MAX_CELLS cells
+    :return: tuple of (zoom, min x, min y, max x, max y)
+    """
+    west, south, east, north = bbox
+    zooms = sorted(settings.PROFILE_FACET_ZOOMS)
+    for zoom in reversed(zooms):
+        min_x, min_y = lonlat_to_tile(west, north, zoom)
+        max_x, max_y = lonlat_to_tile(east, south, zoom)
+        if (max_x - min_x + 1) * (max_y - min_y + 1) <= settings.PROFILE_FACET_MAX_CELLS or zoom == zooms[0]:
+            return zoom, min_x, min_y, max_x, max_y
+
+
+def get_counts(bbox):
+    """
+    Get number of Profile per Expertise inside bbox
+    :param bbox: tuple of (west, south, east, north)
+    :return: dictionary of {Expertise id: count}, without Expertise that has no Profile
+    """
+    ExpertiseCount = apps.get_model('portfolio', 'ExpertiseCount')
+    zoom, min_x, min_y, max_x, max_y = facet_zoom(bbox)
+    counts = (ExpertiseCount.objects.filter(zoom=zoom, x__range=(min_x, max_x), y__range=(min_y, max_y))
+              .values('expertise_id').annotate(total=Sum('count')).filter(total__gt=0))
+    return {row['expertise_id']: row['total'] for row in counts}
+
+
+def rebuild_counts(batch_size=10000):
+    """
+    Rebuild every count from the join table, e.g. after Profile is imported in bulk without sending signals
+    """
+    ExpertiseCount = apps.get_model('portfolio', 'ExpertiseCount')
+    Profile = apps.get_model('portfolio', 'Profile')
+
+    counts = Counter()
+    rows = (Profile.expertise.through.objects.exclude(profile__location=None)
+            .values_list('expertise_id', 'profile__location').iterator())
+    for expertise_id, location in rows:
+        for cell in location_cells(location):
+            counts[(expertise_id,) + cell] += 1
+
+    with transaction.atomic():
+        ExpertiseCount.objects.all().delete()
+        ExpertiseCount.objects.bulk_create((ExpertiseCount(expertise_id=expertise_id, zoom=zoom, x=x, y=y, count=count)
+                                            for (expertise_id, zoom, x, y), count in counts.items()),
+                                           batch_size=batch_size)
@@ -0,0 +1,274 @@
+"""
+Minimal FlatGeobuf writer for point layers, with packed R-tree spatial index.
+
+Features are encoded one by one into a temporary file together with their index node, so memory use does not
+depend on the number of features. The index must be written before the features, so the file is only yielded
+after every feature is encoded. The index is valid for any feature order, but searching it is faster when
+features are sorted along a space-filling curve, e.g. by geohash.
+
+See https://github.com/flatgeobuf/flatgeobuf/tree/master/src/fbs for the schema.
+"""
+import math
+import struct
+import tempfile
+
+MAGIC = b'fgb\x03fgb\x00'
+INDEX_NODE_SIZE = 16
+NODE_ITEM = struct.Struct('<ddddQ')
+CHUNK_SIZE = 64 * 1024
+# Temporary files are kept in memory until they are bigger than this, in bytes
+SPOOL_SIZE = 8 * 1024 * 1024
+
+# GeometryType
+POINT = 1
+
+# ColumnType
+LONG = 7
+DOUBLE = 10
+STRING = 11
+
+# FlatBuffers field types, as (struct format, size)
+SCALARS = {
+    'bool': ('<?', 1),
+    'ubyte': ('<B', 1),
+    'ushort': ('<H', 2),
+    'int': ('<i', 4),
+    'uint': ('<I', 4),
+    'ulong': ('<Q', 8),
+    'double': ('<d', 8),
+}
+
+
+class FlatBufferWriter(object):
+    """
+    Writes a FlatBuffer front to back: every table is preceded by its vtable and followed by
+    the strings, vectors and tables it refers to, so every offset points forward.
+
+    A table is a list of (field index, type, value), where type is a key of SCALARS, 'string', 'table',
+    'bytes', '[table]' or '[<scalar type>]'. Fields with None value are left out.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def finish(self, table):
+        """
+        :return: FlatBuffer bytes with the table as root
+        """
+        self.buffer += b'\0' * 4
+        struct.pack_into('<I', self.buffer, 0, self.write_table(table))
+        return bytes(self.buffer)
+
+    def pad(self, alignment, extra=0):
+        """
+        Pad buffer so that position + extra is a multiple of alignment
+        """
+        self.buffer += b'\0' * (-(len(self.buffer) + extra) % alignment)
+
+    def write_table(self, fields):
+        fields = sorted((field for field in fields if field[2] is not None), key=lambda field: field[0])
+        vtable_size = 4 + 2 * (fields[-1][0] + 1 if fields else 0)
+
+        # inline fields, biggest first so they need no padding
+        inline = sorted(fields, key=lambda field: -SCALARS.get(field[1], (None, 4))[1])
+        alignment = max([SCALARS.get(field[1], (None, 4))[1] for field in inline] + [4])
+
+        self.pad(2)
+        vtable_position = len(self.buffer)
+        self.buffer += b'\0' * vtable_size
+        self.pad(alignment)
+        table_position = len(self.buffer)
+        self.buffer += struct.pack('<i', table_position - vtable_position)
+
+        field_offsets = {}
+        references = []
+        for index, field_type, value in inline:
+            fmt, size = SCALARS.get(field_type, ('<I', 4))
+            self.pad(size)
+            field_offsets[index] = len(self.buffer) - table_position
+            if field_type in SCALARS:
+                self.buffer += struct.pack(fmt, value)
+            else:
+                references.append((len(self.buffer), field_type, value))
+                self.buffer += b'\0' * 4
+
+        struct.pack_into('<HH', self.buffer, vtable_position, vtable_size, len(self.buffer) - table_position)
+        for index, offset in field_offsets.items():
+            struct.pack_into('<H', self.buffer, vtable_position + 4 + 2 * index, offset)
+
+        for position, field_type, value in references:
+            self.write_reference(position, self.write_object(field_type, value))
+        return table_position
+
+    def write_reference(self, position, target):
+        struct.pack_into('<I', self.buffer, position, target - position)
+
+    def write_object(self, field_type, value):
+        """
+        Write string, vector or table, and return its position
+        """
+        if field_type == 'table':
+            return self.write_table(value)
+
+        if field_type == 'string':
+            value = value.encode('utf-8')
+        if field_type in ('string', 'bytes'):
+            self.pad(4)
+            position = len(self.buffer)
+            self.buffer += struct.pack('<I', len(value)) + value
+            if field_type == 'string':
+                self.buffer += b'\0'
+            return position
+
+        element_type = field_type[1:-1]
+        if element_type == 'table':
+            self.pad(4)
+            position = len(self.buffer)
+            self.buffer += struct.pack('<I', len(value)) + b'\0' * 4 * len(value)
+            for i, table in enumerate(value):
+                self.write_reference(position + 4 + 4 * i, self.write_table(table))
+            return position
+
+        fmt, size = SCALARS[element_type]
+        # elements must be aligned, they start right after the length
+        self.pad(max(size, 4), extra=4)
+        position = len(self.buffer)
+        self.buffer += struct.pack('<I{}{}'.format(len(value), fmt[1]), len(value), *value)
+        return position
+
+
+def encode_header(name, columns, envelope, features_count, index_node_size=INDEX_NODE_SIZE):
+    """
+    :param columns: list of (name, ColumnType)
+    :param envelope: (min x, min y, max x, max y) of every feature, None if there is no feature
+    """
+    return FlatBufferWriter().finish([
+        (0, 'string', name),
+        (1, '[double]', list(envelope) if envelope else None),
+        (2, 'ubyte', POINT),
+        (7, '[table]', [[(0, 'string', column), (1, 'ubyte', column_type)] for column, column_type in columns]),
+        (8, 'ulong', features_count),
+        (9, 'ushort', index_node_size),
+        (10, 'table', [(0, 'string', 'EPSG'), (1, 'int', 4326)]),
+    ])
+
+
+def encode_properties(columns, properties):
+    """
+    Encode properties as a sequence of column index and value, None values are left out
+    """
+    data = bytearray()
+    for index, (column, column_type) in enumerate(columns):
+        value = properties.get(column)
+        if value is None:
+            continue
+        data += struct.pack('<H', index)
+        if column_type == STRING:
+            value = str(value).encode('utf-8')
+            data += struct.pack('<I', len(value)) + value
+        elif column_type == LONG:
+            data += struct.pack('<q', value)
+        else:
+            data += struct.pack('<d', value)
+    return bytes(data)
+
+
+def encode_feature(columns, x, y, properties):
+    return FlatBufferWriter().finish([
+        (0, 'table', [(1, '[double]', [x, y])]),
+        (1, 'bytes', encode_properties(columns, properties)),
+    ])
+
+
+def level_bounds(count, node_size):
+    """
+    Get position of every level of packed R-tree, leaves first, as list of (start, end) node index.
+    The root is the first node.
+    """
+    n = count
+    level_sizes = [n]
+    while True:
+        n = int(math.ceil(n / node_size))
+        level_sizes.append(n)
+        if n == 1:
+            break
+
+    bounds = []
+    end = sum(level_sizes)
+    for size in level_sizes:
+        bounds.append((end - size, end))
+        end -= size
+    return bounds
+
+
+def build_parent_level(children, child_start, child_end, node_size, output):
+    """
+    Write nodes of the level above children, each covering node_size children
+    :param children: file with the child nodes
+    :param child_start: node index of the first child
+    """
+    children.seek(0)
+    position = child_start
+    while position < child_end:
+        first = position
+        min_x = min_y = math.inf
+        max_x = max_y = -math.inf
+        for _ in range(min(node_size, child_end - position)):
+            node_min_x, node_min_y, node_max_x, node_max_y, _ = NODE_ITEM.unpack(children.read(NODE_ITEM.size))
+            min_x, min_y = min(min_x, node_min_x), min(min_y, node_min_y)
+            max_x, max_y = max(max_x, node_max_x), max(max_y, node_max_y)
+            position += 1
+        output.write(NODE_ITEM.pack(min_x, min_y, max_x, max_y, first))
+
+
+def copy_chunks(f):
+    f.seek(0)
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def write_flatgeobuf(name, columns, features, index_node_size=INDEX_NODE_SIZE):
+    """
+    Encode point features as FlatGeobuf
+    :param name: layer name
+    :param columns: list of (name, ColumnType)
+    :param features: iterable of (x, y, properties dictionary)
+    :return: generator of bytes chunks
+    """
+    with tempfile.SpooledTemporaryFile(SPOOL_SIZE) as feature_file, \
+            tempfile.SpooledTemporaryFile(SPOOL_SIZE) as leaf_file:
+        count = 0
+        offset = 0
+        min_x = min_y = math.inf
+        max_x = max_y = -math.inf
+        for x, y, properties in features:
+            feature = encode_feature(columns, x, y, properties)
+            feature_file.write(struct.pack('<I', len(feature)) + feature)
+            leaf_file.write(NODE_ITEM.pack(x, y, x, y, offset))
+            offset += 4 + len(feature)
+            count += 1
+            min_x, min_y, max_x, max_y = min(min_x, x), min(min_y, y), max(max_x, x), max(max_y, y)
+
+        envelope = (min_x, min_y, max_x, max_y) if count else None
+        header = encode_header(name, columns, envelope, count, index_node_size if count else 0)
+        yield MAGIC + struct.pack('<I', len(header)) + header
+
+        if count:
+            # build the tree bottom-up, each level in its own file, then write it top-down
+            levels = [leaf_file]
+            bounds = level_bounds(count, index_node_size)
+            for (child_start, child_end), _ in zip(bounds, bounds[1:]):
+                parent_file = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+                build_parent_level(levels[-1], child_start, child_end, index_node_size, parent_file)
+                levels.append(parent_file)
+            try:
+                for level in reversed(levels):
+                    yield from copy_chunks(level)
+            finally:
+                for level in levels[1:]:
+                    level.close()
+
+        yield from copy_chunks(feature_file)
@@ -0,0 +1,122 @@
+import math
+
+from django.contrib.gis.geos import Polygon
+
+# Valid range of longitude and latitude in WGS84 (EPSG:4326)
+WORLD_BOUNDS = (-180.0, -90.0, 180.0, 90.0)
+MAX_ZOOM = 22
+# Earth radius used by PostGIS ST_DistanceSphere, in metres
+EARTH_RADIUS = 6370986.0
+
+
+def parse_bbox(value):
+    """
+    Parse bbox query parameter sent by Leaflet `map.getBounds().toBBoxString()`
+    :param value: string with format 'west,south,east,north'
+    :return: tuple of (west, south, east, north), clamped to WORLD_BOUNDS
+    """
+    if not value:
+        return WORLD_BOUNDS
+
+    try:
+        west, south, east, north = [float(coord) for coord in value.split(',')]
+    except ValueError:
+        raise ValueError('bbox must be 4 comma-separated numbers: west,south,east,north')
+
+    if not all(math.isfinite(coord) for coord in (west, south, east, north)):
+        raise ValueError('bbox must be finite numbers')
+
+    if west > east or south > north:
+        raise ValueError('bbox must be ordered as west,south,east,north')
+
+    # Leaflet keeps counting longitude past the antimeridian when user pans around the world,
+    # so a viewport wider than the world simply means the whole world.
+    if east - west >= 360:
+        west, east = WORLD_BOUNDS[0], WORLD_BOUNDS[2]
+
+    west, south = max(west, WORLD_BOUNDS[0]), max(south, WORLD_BOUNDS[1])
+    east, north = min(east, WORLD_BOUNDS[2]), min(north, WORLD_BOUNDS[3])
+    # a bbox entirely outside of the world is inverted by clamping
+    if west > east or south > north:
+        raise ValueError('bbox must be inside of the world')
+    return west, south, east, north
+
+
+def parse_zoom(value, default=0):
+    """
+    Parse zoom query parameter
+    :param value: string containing map zoom level
+    :param default: zoom level used when value is empty
+    :return: zoom level as integer between 0 and MAX_ZOOM
+    """
+    if not value:
+        return default
+
+    try:
+        zoom = int(value)
+    except ValueError:
+        raise ValueError('zoom must be an integer')
+
+    if not 0 <= zoom <= MAX_ZOOM:
+        raise ValueError('zoom must be between 0 and {}'.format(MAX_ZOOM))
+    return zoom
+
+
+def parse_expertise(value):
+    """
+    Parse expertise query parameter
+    :param value: comma-separated Expertise id
+    :return: list of Expertise id
+    """
+    if not value:
+        return []
+
+    try:
+        return [int(expertise_id) for expertise_id in value.split(',')]
+    except ValueError:
+        raise ValueError('expertise must be comma-separated Expertise id')
+
+
+def bbox_to_polygon(bbox):
+    """
+    Convert bbox tuple to Polygon, to be used as spatial filter
+    :param bbox: tuple of (west, south, east, north)
+    :return: Polygon in EPSG:4326
+    """
+    polygon = Polygon.from_bbox(bbox)
+    polygon.srid = 4326
+    return polygon
+
+
+def sphere_distance(lon1, lat1, lon2, lat2):
+    """
+    Great-circle distance between two coordinates, the same distance as PostGIS ST_DistanceSphere
+    :return: distance in metres
+    """
+    lon1, lat1, lon2, lat2 = map(math.radians, (lon1, lat1, lon2, lat2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(math.sqrt(a), 1.0))
+
+
+def distance_bbox(lon, lat, distance):
+    """
+    Get bbox that contains every coordinate within a distance from a coordinate.
+    Used to let spatial index filter the rows before the exact (and slow) distance is calculated.
+    :param lon: longitude of the center
+    :param lat: latitude of the center
+    :param distance: distance in metres
+    :return: tuple of (west, south, east, north)
+    """
+    lat_delta = math.degrees(distance / EARTH_RADIUS)
+    south, north = lat - lat_delta, lat + lat_delta
+    if south <= WORLD_BOUNDS[1] or north >= WORLD_BOUNDS[3]:
+        # circle contains a pole, so it covers every longitude
+        return WORLD_BOUNDS[0], max(south, WORLD_BOUNDS[1]), WORLD_BOUNDS[2], min(north, WORLD_BOUNDS[3])
+
+    # longitude degree gets shorter towards the poles, the widest part of the circle is at its highest latitude
+    lon_delta = math.degrees(distance / (EARTH_RADIUS * math.cos(math.radians(max(abs(south), abs(north))))))
+    west, east = lon - lon_delta, lon + lon_delta
+    if west < WORLD_BOUNDS[0] or east > WORLD_BOUNDS[2]:
+        # circle crosses the antimeridian
+        west, east = WORLD_BOUNDS[0], WORLD_BOUNDS[2]
+    return west, south, east, north
@@ -0,0 +1,395 @@
+"""
+Bulk import of users and their Profile, used by `manage.py import_profiles`.
+
+Input is read as a stream of records (CSV rows, GeoJSON Features or GeoPackage rows), so memory use does not
+grow with the file. Records are upserted on email in batches with bulk_create and bulk_update, without sending
+signals, so clusters, tiles, map cache and Expertise counts are refreshed once at the end.
+
+Record fields:
+    email      -- required, existing user with the same email is updated
+    username   -- default is the email
+    first_name, last_name, phone, address
+    expertise  -- Expertise names, separated by comma or semicolon (or a list in GeoJSON)
+    lon, lat   -- location in EPSG:4326 (or longitude, latitude), taken from geometry in GeoJSON and GeoPackage
+Fields that are not in the input are left unchanged on existing Profile.
+"""
+import csv
+import json
+import re
+import sqlite3
+import uuid
+from collections import OrderedDict
+
+from django.apps import apps
+from django.contrib.auth.hashers import make_password
+from django.contrib.gis.geos import GEOSGeometry, Point
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.utils import timezone
+from phonenumber_field.phonenumber import to_python as to_phone_number
+
+from portfolio import clustering, facets, map_cache, search, tiles
+from portfolio.geo import WORLD_BOUNDS
+from users import permissions
+from users.models import CustomUser
+
+FORMATS = ('csv', 'geojson', 'gpkg')
+# Text fields of a record and their maximum length
+TEXT_FIELDS = (('username', 150), ('first_name', 20), ('last_name', 20), ('address', 100), ('phone', 15))
+PROFILE_FIELDS = ('first_name', 'last_name', 'phone', 'address', 'location')
+EXPERTISE_SEPARATOR = re.compile(r'[,;]')
+EXPERTISE_MAX_LENGTH = 15
+
+
+def guess_format(path):
+    """
+    Guess input format from file extension
+    """
+    extension = path.rsplit('.', 1)[-1].lower()
+    extension = {'json': 'geojson', 'geopackage': 'gpkg'}.get(extension, extension)
+    if extension not in FORMATS:
+        raise ValueError('Unknown format of {}, use one of: {}'.format(path, ', '.join(FORMATS)))
+    return extension
+
+
+def read_records(path, input_format, layer=None):
+    """
+    Read records from a file
+    :param path: file path
+    :param input_format: 'csv', 'geojson' or 'gpkg'
+    :param layer: GeoPackage table, default is the first feature table
+    :return: iterator of record dictionary
+    """
+    if input_format == 'csv':
+        return read_csv(path)
+    if input_format == 'geojson':
+        return read_geojson(path)
+    return read_geopackage(path, layer)
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        yield from csv.DictReader(f)
+
+
+def read_geojson(path, chunk_size=64 * 1024):
+    """
+    Read GeoJSON Features one by one, without loading the whole FeatureCollection
+    """
+    decoder = json.JSONDecoder()
+    features_start = re.compile(r'"features"\s*:\s*\[')
+    separator = re.compile(r'[\s,]*')
+
+    with open(path, encoding='utf-8-sig') as f:
+        buffer = ''
+        match = None
+        while match is None:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise ValueError('GeoJSON has no "features" array')
+            buffer += chunk
+            match = features_start.search(buffer)
+        position = match.end()
+
+        while True:
+            position = separator.match(buffer, position).end()
+            if buffer.startswith(']', position):
+                return
+            try:
+                feature, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                # Feature continues in the next chunk
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    raise ValueError('GeoJSON ends inside a Feature')
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+            position = end
+            yield feature_to_record(feature)
+
+
+def feature_to_record(feature):
+    """
+    Convert GeoJSON Feature to record, its geometry is kept as dictionary until the record is cleaned
+    """
+    record = dict(feature.get('properties') or {})
+    record['location'] = feature.get('geometry')
+    return record
+
+
+def read_geopackage(path, layer=None):
+    """
+    Read rows of a GeoPackage feature table with Python sqlite3, so GDAL is not needed
+    """
+    connection = sqlite3.connect(path)
+    try:
+        table = connection.execute(
+            "SELECT c.table_name, g.column_name, g.srs_id FROM gpkg_contents c "
+            "JOIN gpkg_geometry_columns g ON g.table_name = c.table_name "
+            "WHERE c.data_type = 'features' AND (? IS NULL OR c.table_name = ?) ORDER BY c.table_name",
+            (layer, layer)).fetchone()
+        if table is None:
+            raise ValueError('GeoPackage has no feature table {}'.format(layer or ''))
+        table_name, geometry_column, srid = table
+
+        cursor = connection.execute('SELECT * FROM "{}"'.format(table_name.replace('"', '""')))
+        columns = [column[0] for column in cursor.description]
+        for row in cursor:
+            record = dict(zip(columns, row))
+            record['location'] = geopackage_geometry(record.pop(geometry_column), srid)
+            yield record
+    finally:
+        connection.close()
+
+
+def geopackage_geometry(blob, srid):
+    """
+    Convert GeoPackage geometry blob to geometry in EPSG:4326
+    :param blob: GeoPackage binary geometry, a header followed by WKB
+    :param srid: SRS id of the geometry column
+    :return: GEOSGeometry, or None if the geometry is empty
+    """
+    if blob is None:
+        return None
+    if blob[:2] != b'GP':
+        raise ValueError('GeoPackage geometry is corrupted')
+
+    flags = blob[3]
+    if flags & 0b10000:
+        # empty geometry
+        return None
+    envelope_size = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}[(flags >> 1) & 0b111]
+    geometry = GEOSGeometry(memoryview(blob[8 + envelope_size:]), srid=srid)
+    if srid != 4326:
+        geometry.transform(4326)
+    return geometry
+
+
+def clean_record(record):
+    """
+    Validate a record and keep only the known fields
+    :return: cleaned record dictionary
+    :raise ValueError: if the record is invalid
+    """
+    email = str(record.get('email') or '').strip()
+    try:
+        validate_email(email)
+    except ValidationError:
+        raise ValueError('invalid email: "{}"'.format(email))
+    cleaned = {'email': email}
+
+    for field, max_length in TEXT_FIELDS:
+        if field in record:
+            value = str(record[field] or '').strip()
+            if len(value) > max_length:
+                raise ValueError('{} is longer than {} characters'.format(field, max_length))
+            cleaned[field] = value
+
+    if cleaned.get('phone'):
+        phone = to_phone_number(cleaned['phone'])
+        if not phone or not phone.is_valid():
+            raise ValueError('invalid phone number: "{}"'.format(cleaned['phone']))
+
+    if 'expertise' in record:
+        names = record['expertise'] or []
+        if isinstance(names, str):
+            names = EXPERTISE_SEPARATOR.split(names)
+        names = [name.strip() for name in names if name and name.strip()]
+        for name in names:
+            if len(name) > EXPERTISE_MAX_LENGTH:
+                raise ValueError('expertise "{}" is longer than {} characters'.format(name, EXPERTISE_MAX_LENGTH))
+        cleaned['expertise'] = list(OrderedDict.fromkeys(names))
+
+    if 'location' in record:
+        cleaned['location'] = parse_geometry(record['location'])
+    else:
+        lon, lat = record.get('lon', record.get('longitude')), record.get('lat', record.get('latitude'))
+        if lon is not None or lat is not None:
+            cleaned['location'] = parse_lonlat(lon, lat)
+
+    return cleaned
+
+
+def parse_geometry(geometry):
+    """
+    Get Profile location from record geometry
+    :param geometry: GeoJSON geometry dictionary, GEOSGeometry or None
+    :return: Point or None
+    """
+    if geometry is None:
+        return None
+    geom_type = geometry.get('type') if isinstance(geometry, dict) else geometry.geom_type
+    if geom_type != 'Point':
+        raise ValueError('geometry must be a Point, not {}'.format(geom_type))
+    if isinstance(geometry, dict):
+        return parse_lonlat(*(list(geometry.get('coordinates') or []) + [None, None])[:2])
+    return geometry
+
+
+def parse_lonlat(lon, lat):
+    if lon in (None, '') and lat in (None, ''):
+        return None
+    try:
+        lon, lat = float(lon), float(lat)
+    except (TypeError, ValueError):
+        raise ValueError('lon and lat must be numbers')
+    if not (WORLD_BOUNDS[0] <= lon <= WORLD_BOUNDS[2] and WORLD_BOUNDS[1] <= lat <= WORLD_BOUNDS[3]):
+        raise ValueError('lon and lat are out of range')
+    return Point(lon, lat, srid=4326)
+
+
+class ProfileImporter(object):
+    """
+    Upsert users and Profile in batches
+    """
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+        self.expertise_ids = {}
+
+    def run(self, records, on_error=None):
+        """
+        Import records
+        :param records: iterator of record dictionary, e.g. from read_records()
+        :param on_error: function called with record number and error message of every invalid record
+        """
+        batch = []
+        try:
+            for number, record in enumerate(records, 1):
+                try:
+                    batch.append(clean_record(record))
+                except ValueError as e:
+                    self.failed += 1
+                    if on_error is not None:
+                        on_error(number, str(e))
+                    continue
+
+                if len(batch) >= self.batch_size:
+                    self.import_batch(batch)
+                    batch = []
+            if batch:
+                self.import_batch(batch)
+        finally:
+            # batches that were committed before a failure (e.g. a truncated file) are kept, so refresh them too
+            if self.created or self.updated:
+                self.refresh()
+
+    @transaction.atomic
+    def import_batch(self, records):
+        """
+        Upsert a batch of cleaned records. When an email appears more than once, its last record wins.
+        """
+        Profile = apps.get_model('portfolio', 'Profile')
+        records = list(OrderedDict((record['email'], record) for record in records).values())
+        users = dict(CustomUser.objects.filter(email__in=[record['email'] for record in records])
+                     .values_list('email', 'pk'))
+
+        new_records = [record for record in records if record['email'] not in users]
+        self.update_user_names([record for record in records if record['email'] in users], users)
+        if new_records:
+            users.update(self.create_users(new_records))
+
+        profile_ids = dict(Profile.objects.filter(user_id__in=users.values()).values_list('user_id', 'pk'))
+        # updated Profile are grouped by the fields of their record, {fields: [Profile]}, because bulk_update
+        # writes the same fields on every Profile and other fields must be left unchanged
+        new_profiles, updated_profiles = [], OrderedDict()
+        now = timezone.now()
+        for record in records:
+            values = {field: record[field] for field in PROFILE_FIELDS if field in record}
+            profile = Profile(user_id=users[record['email']], **values)
+            if profile.user_id in profile_ids:
+                profile.pk, profile.updated_at = profile_ids[profile.user_id], now
+                updated_profiles.setdefault(tuple(sorted(values)), []).append(profile)
+            else:
+                new_profiles.append(profile)
+
+        Profile.objects.bulk_create(new_profiles)
+        for fields, profiles in updated_profiles.items():
+            if fields:
+                Profile.objects.bulk_update(profiles, list(fields) + ['updated_at'])
+        if new_profiles:
+            profile_ids.update(Profile.objects.filter(user_id__in=[profile.user_id for profile in new_profiles])
+                               .values_list('user_id', 'pk'))
+
+        self.set_expertise([(profile_ids[users[record['email']]], record['expertise'])
+                            for record in records if 'expertise' in record])
+        search.update_search_vectors(Profile.objects.filter(pk__in=[profile_ids[users[record['email']]]
+                                                                    for record in records]))
+        self.created += len(new_profiles)
+        self.updated += sum(len(profiles) for profiles in updated_profiles.values())
+
+    def create_users(self, records):
+        """
+        Create users with unusable password (they set it with password reset) and the default permission
+        :return: dictionary of {email: user id}
+        """
+        usernames = [record.get('username') or record['email'] for record in records]
+        taken = set(CustomUser.objects.filter(username__in=usernames).values_list('username', flat=True))
+        users = []
+        for record, username in zip(records, usernames):
+            if username in taken:
+                username = '{}-{}'.format(username[:140], uuid.uuid4().hex[:8])
+            taken.add(username)
+            users.append(CustomUser(username=username, email=record['email'], password=make_password(None),
+                                    first_name=record.get('first_name', ''), last_name=record.get('last_name', '')))
+        CustomUser.objects.bulk_create(users)
+
+        # bulk_create does not set id on every database, so get them by email
+        user_ids = dict(CustomUser.objects.filter(email__in=[record['email'] for record in records])
+                        .values_list('email', 'pk'))
+        permissions.add_default_permission(user_ids.values())
+        return user_ids
+
+    def update_user_names(self, records, users):
+        """
+        Keep user name the same as Profile name, like Profile post_save does
+        """
+        for field in ('first_name', 'last_name'):
+            changed = [CustomUser(pk=users[record['email']], **{field: record[field]})
+                       for record in records if record.get(field)]
+            if changed:
+                CustomUser.objects.bulk_update(changed, [field])
+
+    def set_expertise(self, profile_expertise):
+        """
+        Replace Expertise of Profile
+        :param profile_expertise: list of (Profile id, list of Expertise name)
+        """
+        if not profile_expertise:
+            return
+
+        Profile = apps.get_model('portfolio', 'Profile')
+        self.load_expertise_ids({name for profile_id, names in profile_expertise for name in names})
+        through = Profile.expertise.through
+        through.objects.filter(profile_id__in=[profile_id for profile_id, names in profile_expertise]).delete()
+        through.objects.bulk_create([through(profile_id=profile_id, expertise_id=self.expertise_ids[name])
+                                     for profile_id, names in profile_expertise for name in names],
+                                    ignore_conflicts=True)
+
+    def load_expertise_ids(self, names):
+        """
+        Get id of Expertise by name, creating the missing ones
+        """
+        Expertise = apps.get_model('portfolio', 'Expertise')
+        missing = [name for name in names if name not in self.expertise_ids]
+        if not missing:
+            return
+
+        self.expertise_ids.update(Expertise.objects.filter(name__in=missing).values_list('name', 'pk'))
+        new_names = [name for name in missing if name not in self.expertise_ids]
+        if new_names:
+            Expertise.objects.bulk_create([Expertise(name=name) for name in new_names])
+            self.expertise_ids.update(Expertise.objects.filter(name__in=new_names).values_list('name', 'pk'))
+
+    def refresh(self):
+        """
+        Bulk operations send no signals, so refresh everything that is derived from Profile at once
+        """
+        clustering.invalidate_clusters()
+        tiles.clear_tiles()
+        map_cache.bump_version()
+        facets.rebuild_counts()
@@ -0,0 +1,86 @@
+"""
+Trigram indexes for the `icontains` searches of ProfileAdmin and the similarity search of portfolio.search.
+
+On PostgreSQL, Django runs `icontains` as UPPER(column::text) LIKE UPPER('%term%'), which a B-tree index can not
+answer. A GIN index over the same expression with pg_trgm operator class can, and a GIN index over the column
+itself answers the `%` similarity operator. These indexes are created by post_migrate, because Django migrations
+can not express them, and CREATE INDEX IF NOT EXISTS makes it safe to run after every migrate.
+
+The GIN index of Profile search vector is created the same way, so migrate also runs on SpatiaLite.
+"""
+import logging
+
+from django.apps import apps
+from django.db import DatabaseError, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# (app label, model name, field name) searched with icontains
+TRIGRAM_FIELDS = (
+    ('portfolio', 'Profile', 'first_name'),
+    ('portfolio', 'Profile', 'last_name'),
+    ('portfolio', 'Profile', 'phone'),
+    ('users', 'CustomUser', 'email'),
+)
+# (app label, model name, field name) searched with trigram_similar
+SIMILARITY_FIELDS = (
+    ('portfolio', 'Profile', 'first_name'),
+    ('portfolio', 'Profile', 'last_name'),
+)
+
+
+def trigram_index_sql(connection, model, field_name, upper=True):
+    """
+    :param upper: index UPPER(column) for icontains, instead of the column for similarity
+    """
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    column = model._meta.get_field(field_name).column
+    expression = '(UPPER({}::text))'.format(qn(column)) if upper else qn(column)
+    name = '{}_{}_{}'.format(table, column, 'trgm' if upper else 'similar')
+    return 'CREATE INDEX IF NOT EXISTS {} ON {} USING gin ({} gin_trgm_ops)'.format(
+        qn(name[:63]), qn(table), expression)
+
+
+def create_trigram_indexes(using='default'):
+    """
+    Create pg_trgm extension and trigram indexes, if database is PostgreSQL
+    :return: number of index statements that were run
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return 0
+
+    try:
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            for app_label, model_name, field_name in TRIGRAM_FIELDS:
+                cursor.execute(trigram_index_sql(connection, apps.get_model(app_label, model_name), field_name))
+            for app_label, model_name, field_name in SIMILARITY_FIELDS:
+                cursor.execute(trigram_index_sql(connection, apps.get_model(app_label, model_name), field_name,
+                                                 upper=False))
+    except DatabaseError:
+        # e.g. database user is not allowed to create extension. Admin search still works without index,
+        # Profile search needs pg_trgm to be created by a superuser.
+        logger.exception('Could not create trigram indexes')
+        return 0
+    return len(TRIGRAM_FIELDS) + len(SIMILARITY_FIELDS)
+
+
+def create_search_vector_index(using='default'):
+    """
+    Create GIN index of Profile search vector, if database is PostgreSQL
+    :return: number of index statements that were run
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return 0
+
+    qn = connection.ops.quote_name
+    Profile = apps.get_model('portfolio', 'Profile')
+    table = Profile._meta.db_table
+    column = Profile._meta.get_field('search_vector').column
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE INDEX IF NOT EXISTS {} ON {} USING gin ({})'.format(
+            qn('{}_{}_gin'.format(table, column)[:63]), qn(table), qn(column)))
+    return 1
@@ -0,0 +1,118 @@
+"""
+Background jobs, stored in Job table and run by `manage.py run_worker`.
+
+A job is a registered handler name and JSON keyword arguments. Worker claims pending jobs with
+SELECT ... FOR UPDATE SKIP LOCKED, so several workers can share the table without running a job twice.
+Failed job is retried with exponential backoff until it reaches its max attempts.
+
+With JOB_QUEUE_EAGER (e.g. in tests), job is run right away in the process that enqueues it.
+"""
+import json
+import logging
+import traceback
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Registered handlers, {name: (handler, on_failure)}
+HANDLERS = {}
+
+
+def register(name, on_failure=None):
+    """
+    Decorator to register a job handler
+    :param name: job name used to enqueue the job
+    :param on_failure: function called with the same arguments as the handler when the job
+                       fails for the last time
+    """
+    def decorator(handler):
+        HANDLERS[name] = (handler, on_failure)
+        return handler
+    return decorator
+
+
+def enqueue(name, max_attempts=None, **kwargs):
+    """
+    Add a job to the queue
+    :param name: registered handler name
+    :param max_attempts: number of times the job is tried, default is JOB_MAX_ATTEMPTS
+    :param kwargs: JSON serializable arguments of the handler
+    :return: Job object
+    """
+    if name not in HANDLERS:
+        raise ValueError('Job {} is not registered'.format(name))
+
+    Job = apps.get_model('portfolio', 'Job')
+    job = Job.objects.create(name=name, payload=json.dumps(kwargs),
+                             max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS)
+    if settings.JOB_QUEUE_EAGER:
+        job.status, job.attempts = Job.RUNNING, 1
+        job.save(update_fields=['status', 'attempts', 'updated_at'])
+        run_job(job.pk)
+        job.refresh_from_db()
+    return job
+
+
+def claim_jobs(limit):
+    """
+    Mark pending jobs that are due as running, so no other worker picks them
+    :param limit: maximum number of claimed jobs
+    :return: list of claimed Job id
+    """
+    Job = apps.get_model('portfolio', 'Job')
+    with transaction.atomic():
+        ids = list(Job.objects.select_for_update(skip_locked=True)
+                   .filter(status=Job.PENDING, run_after__lte=timezone.now())
+                   .order_by('run_after', 'id').values_list('id', flat=True)[:limit])
+        if ids:
+            for job in Job.objects.filter(id__in=ids):
+                job.status, job.attempts = Job.RUNNING, job.attempts + 1
+                job.save(update_fields=['status', 'attempts', 'updated_at'])
+    return ids
+
+
+def requeue_stale(timeout):
+    """
+    Put back jobs that have been running for too long, e.g. because their worker was killed
+    :param timeout: seconds after which running job is considered lost
+    :return: number of requeued jobs
+    """
+    Job = apps.get_model('portfolio', 'Job')
+    return Job.objects.filter(status=Job.RUNNING, updated_at__lt=timezone.now() - timedelta(seconds=timeout)) \
+        .update(status=Job.PENDING, run_after=timezone.now())
+
+
+def run_job(job_id):
+    """
+    Run a claimed job and record its result. Runs inside worker process.
+    :param job_id: id of Job with status running
+    :return: status of the job after it is run
+    """
+    Job = apps.get_model('portfolio', 'Job')
+    job = Job.objects.get(pk=job_id)
+    handler, on_failure = HANDLERS[job.name]
+    kwargs = json.loads(job.payload)
+
+    try:
+        handler(**kwargs)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            job.status = Job.PENDING
+            job.run_after = timezone.now() + timedelta(seconds=settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1))
+            logger.warning('Job %s (%s) failed, retrying at %s', job.pk, job.name, job.run_after)
+        else:
+            job.status = Job.FAILED
+            logger.error('Job %s (%s) failed after %s attempts', job.pk, job.name, job.attempts)
+            if on_failure is not None:
+                on_failure(**kwargs)
+    else:
+        job.status, job.last_error = Job.DONE, ''
+
+    job.save(update_fields=['status', 'run_after', 'last_error', 'updated_at'])
+    return job.status
@@ -0,0 +1,93 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from portfolio import benchmarks
+
+
+class Command(BaseCommand):
+    """
+    Seed synthetic users and Profile, then measure throughput, latency and query count of the hot views at each
+    row count. See portfolio.benchmarks for the data and scenarios.
+
+    Bench rows are written to the configured database and kept between runs, so run it against a dedicated
+    database, and remove them with --cleanup. Results are written as JSON, and compared with --baseline to fail
+    on regressions before deploy.
+    """
+    help = 'Benchmark hot views on synthetic Profile'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,100000,1000000',
+                            help='Comma-separated numbers of Profile to benchmark at')
+        parser.add_argument('--requests', type=int, default=50, help='Number of requests per scenario')
+        parser.add_argument('--scenario', action='append', choices=benchmarks.SCENARIO_NAMES, dest='scenarios',
+                            help='Scenario to run, can be repeated. Default is every scenario.')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed of synthetic data')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Number of Profile seeded per transaction')
+        parser.add_argument('--output', default=None, help='JSON result file, default is standard output')
+        parser.add_argument('--baseline', default=None, help='JSON result of a previous run to compare with')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed relative increase of p95 latency against baseline')
+        parser.add_argument('--cleanup', action='store_true', help='Remove bench users and Profile, then exit')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help='Do not ask for confirmation before writing bench rows')
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            self.stdout.write('{} bench users removed'.format(benchmarks.remove_profiles()))
+            return
+
+        try:
+            sizes = sorted(int(size) for size in options['sizes'].split(','))
+        except ValueError:
+            raise CommandError('--sizes must be comma-separated numbers')
+        if not sizes or sizes[0] < 1:
+            raise CommandError('--sizes must be positive')
+
+        if options['interactive']:
+            confirm = input('This will add up to {} bench users to database "{}". Type "yes" to continue: '.format(
+                sizes[-1], connection.settings_dict['NAME']))
+            if confirm != 'yes':
+                raise CommandError('Benchmark cancelled')
+
+        result = {
+            'created_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'seed': options['seed'],
+            'runs': [],
+        }
+        # Debug toolbar and query logging of DEBUG would be measured too
+        with override_settings(DEBUG=False, ALLOWED_HOSTS=['testserver']):
+            for size in sizes:
+                start = time.perf_counter()
+                created = benchmarks.seed_profiles(size, options['seed'], options['batch_size'])
+                self.stderr.write('{} rows: {} Profile seeded in {:.1f} s'.format(
+                    size, created, time.perf_counter() - start))
+                try:
+                    scenarios = benchmarks.run_scenarios(options['scenarios'], options['requests'])
+                except ValueError as e:
+                    raise CommandError(str(e))
+                result['runs'].append({'rows': size, 'scenarios': scenarios})
+                for name, measured in scenarios.items():
+                    self.stderr.write('  {}: {} req/s, p95 {} ms, {} queries'.format(
+                        name, measured['throughput'], measured['latency_ms']['p95'], measured['queries']['max']))
+
+        output = json.dumps(result, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                regressions = benchmarks.compare(json.load(f), result, options['tolerance'])
+            for regression in regressions:
+                self.stderr.write(self.style.ERROR(regression))
+            if regressions:
+                raise CommandError('{} regressions against {}'.format(len(regressions), options['baseline']))
+            self.stderr.write(self.style.SUCCESS('No regression against {}'.format(options['baseline'])))
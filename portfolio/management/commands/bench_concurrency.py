@@ -0,0 +1,50 @@
+import json
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from portfolio import benchmarks
+
+
+class Command(BaseCommand):
+    """
+    Compare how WSGI sync workers and the ASGI handler keep up with many simultaneous map clients that download
+    slowly. Both serve the same Django application in this process, against Profile already in database
+    (see `manage.py bench` to seed them).
+    """
+    help = 'Compare WSGI and ASGI concurrency of a map API with slow clients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=1000, help='Number of simultaneous clients')
+        parser.add_argument('--workers', type=int, default=8, help='Number of WSGI sync workers')
+        parser.add_argument('--threads', type=int, default=None, help='ASGI pool threads, default is ASGI_THREADS')
+        parser.add_argument('--download-time', type=float, default=0.5,
+                            help='Seconds each client takes to receive a response')
+        parser.add_argument('--url', default=None, help='Path of the requested API, default is the map GeoJSON')
+        parser.add_argument('--query', default='bbox=95,-11,141,6', help='Query string of the requested API')
+        parser.add_argument('--output', default=None, help='JSON result file, default is standard output')
+
+    def handle(self, *args, **options):
+        threads = options['threads'] or settings.ASGI_THREADS
+        # Debug toolbar and query logging of DEBUG would be measured too
+        with override_settings(DEBUG=False, ALLOWED_HOSTS=['testserver']):
+            try:
+                result = benchmarks.compare_concurrency(
+                    WSGIHandler(), options['url'] or reverse('profile_geojson'), options['query'], options['clients'],
+                    options['workers'], threads, options['download_time'])
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        for mode, measured in result.items():
+            self.stderr.write('{}: {} req/s, p50 {} ms, p99 {} ms'.format(
+                mode, measured['throughput'], measured['latency_ms']['p50'], measured['latency_ms']['p99']))
+        output = json.dumps(dict(result, clients=options['clients'], download_time=options['download_time']),
+                            indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
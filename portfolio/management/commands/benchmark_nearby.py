@@ -0,0 +1,68 @@
+import random
+import time
+
+from django.contrib.gis.measure import D
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from portfolio.models import Profile
+
+
+class Command(BaseCommand):
+    """
+    Check that Profile location has a spatial index and measure proximity search latency.
+    Search points are taken from random Profile location, so they follow the real distribution of Profile.
+    """
+    help = 'Check Profile spatial index and benchmark proximity search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=100, help='Number of searches')
+        parser.add_argument('--radius', type=float, default=None, help='Search radius in kilometres')
+        parser.add_argument('--k', type=int, default=10, help='Number of nearest Profile')
+        parser.add_argument('--explain', action='store_true', help='Print query plan of the first search')
+
+    def handle(self, *args, **options):
+        self.check_index()
+
+        locations = list(Profile.objects.exclude(location=None).order_by('?')
+                         .values_list('location', flat=True)[:options['queries']])
+        if not locations:
+            raise CommandError('There is no Profile with location to search around')
+
+        radius = D(km=options['radius']) if options['radius'] else None
+        timings = []
+        for i in range(options['queries']):
+            point = random.choice(locations)
+            queryset = Profile.objects.nearby(point, distance=radius, nearest=options['k'])[:options['k']]
+            if i == 0 and options['explain']:
+                self.stdout.write(queryset.explain(analyze=connection.vendor == 'postgresql'))
+
+            start = time.perf_counter()
+            list(queryset.values_list('id', flat=True))
+            timings.append((time.perf_counter() - start) * 1000)
+
+        timings.sort()
+        self.stdout.write('{} searches over {} Profile'.format(len(timings), Profile.objects.count()))
+        for name, percentile in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+            self.stdout.write('{}: {:.2f} ms'.format(name, timings[min(int(len(timings) * percentile),
+                                                                           len(timings) - 1)]))
+        self.stdout.write('max: {:.2f} ms'.format(timings[-1]))
+
+    def check_index(self):
+        """
+        Print spatial index of Profile location, PostGIS creates it as GiST index
+        """
+        if connection.vendor != 'postgresql':
+            self.stdout.write('Index check is only available on PostGIS')
+            return
+
+        column = Profile._meta.get_field('location').column
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s AND indexdef ILIKE %s",
+                           [Profile._meta.db_table, '%USING gist%({})%'.format(column)])
+            indexes = cursor.fetchall()
+
+        if not indexes:
+            raise CommandError('Profile location has no GiST index, run migrate to create it')
+        for name, definition in indexes:
+            self.stdout.write(self.style.SUCCESS('Spatial index found: {}'.format(definition)))
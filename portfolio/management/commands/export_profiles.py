@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from portfolio import exporters
+from portfolio.geo import parse_bbox, parse_expertise
+
+
+class Command(BaseCommand):
+    """
+    Export every Profile with location to a file, streaming it so memory use does not grow with the table.
+    """
+    help = 'Export Profile as GeoJSON, CSV or FlatGeobuf'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Output file')
+        parser.add_argument('--format', choices=sorted(exporters.FORMATS), default=None,
+                            help='Output format, default is guessed from file extension')
+        parser.add_argument('--bbox', default=None, help='Only export Profile inside west,south,east,north')
+        parser.add_argument('--expertise', default=None,
+                            help='Only export Profile which has any of these comma-separated Expertise id')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Number of rows fetched at once')
+
+    def handle(self, *args, **options):
+        export_format = options['format'] or options['path'].rsplit('.', 1)[-1].lower()
+        if export_format not in exporters.FORMATS:
+            raise CommandError('Unknown format {}, use --format'.format(export_format))
+
+        try:
+            bbox = parse_bbox(options['bbox']) if options['bbox'] else None
+            expertise = parse_expertise(options['expertise'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        with open(options['path'], 'wb') as f:
+            for chunk in exporters.export(export_format, bbox, expertise, options['chunk_size']):
+                f.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+        self.stdout.write(self.style.SUCCESS('Profile exported to {}'.format(options['path'])))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from portfolio import jobs, thumbnails
+from portfolio.models import Profile
+
+
+class Command(BaseCommand):
+    """
+    Generate resized derivatives of every Profile photo, e.g. for photos uploaded before derivatives existed
+    or after PROFILE_PHOTO_SIZES changes.
+    """
+    help = 'Generate resized derivatives of Profile photos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--enqueue', action='store_true',
+                            help='Enqueue a job per photo for run_worker instead of processing it here')
+
+    def handle(self, *args, **options):
+        count = 0
+        for profile in Profile.objects.exclude(photo='').exclude(photo=None).only('photo').iterator():
+            if options['enqueue']:
+                jobs.enqueue('process_photo', profile_id=profile.pk, name=profile.photo.name)
+            else:
+                try:
+                    thumbnails.process_photo(profile.pk, profile.photo.name)
+                except (IOError, OSError) as e:
+                    self.stderr.write('Failed to generate derivatives of {}: {}'.format(profile.photo.name, e))
+                    continue
+            count += 1
+        self.stdout.write(self.style.SUCCESS('Derivatives of {} photos {}'.format(
+            count, 'enqueued' if options['enqueue'] else 'generated')))
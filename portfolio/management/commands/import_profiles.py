@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from portfolio import importers
+
+
+class Command(BaseCommand):
+    """
+    Import users and their Profile from CSV, GeoJSON or GeoPackage, see portfolio.importers for the fields.
+    Users are matched by email, so importing the same file again updates them instead of duplicating them.
+    Each batch is imported in its own transaction.
+    """
+    help = 'Import users and Profile from CSV, GeoJSON or GeoPackage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Input file')
+        parser.add_argument('--format', choices=importers.FORMATS, default=None,
+                            help='Input format, default is guessed from file extension')
+        parser.add_argument('--layer', default=None, help='GeoPackage table, default is the first feature table')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of records per transaction')
+
+    def handle(self, *args, **options):
+        try:
+            input_format = options['format'] or importers.guess_format(options['path'])
+            records = importers.read_records(options['path'], input_format, options['layer'])
+            importer = importers.ProfileImporter(batch_size=options['batch_size'])
+            start = time.perf_counter()
+            importer.run(records, on_error=self.report_error)
+        except (IOError, ValueError) as e:
+            raise CommandError(str(e))
+
+        elapsed = time.perf_counter() - start
+        imported = importer.created + importer.updated
+        self.stdout.write(self.style.SUCCESS(
+            '{} Profile created, {} updated, {} records failed in {:.1f} s ({:.0f} Profile/s)'.format(
+                importer.created, importer.updated, importer.failed, elapsed, imported / elapsed if elapsed else 0)))
+
+    def report_error(self, number, message):
+        self.stderr.write('Record {}: {}'.format(number, message))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from portfolio import facets
+
+
+class Command(BaseCommand):
+    """
+    Rebuild ExpertiseCount from the Profile-Expertise join table.
+    Run it once after migrate, and after Profile or Expertise are changed in bulk without sending signals.
+    """
+    help = 'Rebuild per-Expertise Profile counts used by the map facets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help='Number of rows per INSERT')
+
+    def handle(self, *args, **options):
+        facets.rebuild_counts(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Expertise counts rebuilt'))
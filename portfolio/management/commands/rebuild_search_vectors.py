@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from portfolio import search
+from portfolio.models import Profile
+
+
+class Command(BaseCommand):
+    """
+    Rebuild search vector of every Profile, in batches of Profile id so each UPDATE stays short.
+    Run it once after migrate, and after PROFILE_SEARCH_CONFIG changes.
+    """
+    help = 'Rebuild search vector of every Profile'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help='Number of Profile per UPDATE')
+
+    def handle(self, *args, **options):
+        count = 0
+        last_id = 0
+        while True:
+            ids = list(Profile.objects.filter(pk__gt=last_id).order_by('pk')
+                       .values_list('pk', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            count += search.update_search_vectors(Profile.objects.filter(pk__in=ids))
+            last_id = ids[-1]
+        self.stdout.write(self.style.SUCCESS('Search vector of {} Profile rebuilt'.format(count)))
@@ -0,0 +1,66 @@
+import logging
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from portfolio import jobs
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Run background jobs from Job table on a pool of processes.
+    Several workers (e.g. on different hosts) can run at the same time, a job is only claimed by one of them.
+    """
+    help = 'Run background jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(),
+                            help='Number of worker processes')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait before checking the queue again when it is empty')
+        parser.add_argument('--stale-timeout', type=int, default=600,
+                            help='Seconds after which a running job is considered lost and run again')
+        parser.add_argument('--once', action='store_true', help='Exit when there is no pending job')
+
+    def handle(self, *args, **options):
+        processes = options['processes']
+        # Forked processes must not share database connection of this process
+        connections.close_all()
+        pool = multiprocessing.Pool(processes)
+        running = []
+        self.stdout.write('Worker started with {} processes'.format(processes))
+
+        try:
+            while True:
+                running = [result for result in running if not result.ready()]
+                claimed = []
+                if len(running) < processes:
+                    requeued = jobs.requeue_stale(options['stale_timeout'])
+                    if requeued:
+                        logger.warning('%s stale jobs requeued', requeued)
+                    claimed = jobs.claim_jobs(processes - len(running))
+                    # Close it again, in case pool forks a new process to replace a dead one
+                    connections.close_all()
+                    running.extend(pool.apply_async(jobs.run_job, (job_id,), error_callback=self.log_error)
+                                   for job_id in claimed)
+
+                if not claimed:
+                    if options['once'] and not running:
+                        break
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            # Interrupted jobs stay running until they are requeued by --stale-timeout
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
+
+    def log_error(self, error):
+        """
+        Jobs catch errors of their handler, so this only logs errors of the queue itself, e.g. lost database
+        """
+        logger.error('Job could not be run: %r', error)
@@ -0,0 +1,55 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    """
+    Measure the cold start of a worker: settings, import, models and ready() of each app, middleware and URLconf.
+    Every run is a fresh `python -m project.startup` process, see project.startup. The fastest of --repeat runs
+    is reported, to leave out noise of the machine.
+    """
+    help = 'Report import and setup time per app of a new worker process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', action='append', choices=settings.SETTINGS_PROFILES, dest='profiles',
+                            help='Settings profile to measure, can be repeated. Default is the current profile.')
+        parser.add_argument('--repeat', type=int, default=3, help='Number of runs per profile')
+        parser.add_argument('--json', action='store_true', help='Print JSON instead of a table')
+
+    def handle(self, *args, **options):
+        reports = [self.measure(profile, max(options['repeat'], 1))
+                   for profile in options['profiles'] or [settings.SETTINGS_PROFILE]]
+        if options['json']:
+            self.stdout.write(json.dumps(reports, indent=2))
+            return
+        for report in reports:
+            self.write_report(report)
+
+    def measure(self, profile, repeat):
+        """
+        :return: report of the fastest run of a profile
+        """
+        env = dict(os.environ, SETTINGS_PROFILE=profile,
+                   DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'project.settings'))
+        reports = []
+        for _ in range(repeat):
+            process = subprocess.run([sys.executable, '-m', 'project.startup'], cwd=settings.BASE_DIR, env=env,
+                                     stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            if process.returncode != 0:
+                raise CommandError('Startup of profile {} failed:\n{}'.format(profile, process.stderr))
+            reports.append(json.loads(process.stdout.strip().splitlines()[-1]))
+        return min(reports, key=lambda report: report['total_ms'])
+
+    def write_report(self, report):
+        self.stdout.write(self.style.MIGRATE_HEADING('Profile {}: {} ms, {} modules, {} MB peak memory'.format(
+            report['profile'], report['total_ms'], report['modules'], round(report['max_rss_kb'] / 1024, 1))))
+        self.stdout.write('  settings {settings_ms} ms, django.setup() {setup_ms} ms, middleware {middleware_ms} ms, '
+                          'URLconf {urlconf_ms} ms'.format(**report))
+        self.stdout.write('  {:<32} {:>9} {:>9} {:>9} {:>8}'.format('app', 'import', 'models', 'ready', 'modules'))
+        for app in sorted(report['apps'], key=lambda app: app['import'] + app['models'] + app['ready'], reverse=True):
+            self.stdout.write('  {app:<32} {import:>9} {models:>9} {ready:>9} {modules:>8}'.format(**app))
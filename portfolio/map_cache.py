@@ -0,0 +1,75 @@
+"""
+Cache of the home map payload, one JSON document per map tile.
+
+Keys are versioned with a global version, which is bumped when something that is shown on every tile
+changes (e.g. Expertise is renamed). When a single Profile changes, only the tiles which contain it
+are removed.
+"""
+from django.conf import settings
+from django.core.cache import caches
+
+from portfolio.geo import MAX_ZOOM
+from portfolio.tiles import lonlat_to_tile
+from project.db_router import read_from_primary
+
+VERSION_KEY = 'profile-map:version'
+
+
+def get_cache():
+    return caches[settings.PROFILE_MAP_CACHE]
+
+
+def get_version():
+    """
+    Get current global version of the map payload
+    """
+    map_cache = get_cache()
+    version = map_cache.get(VERSION_KEY)
+    if version is None:
+        # add() does nothing if another process has just set the version
+        map_cache.add(VERSION_KEY, 1, None)
+        version = map_cache.get(VERSION_KEY, 1)
+    return version
+
+
+def bump_version():
+    """
+    Invalidate every cached map payload
+    """
+    map_cache = get_cache()
+    try:
+        map_cache.incr(VERSION_KEY)
+    except ValueError:
+        # version does not exist yet, nothing is cached with it
+        map_cache.add(VERSION_KEY, 1, None)
+
+
+def tile_key(z, x, y, version=None):
+    return 'profile-map:v{}:{}/{}/{}'.format(version or get_version(), z, x, y)
+
+
+def get_tile(z, x, y, render):
+    """
+    Get JSON document of a map tile, render and cache it if it is not cached yet
+    :param render: function that renders the JSON document of the tile
+    :return: JSON document as string
+    """
+    map_cache = get_cache()
+    key = tile_key(z, x, y)
+    document = map_cache.get(key)
+    if document is None:
+        # the document is shared by every client, so it must not come from a lagging replica
+        with read_from_primary():
+            document = render()
+        map_cache.set(key, document, settings.PROFILE_MAP_CACHE_TIMEOUT)
+    return document
+
+
+def invalidate_location(location):
+    """
+    Remove cached map tiles that contain a location
+    :param location: Point in EPSG:4326
+    """
+    version = get_version()
+    keys = [tile_key(z, *lonlat_to_tile(location.x, location.y, z), version=version) for z in range(MAX_ZOOM + 1)]
+    get_cache().delete_many(keys)
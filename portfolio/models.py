@@ -1,11 +1,29 @@
 from django.contrib.gis.db import models as gis
-from django.db import models
-from django.db.models.signals import post_save, pre_save, pre_delete
+from django.contrib.gis.db.models.functions import Distance
+from django.contrib.gis.geos import GEOSGeometry
+from django.contrib.gis.measure import D
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVectorField
+from django.db import connections, models
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_save, pre_delete
 from django.dispatch import receiver
+from django.utils import timezone
 from phonenumber_field.modelfields import PhoneNumberField
 from users.models import CustomUser
+from portfolio import clustering, facets, indexes, jobs, map_cache, page_cache, search, thumbnails, tiles
+from portfolio.geo import EARTH_RADIUS, bbox_to_polygon, distance_bbox, sphere_distance
+import functools
+import math
 import os
 
+def loaded_copy(value):
+    """
+    Copy of a loaded field value that does not change with the field. Geometry is mutable, e.g.
+    `profile.location.x = 110`, so it is cloned.
+    """
+    return value.clone() if isinstance(value, GEOSGeometry) else value
+
 class BaseModel(models.Model):
     """
     Abstract Model to be inherited by other model in profile
@@ -42,19 +60,111 @@ class Expertise(BaseModel):
     class Meta:
         ordering = ('name',)
 
+class ProfileQuerySet(models.QuerySet):
+    """
+    Custom QuerySet for Profile
+    """
+
+    def map_listing(self):
+        """
+        Lean queryset for map popup. Only load the fields shown in popup, join the user to get email, and
+        aggregate Expertise names in SQL as `expertise_names`, so listing costs one query however many Profile it has.
+        Databases other than PostgreSQL can not aggregate strings, so they prefetch Expertise instead.
+        """
+        queryset = self.select_related('user').only('id', 'first_name', 'last_name', 'phone', 'address', 'photo',
+                                                    'photo_status', 'location', 'user', 'user__email')
+        if connections[self.db].vendor == 'postgresql':
+            return queryset.annotate(expertise_names=StringAgg('expertise__name', ', ', ordering='expertise__name'))
+        return queryset.prefetch_related(models.Prefetch('expertise', queryset=Expertise.objects.only('name')))
+
+    def with_expertise(self, expertise_ids):
+        """
+        Filter Profile which has any of the Expertise. A subquery on the join table is used instead of
+        joining it, so the result does not need DISTINCT.
+        :param expertise_ids: list of Expertise id
+        """
+        through = self.model.expertise.through.objects.filter(expertise_id__in=expertise_ids)
+        return self.filter(pk__in=through.values('profile_id'))
+
+    def nearby(self, point, distance=None, nearest=None):
+        """
+        Profile sorted by distance from a point, with the distance in metres annotated as `distance`.
+        Slice the result to get K nearest Profile.
+        :param point: Point in EPSG:4326
+        :param distance: D measure, only return Profile within this distance
+        :param nearest: number of nearest Profile that will be taken from the result. When distance is not
+                        given, it is used to find the distance that contains that many Profile, so the
+                        spatial index can still be used.
+        """
+        queryset = self.exclude(location=None)
+        if distance is None and nearest is not None:
+            distance = queryset.nearest_distance(point, nearest)
+
+        if distance is not None:
+            # bbox filter uses spatial index, exact distance is only calculated for Profile inside bbox
+            bbox = distance_bbox(point.x, point.y, distance.m)
+            queryset = queryset.filter(location__intersects=bbox_to_polygon(bbox),
+                                       location__distance_lte=(point, distance))
+
+        return queryset.annotate(distance=Distance('location', point)).order_by('distance', 'pk')
+
+    def nearest_distance(self, point, nearest):
+        """
+        Find the distance from a point that contains at least `nearest` Profile
+        :return: D measure, or None if there are not that many Profile
+        """
+        if connections[self.db].vendor == 'postgresql':
+            # KNN (<->) uses spatial index to find nearest Profile in degrees. Degrees are not metres,
+            # but the farthest of them gives a distance that surely contains the `nearest` nearest Profile.
+            knn = RawSQL('{}.{} <-> ST_GeomFromEWKT(%s)'.format(
+                connections[self.db].ops.quote_name(self.model._meta.db_table),
+                connections[self.db].ops.quote_name(self.model._meta.get_field('location').column),
+            ), (point.ewkt,))
+            locations = list(self.annotate(knn=knn).order_by('knn').values_list('location', flat=True)[:nearest])
+            if len(locations) < nearest:
+                return None
+            # add 1 metre so rounding never excludes the farthest one
+            return D(m=max(sphere_distance(point.x, point.y, location.x, location.y) for location in locations) + 1)
+
+        # Other databases can not use spatial index for ordering, so grow the distance until it is big enough
+        distance = 1000
+        while distance < 2 * EARTH_RADIUS * math.pi:
+            bbox = distance_bbox(point.x, point.y, distance)
+            if self.filter(location__intersects=bbox_to_polygon(bbox),
+                           location__distance_lte=(point, D(m=distance)))[:nearest].count() >= nearest:
+                return D(m=distance)
+            distance *= 4
+        return None
+
 class Profile(BaseModel):
     """
     Model for User Profile, has OnetoOne relationship with CustomUser
     """
+    PHOTO_READY = 'ready'
+    PHOTO_PROCESSING = 'processing'
+    PHOTO_FAILED = 'failed'
+    PHOTO_STATUS_CHOICES = (
+        (PHOTO_READY, 'Ready'),
+        (PHOTO_PROCESSING, 'Processing'),
+        (PHOTO_FAILED, 'Failed'),
+    )
 
     user = models.OneToOneField(CustomUser, null=False, default=1, on_delete=models.CASCADE)
     photo = models.ImageField(upload_to=user_photo_directory, null=True, blank=True)
+    # Uploaded photo is resized by a background job, see portfolio.thumbnails.process_photo
+    photo_status = models.CharField(max_length=10, choices=PHOTO_STATUS_CHOICES, default=PHOTO_READY, editable=False)
     first_name = models.CharField(max_length=20, null=False, blank=False, default='')
     last_name = models.CharField(max_length=20, null=False, blank=False, default='')
     address = models.CharField(max_length=100, default='', null=False, blank=True)
     phone = PhoneNumberField(max_length=15, null=False, blank=True, default='')
     expertise = models.ManyToManyField(Expertise)
-    location = gis.PointField(null=True, default=None, blank=True)
+    # Spatial (GiST on PostGIS) index is what keeps bbox, tile and proximity queries fast, so keep it explicit
+    location = gis.PointField(null=True, default=None, blank=True, spatial_index=True)
+    # Name, email, Expertise and address for Profile search, kept up to date by signal receivers on PostgreSQL.
+    # Its GIN index is created after migrate, see portfolio.indexes.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = ProfileQuerySet.as_manager()
 
     def __unicode__(self):
         return '{} - {} - {}'.format(self.user.username, self.user.first_name + ' ' + self.user.last_name, self.phone)
@@ -62,22 +172,317 @@ class Profile(BaseModel):
     def __str__(self):
         return self.__unicode__()
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Keep loaded values, so signal receivers can compare them without fetching the row again
+        instance._loaded_values = {name: loaded_copy(value) for name, value in zip(field_names, values)}
+        return instance
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        # search_vector is rebuilt in SQL by signal receivers, so an existing row must not get back the
+        # vector this instance loaded, which may be older than the row's. Leaving it out of the UPDATE keeps
+        # the default save, e.g. a row deleted meanwhile is inserted again.
+        values = [value for value in values if value[0].name != 'search_vector']
+        return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        super().save(force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        # Saved values become the loaded values for the next save. Photo is kept as its name, like it is loaded.
+        self._loaded_values = {field.attname: loaded_copy(self.__dict__[field.attname])
+                               for field in self._meta.concrete_fields if field.attname in self.__dict__}
+        if 'photo' in self._loaded_values:
+            self._loaded_values['photo'] = self.photo.name
+
+    def get_loaded_value(self, field_name, default=None):
+        """
+        Get value of a field as it was when Profile was loaded from database (or last saved)
+        :param field_name: attname of the field
+        :param default: returned value if the field was not loaded, e.g. Profile is new or field is deferred
+        """
+        return getattr(self, '_loaded_values', {}).get(field_name, default)
+
+    class Meta:
+        ordering = ('-id',)
+
+class ExpertiseCount(models.Model):
+    """
+    Number of Profile which has an Expertise inside a map tile, at zoom levels of PROFILE_FACET_ZOOMS.
+    Kept up to date by signal receivers, see portfolio.facets.
+    """
+    expertise = models.ForeignKey(Expertise, on_delete=models.CASCADE, related_name='counts')
+    zoom = models.PositiveSmallIntegerField()
+    x = models.IntegerField()
+    y = models.IntegerField()
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return '{} - {}/{}/{} - {}'.format(self.expertise_id, self.zoom, self.x, self.y, self.count)
+
+    class Meta:
+        unique_together = ('expertise', 'zoom', 'x', 'y')
+        indexes = [models.Index(fields=['zoom', 'x', 'y'])]
+
+class Job(BaseModel):
+    """
+    Background job, see portfolio.jobs
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    name = models.CharField(max_length=50)
+    payload = models.TextField(default='{}') # JSON keyword arguments of the handler
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+
+    def __str__(self):
+        return '{} #{} - {}'.format(self.name, self.pk, self.status)
+
     class Meta:
         ordering = ('-id',)
+        # worker looks for pending jobs that are due
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+def skip_raw(receiver_function):
+    """
+    Decorator for save signal receivers of Profile, skipping them when Profile is saved raw,
+    e.g. loaded from fixture by loaddata. Bulk operations (bulk_create, bulk_update, QuerySet.update)
+    do not send signals at all.
+    """
+    @functools.wraps(receiver_function)
+    def wrapper(sender, instance, **kwargs):
+        if kwargs.get('raw'):
+            return
+        return receiver_function(sender, instance, **kwargs)
+    return wrapper
 
 @receiver(post_save, sender=Profile)
-def update_user_name(sender, instance, **kwargs):
+@skip_raw
+def update_user_name(sender, instance, created, **kwargs):
     """
     Change User first_name and last_name when updating Profile
-    first_name and last_name
+    first_name and last_name. User is only saved when they actually change.
     :param sender: Profile
     :param instance: Profile instance (saved Profile object)
     """
-    if not instance.first_name == '':
-        instance.user.first_name = instance.first_name
-    if not instance.last_name == '':
-        instance.user.last_name = instance.last_name
-    instance.user.save()
+    changed = [field for field in ('first_name', 'last_name') if getattr(instance, field) != '' and
+               (created or getattr(instance, field) != instance.get_loaded_value(field, default=False))]
+    if not changed:
+        return
+
+    update_fields = [field for field in changed if getattr(instance.user, field) != getattr(instance, field)]
+    for field in update_fields:
+        setattr(instance.user, field, getattr(instance, field))
+    if update_fields:
+        instance.user.save(update_fields=update_fields)
+
+@receiver(post_save, sender=Profile)
+@skip_raw
+def update_profile_clusters(sender, instance, created, **kwargs):
+    """
+    Rebuild cached map clusters around the old and new location when a Profile location changes
+    :param sender: Profile
+    :param instance: Profile instance (saved Profile object)
+    """
+    old_location = None if created else instance.get_loaded_value('location', default=False)
+    if old_location == instance.location:
+        return
+    if old_location is False:
+        # location was not loaded, so it may have been anywhere
+        clustering.invalidate_clusters()
+        return
+    for location in (old_location, instance.location):
+        if location is not None:
+            clustering.invalidate_location(location)
+
+@receiver(pre_delete, sender=Profile)
+def remove_profile_from_clusters(sender, instance, **kwargs):
+    """
+    Rebuild cached map clusters around the deleted Profile
+    """
+    if instance.location is not None:
+        clustering.invalidate_location(instance.location)
+
+@receiver(post_save, sender=Profile)
+@skip_raw
+def invalidate_profile_tiles(sender, instance, created, **kwargs):
+    """
+    Remove cached vector tiles that contain the Profile, before and after it is saved
+    """
+    old_location = None if created else instance.get_loaded_value('location')
+    if old_location is not None:
+        tiles.invalidate_tiles(old_location)
+    if instance.location is not None and instance.location != old_location:
+        tiles.invalidate_tiles(instance.location)
+
+@receiver(pre_delete, sender=Profile)
+def invalidate_deleted_profile_tiles(sender, instance, **kwargs):
+    """
+    Remove cached vector tiles that contain deleted Profile
+    """
+    if instance.location is not None:
+        tiles.invalidate_tiles(instance.location)
+
+@receiver(m2m_changed, sender=Profile.expertise.through)
+def invalidate_expertise_tiles(sender, instance, action, **kwargs):
+    """
+    Expertise is part of vector tile attributes, so remove cached tiles that contain
+    the Profile when its Expertise changes
+    """
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, Profile) \
+            and instance.location is not None:
+        tiles.invalidate_tiles(instance.location)
+
+@receiver(post_save, sender=Profile)
+@skip_raw
+def invalidate_profile_map_cache(sender, instance, created, **kwargs):
+    """
+    Remove cached home map tiles that contain the Profile, before and after it is saved
+    """
+    old_location = None if created else instance.get_loaded_value('location')
+    if old_location is not None:
+        map_cache.invalidate_location(old_location)
+    if instance.location is not None and instance.location != old_location:
+        map_cache.invalidate_location(instance.location)
+
+@receiver(pre_delete, sender=Profile)
+def invalidate_deleted_profile_map_cache(sender, instance, **kwargs):
+    """
+    Remove cached home map tiles that contain deleted Profile
+    """
+    if instance.location is not None:
+        map_cache.invalidate_location(instance.location)
+
+@receiver(m2m_changed, sender=Profile.expertise.through)
+def invalidate_expertise_map_cache(sender, instance, action, **kwargs):
+    """
+    Remove cached home map tiles that contain the Profile when its Expertise changes.
+    When Profile are added to or removed from an Expertise instead, invalidate every tile.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not isinstance(instance, Profile):
+        map_cache.bump_version()
+    elif instance.location is not None:
+        map_cache.invalidate_location(instance.location)
+
+@receiver(post_save, sender=Expertise)
+@receiver(pre_delete, sender=Expertise)
+def invalidate_map_cache_on_expertise_change(sender, instance, **kwargs):
+    """
+    Expertise name is shown in every popup, so invalidate every cached home map tile when it changes
+    """
+    map_cache.bump_version()
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_map_cache_on_email_change(sender, instance, created, update_fields=None, **kwargs):
+    """
+    User email is shown in popup, so remove cached home map tiles of the user's Profile when it may have changed
+    """
+    if created or (update_fields is not None and 'email' not in update_fields):
+        return
+    location = Profile.objects.filter(user=instance).values_list('location', flat=True).first()
+    if location is not None:
+        map_cache.invalidate_location(location)
+
+@receiver(post_save, sender=CustomUser)
+def create_profile_on_signup(sender, instance, created, raw=False, **kwargs):
+    """
+    Create Profile of new user, so profile page does not have to create it
+    :param sender: CustomUser
+    :param instance: created CustomUser object
+    """
+    if created and not raw:
+        Profile.objects.create(user=instance, first_name=instance.first_name, last_name=instance.last_name)
+
+@receiver(post_save, sender=Profile)
+@skip_raw
+def invalidate_profile_page(sender, instance, **kwargs):
+    """
+    Remove cached profile page of the Profile's user when Profile is saved
+    """
+    page_cache.invalidate_profile(instance.user_id)
+
+@receiver(pre_delete, sender=Profile)
+def invalidate_deleted_profile_page(sender, instance, **kwargs):
+    page_cache.invalidate_profile(instance.user_id)
+
+@receiver(m2m_changed, sender=Profile.expertise.through)
+def invalidate_expertise_profile_page(sender, instance, action, **kwargs):
+    """
+    Remove cached profile page when Profile's Expertise changes. Changes from Expertise side bump
+    the map cache version, which invalidates every profile page.
+    """
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, Profile):
+        page_cache.invalidate_profile(instance.user_id)
+
+@receiver(post_save, sender=Profile)
+@skip_raw
+def move_expertise_counts(sender, instance, created, **kwargs):
+    """
+    Move Expertise counts of the Profile when its location changes.
+    New Profile has no Expertise yet, it is counted when Expertise is added.
+    """
+    old_location = False if created else instance.get_loaded_value('location', default=False)
+    if old_location is not False and old_location != instance.location:
+        facets.move_profile(list(instance.expertise.values_list('pk', flat=True)), old_location, instance.location)
+
+@receiver(pre_delete, sender=Profile)
+def remove_expertise_counts(sender, instance, **kwargs):
+    """
+    Uncount Expertise of deleted Profile. Join table rows are deleted by cascade, which does not send m2m_changed.
+    """
+    if instance.location is not None:
+        facets.update_counts(list(instance.expertise.values_list('pk', flat=True)), instance.location, -1)
+
+@receiver(m2m_changed, sender=Profile.expertise.through)
+def update_expertise_counts(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Update Expertise counts when Expertise is added to or removed from Profile, from either side of the relation
+    :param reverse: False if instance is Profile and pk_set is Expertise id,
+                    True if instance is Expertise and pk_set is Profile id
+    """
+    related = instance.profile_set if reverse else instance.expertise
+    if action in ('pre_remove', 'pre_clear'):
+        # remove() accepts id that is not related and clear() does not tell what it removes,
+        # so keep what is actually related before the rows are deleted
+        if action == 'pre_remove':
+            related = related.filter(pk__in=pk_set)
+        instance._uncounted_pk_set = set(related.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    delta = 1 if action == 'post_add' else -1
+    if action != 'post_add':
+        pk_set = instance._uncounted_pk_set
+
+    if not reverse:
+        facets.update_counts(list(pk_set), instance.location, delta)
+    else:
+        for location in Profile.objects.filter(pk__in=pk_set).exclude(location=None).values_list('location', flat=True):
+            facets.update_counts([instance.pk], location, delta)
+
+def delete_photo(instance, name):
+    """
+    Delete a photo of Profile and its derivatives from storage
+    :param instance: Profile object
+    :param name: photo file name in storage
+    """
+    photo = instance.photo.field.attr_class(instance, instance.photo.field, name)
+    photo.storage.delete(name)
+    thumbnails.delete_thumbnails(photo)
 
 @receiver(pre_delete, sender=Profile)
 def auto_delete_photo_on_delete(sender, instance, **kwargs):
@@ -85,35 +490,114 @@ def auto_delete_photo_on_delete(sender, instance, **kwargs):
     Deletes old photo from filesystem when
     Profile object is deleted.
     """
+    photo = instance.get_loaded_value('photo', default=False)
+    if photo is False:
+        photo = instance.photo.name
+    if photo:
+        delete_photo(instance, photo)
 
+@receiver(pre_save, sender=Profile)
+@skip_raw
+def auto_delete_photo_on_update(sender, instance, **kwargs):
+    """
+    Deletes old photo from filesystem when
+    Profile object is updated with new photo.
+    """
     if not instance.pk:
-        return False
+        return
 
-    try:
-        photo = sender.objects.get(pk=instance.pk).photo
-    except sender.DoesNotExist:
-        return False
+    old_photo = instance.get_loaded_value('photo', default=False)
+    if old_photo is False:
+        # photo was not loaded, e.g. Profile is saved with a deferred photo or without loading it first
+        old_photo = sender.objects.filter(pk=instance.pk).values_list('photo', flat=True).first()
 
-    if bool(photo) == True:
-        if os.path.isfile(photo.path):
-            os.remove(photo.path)
+    if old_photo and old_photo != instance.photo.name:
+        delete_photo(instance, old_photo)
 
 @receiver(pre_save, sender=Profile)
-def auto_delete_photo_on_update(sender, instance, **kwargs):
+@skip_raw
+def mark_new_photo(sender, instance, **kwargs):
     """
-    Deletes old photo from filesystem when
-    Profile object is updated with new photo.
+    Remembers whether Profile is saved with new photo. It has to be checked before saving,
+    because new photo is saved with the same name as the old one.
     """
+    instance._new_photo = bool(instance.photo) and instance.photo.name != instance.get_loaded_value('photo')
+    if instance._new_photo:
+        instance.photo_status = Profile.PHOTO_PROCESSING
+    elif not instance.photo:
+        instance.photo_status = Profile.PHOTO_READY
 
-    if not instance.pk:
-        return False
+@receiver(post_save, sender=Profile)
+@skip_raw
+def process_new_photo(sender, instance, **kwargs):
+    """
+    Enqueues a job to resize new photo, so the request which uploads it does not wait for it.
+    """
+    if getattr(instance, '_new_photo', False):
+        jobs.enqueue('process_photo', profile_id=instance.pk, name=instance.photo.name)
 
-    try:
-        old_photo = sender.objects.get(pk=instance.pk).photo
-    except sender.DoesNotExist:
-        return False
+@receiver(post_migrate)
+def create_trigram_indexes(sender, using='default', **kwargs):
+    """
+    Creates trigram indexes used by ProfileAdmin search, and search vector index, after migrate.
+    """
+    if sender.name == 'portfolio':
+        indexes.create_trigram_indexes(using)
+        indexes.create_search_vector_index(using)
 
-    new_photo = instance.photo
-    if not old_photo == new_photo and bool(old_photo) == True:
-        if os.path.isfile(old_photo.path):
-            os.remove(old_photo.path)
\ No newline at end of file
+@receiver(post_save, sender=Profile)
+@skip_raw
+def update_profile_search_vector(sender, instance, created, **kwargs):
+    """
+    Rebuild search vector when searched fields of Profile change. Existing Profile is saved without its
+    search vector, see Profile.save.
+    """
+    changed = created or any(getattr(instance, field) != instance.get_loaded_value(field, default=False)
+                             for field in ('first_name', 'last_name', 'address'))
+    if changed:
+        search.update_search_vectors(Profile.objects.filter(pk=instance.pk))
+
+@receiver(m2m_changed, sender=Profile.expertise.through)
+def update_expertise_search_vector(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Rebuild search vector of Profile whose Expertise change
+    """
+    if action == 'pre_clear' and reverse:
+        # Profile of the Expertise are not known anymore after clear
+        instance._cleared_profile_ids = list(instance.profile_set.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            profile_ids = [instance.pk]
+        elif action == 'post_clear':
+            profile_ids = getattr(instance, '_cleared_profile_ids', [])
+        else:
+            profile_ids = pk_set
+        search.update_search_vectors(Profile.objects.filter(pk__in=profile_ids))
+
+@receiver(post_save, sender=Expertise)
+def update_renamed_expertise_search_vector(sender, instance, created, raw=False, **kwargs):
+    """
+    Rebuild search vector of Profile which has a saved Expertise, as its name may have changed
+    """
+    if not created and not raw:
+        search.update_search_vectors(Profile.objects.with_expertise([instance.pk]))
+
+@receiver(pre_delete, sender=Expertise)
+def remember_expertise_profiles(sender, instance, **kwargs):
+    """
+    Remembers Profile of deleted Expertise, its join rows are deleted without m2m_changed
+    """
+    instance._profile_ids = list(instance.profile_set.values_list('pk', flat=True))
+
+@receiver(post_delete, sender=Expertise)
+def update_deleted_expertise_search_vector(sender, instance, **kwargs):
+    search.update_search_vectors(Profile.objects.filter(pk__in=getattr(instance, '_profile_ids', [])))
+
+@receiver(post_save, sender=CustomUser)
+def update_email_search_vector(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """
+    User email is searched, so rebuild search vector of the user's Profile when it may have changed
+    """
+    if created or raw or (update_fields is not None and 'email' not in update_fields):
+        return
+    search.update_search_vectors(Profile.objects.filter(user=instance))
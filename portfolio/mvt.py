@@ -0,0 +1,102 @@
+"""
+Minimal Mapbox Vector Tile encoder for point layers.
+
+Used to render Profile tiles when the database can not do it with ST_AsMVT (e.g. SpatiaLite).
+Only the parts of the specification needed by a point layer are implemented, see
+https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+"""
+import struct
+
+EXTENT = 4096
+
+# Protobuf wire types
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+
+POINT = 1
+MOVE_TO = 1
+
+
+def encode_varint(value):
+    data = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            data.append(byte | 0x80)
+        else:
+            data.append(byte)
+            return bytes(data)
+
+
+def encode_key(field_number, wire_type):
+    return encode_varint((field_number << 3) | wire_type)
+
+
+def encode_bytes(field_number, value):
+    return encode_key(field_number, LENGTH_DELIMITED) + encode_varint(len(value)) + value
+
+
+def encode_packed(field_number, values):
+    return encode_bytes(field_number, b''.join(encode_varint(value) for value in values))
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def encode_value(value):
+    """
+    Encode feature property value as Value message
+    """
+    if isinstance(value, bool):
+        return encode_key(7, VARINT) + encode_varint(int(value))
+    if isinstance(value, int):
+        if value >= 0:
+            return encode_key(5, VARINT) + encode_varint(value)
+        return encode_key(6, VARINT) + encode_varint(zigzag(value))
+    if isinstance(value, float):
+        return encode_key(3, FIXED64) + struct.pack('<d', value)
+    return encode_bytes(1, str(value).encode('utf-8'))
+
+
+def encode_layer(name, features, extent=EXTENT):
+    """
+    Encode a point layer as vector tile
+    :param name: layer name
+    :param features: iterable of (id, x, y, properties) where x and y are already in tile coordinates,
+                     counted from top left of the tile between 0 and extent. id is None for a feature
+                     without id.
+    :param extent: tile extent
+    :return: encoded tile as bytes, empty if there is no feature
+    """
+    keys = dict()
+    values = dict()
+    encoded_features = []
+
+    for feature_id, x, y, properties in features:
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault((type(value), value), len(values)))
+
+        geometry = [(MOVE_TO & 0x7) | (1 << 3), zigzag(int(round(x))), zigzag(int(round(y)))]
+        feature = b'' if feature_id is None else encode_key(1, VARINT) + encode_varint(feature_id)
+        feature += (encode_packed(2, tags) +
+                   encode_key(3, VARINT) + encode_varint(POINT) +
+                   encode_packed(4, geometry))
+        encoded_features.append(encode_bytes(2, feature))
+
+    if not encoded_features:
+        return b''
+
+    layer = [encode_key(15, VARINT) + encode_varint(2), encode_bytes(1, name.encode('utf-8'))]
+    layer += encoded_features
+    layer += [encode_bytes(3, key.encode('utf-8')) for key in keys]
+    layer += [encode_bytes(4, encode_value(value)) for value_type, value in values]
+    layer.append(encode_key(5, VARINT) + encode_varint(extent))
+
+    return encode_bytes(3, b''.join(layer))
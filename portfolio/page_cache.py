@@ -0,0 +1,56 @@
+"""
+Cache of the Profile shown on profile page, per user.
+
+Profile is cached with its Expertise prefetched, so a cached profile page does not query Profile at all.
+It is removed when the Profile or its Expertise change. Keys include the home map cache version, which is
+bumped when an Expertise changes, because Expertise names are shown on the page too.
+
+Removal only reaches other processes through a shared cache, see PROFILE_MAP_CACHE_TIMEOUT. So a user always
+sees their own edit on every process, Profile is cached with the revision kept in the user's session (stored in
+database), which ProfileEditView changes when the Profile is saved. Cached Profile of another revision is not used.
+"""
+import uuid
+
+from django.apps import apps
+from django.conf import settings
+
+from portfolio import map_cache
+
+SESSION_KEY = 'profile_page_revision'
+
+
+def profile_key(user_id, version=None):
+    return 'profile-page:v{}:{}'.format(version or map_cache.get_version(), user_id)
+
+
+def get_profile(user, session=None):
+    """
+    Get Profile of a user, from cache if it has not changed since it was cached
+    :param user: CustomUser object
+    :param session: session of the request, Profile cached before its revision changed is not used
+    :return: Profile object with Expertise prefetched
+    """
+    Profile = apps.get_model('portfolio', 'Profile')
+    key = profile_key(user.pk)
+    revision = session.get(SESSION_KEY, '') if session is not None else ''
+    cached = map_cache.get_cache().get(key)
+    if cached is not None and (session is None or cached[0] == revision):
+        return cached[1]
+
+    profile = Profile.objects.prefetch_related('expertise').filter(user=user).first()
+    if profile is None:
+        # Profile is created on signup, but users created before that have none yet
+        profile = Profile.objects.create(user=user, first_name=user.first_name, last_name=user.last_name)
+    map_cache.get_cache().set(key, (revision, profile), settings.PROFILE_MAP_CACHE_TIMEOUT)
+    return profile
+
+
+def invalidate_profile(user_id, session=None):
+    """
+    Remove cached Profile of a user
+    :param session: session of the request that changed the Profile, it gets a new revision so the user does
+                    not get the old page from another process
+    """
+    if session is not None:
+        session[SESSION_KEY] = uuid.uuid4().hex
+    map_cache.get_cache().delete(profile_key(user_id))
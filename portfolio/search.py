@@ -0,0 +1,120 @@
+"""
+Profile search.
+
+Every Profile has a search_vector column with its name and user email (weight A), Expertise names (weight B)
+and address (weight C), indexed with GIN. It is filled with one UPDATE by update_search_vectors(), called by
+signal receivers when any of those change, and by import_profiles and rebuild_search_vectors.
+Search needs PostgreSQL full text search and pg_trgm. On other databases vectors are not filled, and
+ProfileSearchView answers that search is not available.
+
+Each search word matches as a prefix of a vector word. The search text is also compared with first and last name
+using pg_trgm similarity, so names with a typo are still found. Results are sorted by rank, and paged with a
+(rank, id) cursor instead of OFFSET.
+"""
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+from django.db import connections
+from django.db.models import DecimalField, F, OuterRef, Q, Subquery, TextField
+from django.db.models.functions import Cast, Greatest
+
+from portfolio.geo import bbox_to_polygon
+
+# Letters and digits, which may be joined by '.', '@' or '-' like in email. Other characters are tsquery operators.
+WORD = re.compile(r'\w(?:[\w.@-]*\w)?')
+# Rank is compared exactly in the cursor, so it is rounded to a fixed number of decimal places
+RANK_FIELD = DecimalField(max_digits=12, decimal_places=6)
+
+
+def search_vector():
+    """
+    :return: expression of Profile search vector, to be used in QuerySet.update()
+    """
+    Profile = apps.get_model('portfolio', 'Profile')
+    CustomUser = apps.get_model(settings.AUTH_USER_MODEL)
+    config = settings.PROFILE_SEARCH_CONFIG
+    expertise_names = Profile.expertise.through.objects.filter(profile_id=OuterRef('pk')).order_by() \
+        .values('profile_id').annotate(names=StringAgg('expertise__name', ' ')).values('names')
+    email = CustomUser.objects.filter(pk=OuterRef('user_id')).values('email')
+
+    return (SearchVector('first_name', 'last_name', weight='A', config=config) +
+            SearchVector(Subquery(email), weight='A', config=config) +
+            SearchVector(Subquery(expertise_names, output_field=TextField()), weight='B', config=config) +
+            SearchVector('address', weight='C', config=config))
+
+
+def update_search_vectors(queryset):
+    """
+    Rebuild search vector of Profile in a QuerySet
+    :return: number of updated Profile
+    """
+    if not is_available(queryset.db):
+        return 0
+    return queryset.order_by().update(search_vector=search_vector())
+
+
+def is_available(using='default'):
+    """
+    :return: True if database can search Profile, i.e. is PostgreSQL
+    """
+    return connections[using].vendor == 'postgresql'
+
+
+def parse_query(value):
+    """
+    :param value: q query parameter
+    :return: list of search words
+    """
+    words = WORD.findall(value or '')
+    if not words:
+        raise ValueError('q must contain at least one word')
+    return words
+
+
+def parse_cursor(value):
+    """
+    :param value: cursor query parameter, 'rank_id' of the last Profile of previous page
+    :return: tuple of (rank, id), or None
+    """
+    if not value:
+        return None
+    try:
+        rank, pk = value.split('_')
+        return Decimal(rank), int(pk)
+    except (ValueError, InvalidOperation):
+        raise ValueError('cursor is not valid')
+
+
+def search(words, bbox=None, cursor=None):
+    """
+    Search Profile
+    :param words: list of search words, from parse_query()
+    :param bbox: tuple of (west, south, east, north), only return Profile inside it
+    :param cursor: (rank, id) of the last Profile of previous page, from parse_cursor()
+    :return: QuerySet of Profile with `rank`, sorted by rank. Slice it to get a page.
+    """
+    Profile = apps.get_model('portfolio', 'Profile')
+    text = ' '.join(words)
+    query = SearchQuery(' & '.join('{}:*'.format(word) for word in words), config=settings.PROFILE_SEARCH_CONFIG,
+                        search_type='raw')
+
+    queryset = Profile.objects.filter(Q(search_vector=query) | Q(first_name__trigram_similar=text) |
+                                      Q(last_name__trigram_similar=text))
+    if bbox is not None:
+        queryset = queryset.filter(location__intersects=bbox_to_polygon(bbox))
+
+    rank = SearchRank(F('search_vector'), query) + Greatest(TrigramSimilarity('first_name', text),
+                                                            TrigramSimilarity('last_name', text))
+    queryset = queryset.annotate(rank=Cast(rank, RANK_FIELD))
+    if cursor is not None:
+        rank, pk = cursor
+        queryset = queryset.filter(Q(rank__lt=rank) | Q(rank=rank, pk__lt=pk))
+    return queryset.map_listing().order_by('-rank', '-pk')
+
+
+def next_cursor(profile):
+    return '{}_{}'.format(profile.rank, profile.pk)
@@ -0,0 +1,69 @@
+from portfolio.templatetags.portfolio_tags import expertises_to_comma_separated_string
+from portfolio.thumbnails import photo_urls
+
+# Width of photo in map popup
+POPUP_PHOTO_WIDTH = 210
+
+
+def profile_to_feature(profile):
+    """
+    Convert Profile object to GeoJSON Feature, containing the data shown in map popup
+    :param profile: Profile object, preferably from ProfileQuerySet.map_listing(). Profile without location
+                    has null geometry.
+    :return: dictionary of GeoJSON Feature
+    """
+    if hasattr(profile, 'expertise_names'):
+        expertise = profile.expertise_names or ''
+    else:
+        expertise = expertises_to_comma_separated_string(profile.expertise.all())
+    photo, photo_webp = photo_urls(profile.photo, profile.photo_status, POPUP_PHOTO_WIDTH)
+
+    return {
+        'type': 'Feature',
+        'id': profile.pk,
+        'geometry': {
+            'type': 'Point',
+            'coordinates': [profile.location.x, profile.location.y],
+        } if profile.location is not None else None,
+        'properties': {
+            'name': '{} {}'.format(profile.first_name, profile.last_name).strip(),
+            'email': profile.user.email,
+            'phone': str(profile.phone),
+            'address': profile.address,
+            'expertise': expertise,
+            'photo': photo,
+            'photo_webp': photo_webp,
+        },
+    }
+
+
+def cluster_to_feature(lon, lat, count):
+    """
+    Convert cluster centroid to GeoJSON Feature
+    :param lon: longitude of cluster centroid
+    :param lat: latitude of cluster centroid
+    :param count: number of Profile in the cluster
+    :return: dictionary of GeoJSON Feature
+    """
+    return {
+        'type': 'Feature',
+        'geometry': {
+            'type': 'Point',
+            'coordinates': [lon, lat],
+        },
+        'properties': {
+            'count': count,
+        },
+    }
+
+
+def feature_collection(features, **extra):
+    """
+    Wrap GeoJSON Features into FeatureCollection
+    :param features: iterable of GeoJSON Feature dictionary
+    :param extra: additional top-level members, e.g. bbox or zoom
+    :return: dictionary of GeoJSON FeatureCollection
+    """
+    collection = {'type': 'FeatureCollection', 'features': list(features)}
+    collection.update(extra)
+    return collection
@@ -1,4 +1,8 @@
 from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html
+
+from portfolio import thumbnails
 
 register = template.Library()
 
@@ -11,4 +15,38 @@ def expertises_to_comma_separated_string(queryset):
     :return: Comma-separated string containing User Expertise
     """
     string = ", ".join(str(obj.name) for obj in queryset)
-    return string
\ No newline at end of file
+    return string
+
+
+@register.filter(name='thumbnail_url')
+def thumbnail_url(photo, width):
+    """
+    Get URL of JPEG derivative of a photo for a display width
+    :param photo: FieldFile of Profile photo
+    :param width: display width in pixel
+    :return: URL of the derivative, or empty string if there is no photo
+    """
+    if not photo:
+        return ''
+    return thumbnails.thumbnail_url(photo, int(width))
+
+
+@register.simple_tag
+def profile_photo(photo, width, css_class='', status='ready'):
+    """
+    Render Profile photo as <picture> with WebP and JPEG derivatives that fit the display width,
+    or the default avatar if there is no photo or it is still processed
+    :param photo: FieldFile of Profile photo
+    :param width: display width in pixel
+    :param css_class: class of <img>
+    :param status: Profile photo_status
+    """
+    src, webp = thumbnails.photo_urls(photo, status, int(width))
+    if src is None:
+        return format_html('<img src="{}" class="{}" width="{}" alt="avatar">', static('images/avatar.png'),
+                           css_class, width)
+    if webp is None:
+        return format_html('<img src="{}" class="{}" width="{}" alt="avatar">', src, css_class, width)
+    return format_html('<picture><source srcset="{}" type="image/webp">'
+                       '<img src="{}" class="{}" width="{}" alt="avatar"></picture>',
+                       webp, src, css_class, width)
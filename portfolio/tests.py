@@ -1,12 +1,33 @@
-from django.urls import resolve, reverse_lazy as _
-from django.test import TestCase, override_settings
+from django.conf import settings
+from django.urls import get_resolver, resolve, reverse_lazy as _
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
+from django.contrib.gis.geos import Point
 from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import CommandError, call_command
+from django.http import StreamingHttpResponse
+from portfolio.admin import ProfileAdmin
+from project import asgi_handler, db_router, instrumentation, staticfiles
+from project.asgi_handler import WSGIToASGIHandler
+from project.staticfiles import StaticFileHandler
+from portfolio import (benchmarks, checks, clustering, exporters, facets, flatgeobuf, importers, jobs, map_cache,
+                       page_cache, search, thumbnails, tiles)
+from portfolio.templatetags.portfolio_tags import profile_photo
 from portfolio.views import HomePageView
 from portfolio.forms import ProfileForm
-from portfolio.models import Profile
-from io import BytesIO
+from portfolio.models import Expertise, Job, Profile
+from io import BytesIO, StringIO
+from PIL import Image
+from unittest import mock
+import asyncio
 import base64 # for testing image upload
+import gzip
+import json
+import os
+import struct
 import tempfile # set tempdir for media
 
 def setup_test_data(cls):
@@ -23,7 +44,7 @@ def setup_test_data(cls):
     cls.password = cls.credentials['password']
     cls.user = get_user_model().objects.create_user(username=cls.username, email=cls.email,
                                                     password=cls.password)
-    cls.profile = Profile.objects.create(user=cls.user)
+    cls.profile = Profile.objects.get(user=cls.user)  # created on signup
     cls.photo = InMemoryUploadedFile(
         BytesIO(base64.b64decode(TEST_IMAGE)),  # use io.BytesIO
         field_name='tempfile',
@@ -47,6 +68,85 @@ def setup_test_data(cls):
     }
 
 
+def create_profile(username, location):
+    """
+    Create a user, and set location of the Profile created on signup
+    :return: Profile object
+    """
+    user = get_user_model().objects.create_user(username=username, email='{}@gmail.com'.format(username),
+                                                password='secret')
+    profile = Profile.objects.get(user=user)
+    profile.location = location
+    profile.save()
+    return profile
+
+
+def read_varint(data, position):
+    value, shift = 0, 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, position
+
+
+def read_packed(data):
+    values, position = [], 0
+    while position < len(data):
+        value, position = read_varint(data, position)
+        values.append(value)
+    return values
+
+
+def read_fields(data):
+    """
+    Decode protobuf message into list of (field number, value), value is bytes for length-delimited fields
+    """
+    fields, position = [], 0
+    while position < len(data):
+        key, position = read_varint(data, position)
+        field_number, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            value, position = read_varint(data, position)
+        elif wire_type == 1:
+            value, position = struct.unpack('<d', data[position:position + 8])[0], position + 8
+        elif wire_type == 5:
+            value, position = struct.unpack('<f', data[position:position + 4])[0], position + 4
+        else:
+            length, position = read_varint(data, position)
+            value, position = data[position:position + length], position + length
+        fields.append((field_number, value))
+    return fields
+
+
+def decode_tile(data):
+    """
+    Decode point layers of a vector tile
+    :return: dictionary of {layer name: list of (feature id, (x, y), properties)}
+    """
+    layers = {}
+    for field_number, layer_data in read_fields(data):
+        layer = read_fields(layer_data)
+        keys = [value.decode() for number, value in layer if number == 3]
+        values = []
+        for number, value in layer:
+            if number == 4:
+                (value_type, decoded), = read_fields(value)
+                values.append(decoded.decode() if value_type == 1 else decoded)
+        features = []
+        for number, feature_data in layer:
+            if number != 2:
+                continue
+            feature = dict(read_fields(feature_data))
+            tags, geometry = read_packed(feature.get(2, b'')), read_packed(feature[4])
+            features.append((feature.get(1), tuple((value >> 1) ^ -(value & 1) for value in geometry[1:3]),
+                             {keys[tags[i]]: values[tags[i + 1]] for i in range(0, len(tags), 2)}))
+        layers[dict(layer)[1].decode()] = features
+    return layers
+
+
 class HomeTests(TestCase):
     """
     TestCase for HomeView
@@ -136,6 +236,10 @@ class ProfileViewTests(TestCase):
         self.login()
         self.assertEquals(self.response.status_code, 200)
 
+    def setUp(self):
+        # cache is not rolled back between tests, so every test starts with empty cache
+        map_cache.get_cache().clear()
+
     def test_profile_object_created_after_access_profile_view(self):
         """
         After login for the first time and open profile page, Profile will be automatically created
@@ -143,6 +247,58 @@ class ProfileViewTests(TestCase):
         self.login()
         self.assertEquals(1,Profile.objects.filter(user=self.user).count())
 
+    def test_profile_created_on_signup(self):
+        """
+        Profile is created together with the user, with the user's name
+        """
+        user = get_user_model().objects.create_user(username='testuser2', email='testuser2@gmail.com',
+                                                    password='secret', first_name='Budi')
+        self.assertEqual(Profile.objects.get(user=user).first_name, 'Budi')
+
+    def test_profile_created_for_user_without_profile(self):
+        """
+        User created before Profile was created on signup gets one when opening profile page
+        """
+        Profile.objects.filter(user=self.user).delete()
+        self.login()
+        self.assertEquals(self.response.status_code, 200)
+        self.assertEquals(1, Profile.objects.filter(user=self.user).count())
+
+    def test_profile_read_once_and_cached(self):
+        """
+        Profile page reads Profile once, then uses the cached Profile until it changes
+        """
+        self.client.login(email=self.email, password=self.password)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(_('profile'))
+        profile_queries = [query['sql'] for query in queries if Profile._meta.db_table in query['sql']]
+        self.assertEqual(len(profile_queries), 2)  # Profile and its prefetched Expertise
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(_('profile'))
+        self.assertFalse([query['sql'] for query in queries if Profile._meta.db_table in query['sql']])
+
+        profile = Profile.objects.get(pk=self.profile.pk)
+        profile.address = 'Purworejo'
+        profile.save()
+        self.assertContains(self.client.get(_('profile')), 'Purworejo')
+
+    def test_own_edit_not_hidden_by_other_process_cache(self):
+        """
+        After editing, the user gets the saved Profile even when the cache still has the old one, e.g. a local
+        memory cache of another process
+        """
+        self.client.login(email=self.email, password=self.password)
+        self.client.get(_('profile'))
+        key = page_cache.profile_key(self.user.pk)
+        stale = map_cache.get_cache().get(key)
+
+        response = self.client.post(_('profile_edit'), data={'first_name': 'Budi', 'last_name': 'Istiadi',
+                                                             'address': 'Purworejo'})
+        self.assertEquals(response.status_code, 302)
+        map_cache.get_cache().set(key, stale)
+        self.assertContains(self.client.get(_('profile')), 'Purworejo')
+
 
 class ProfileEditTest(TestCase):
     """
@@ -214,6 +370,1522 @@ class ProfileEditTest(TestCase):
         self.assertEqual(self.form.is_valid(), False)
 
 
+
+class ProfileGeoJSONTests(TestCase):
+    """
+    TestCase for ProfileGeoJSONView
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        setup_test_data(cls)
+        cls.profile.first_name = 'Budi'
+        cls.profile.location = Point(110.0093, -7.7129, srid=4326)
+        cls.profile.save()
+
+        # Profile outside Indonesia
+        cls.profile2 = create_profile('testuser2', Point(13.4050, 52.5200, srid=4326))
+
+    def test_geojson_status_code(self):
+        """
+        Map API can be accessed without login
+        """
+        response = self.client.get(_('profile_geojson'))
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.json()['type'], 'FeatureCollection')
+
+    def test_geojson_without_bbox_returns_all_profile(self):
+        """
+        Without bbox, every Profile which has location is returned
+        """
+        response = self.client.get(_('profile_geojson'))
+        self.assertEquals(len(response.json()['features']), 2)
+
+    def test_geojson_bbox_filter(self):
+        """
+        Only Profile inside bbox is returned
+        """
+        response = self.client.get(_('profile_geojson'), {'bbox': '95,-11,141,6', 'zoom': 5})
+        features = response.json()['features']
+        self.assertEquals(len(features), 1)
+        self.assertEquals(features[0]['id'], self.profile.pk)
+        self.assertEquals(features[0]['properties']['email'], self.email)
+
+    def test_geojson_limit(self):
+        """
+        Client can limit the number of returned Profile
+        """
+        response = self.client.get(_('profile_geojson'), {'limit': 1})
+        self.assertEquals(len(response.json()['features']), 1)
+
+    def test_geojson_invalid_bbox(self):
+        """
+        Invalid bbox returns bad request
+        """
+        for bbox in ['95,-11,141', 'nan,-11,141,6', '95,-11,inf,6', '200,-11,210,6']:
+            response = self.client.get(_('profile_geojson'), {'bbox': bbox})
+            self.assertEquals(response.status_code, 400)
+
+    def test_geojson_query_count_does_not_depend_on_profile_count(self):
+        """
+        Map listing uses the same number of queries however many Profile (and Expertise) it returns
+        """
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(_('profile_geojson'))
+
+        expertises = [Expertise.objects.create(name='Expertise {}'.format(i)) for i in range(3)]
+        for i in range(10):
+            profile = create_profile('mapuser{}'.format(i), Point(110 + i / 100, -7.7, srid=4326))
+            profile.expertise.set(expertises)
+
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(_('profile_geojson'))
+        self.assertEquals(len(response.json()['features']), 12)
+        self.assertEquals(response.json()['features'][0]['properties']['expertise'],
+                          'Expertise 0, Expertise 1, Expertise 2')
+        self.assertEquals(len(few), len(many))
+
+    def test_geojson_gzip(self):
+        """
+        Response is compressed if client accepts gzip
+        """
+        response = self.client.get(_('profile_geojson'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEquals(response['Content-Encoding'], 'gzip')
+
+
+
+class ProfileClusterTests(TestCase):
+    """
+    TestCase for server-side clustering and ProfileClusterView
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        setup_test_data(cls)
+        cls.profile.location = Point(110.0093, -7.7129, srid=4326)
+        cls.profile.save()
+
+        for i, location in enumerate([Point(110.0193, -7.7229, srid=4326), Point(13.4050, 52.5200, srid=4326)]):
+            create_profile('clusteruser{}'.format(i), location)
+
+    def setUp(self):
+        # cache is not rolled back between tests, so every test starts with empty clusters
+        clustering.invalidate_clusters()
+
+    def test_world_zoom_clusters(self):
+        """
+        At world zoom, nearby Profile are grouped into one cluster
+        """
+        response = self.client.get(_('profile_clusters'), {'zoom': 0})
+        counts = sorted(feature['properties']['count'] for feature in response.json()['features'])
+        self.assertEquals(counts, [1, 2])
+
+    def test_clusters_bbox_filter(self):
+        """
+        Only clusters inside bbox are returned
+        """
+        response = self.client.get(_('profile_clusters'), {'zoom': 4, 'bbox': '95,-11,141,6'})
+        features = response.json()['features']
+        self.assertEquals(len(features), 1)
+        self.assertEquals(features[0]['properties']['count'], 2)
+
+    def test_cached_clusters(self):
+        """
+        Clusters of low zoom levels are cached until a Profile moves
+        """
+        clustering.get_clusters((-180, -90, 180, 90), 0)
+        with self.assertNumQueries(0):
+            clusters = clustering.get_clusters((-180, -90, 180, 90), 0)
+        self.assertEquals(sorted(count for lon, lat, count in clusters), [1, 2])
+
+        profile = Profile.objects.get(pk=self.profile.pk)
+        profile.location = Point(13.4150, 52.5300, srid=4326)
+        profile.save()
+        clusters = clustering.get_clusters((-180, -90, 180, 90), 0)
+        self.assertEquals(sorted(count for lon, lat, count in clusters), [1, 2])
+        self.assertAlmostEqual(max(clusters, key=lambda cluster: cluster[2])[0], 13.41, places=2)
+
+    def test_moved_profile_only_rebuilds_its_blocks(self):
+        """
+        Moving a Profile only rebuilds the cached blocks around its location
+        """
+        zoom = 3
+        clustering.get_clusters((-180, -90, 180, 90), zoom)
+        version = clustering.get_version()
+        java_key, berlin_key = [
+            clustering.block_key(zoom, clustering.cell_to_block(clustering.lonlat_to_cell(lon, lat, zoom)), version)
+            for lon, lat in [(110.0093, -7.7129), (13.4050, 52.5200)]]
+        self.assertNotEqual(java_key, berlin_key)
+
+        profile = Profile.objects.get(pk=self.profile.pk)
+        profile.location = Point(110.0293, -7.7329, srid=4326)
+        profile.save()
+        map_cache = clustering.get_cache()
+        self.assertIsNone(map_cache.get(java_key))
+        self.assertIsNotNone(map_cache.get(berlin_key))
+
+        # only the removed block is aggregated again
+        with self.assertNumQueries(1):
+            clusters = clustering.get_clusters((-180, -90, 180, 90), zoom)
+        self.assertEquals(sorted(count for lon, lat, count in clusters), [1, 2])
+        self.assertAlmostEqual(max(clusters, key=lambda cluster: cluster[2])[0], 110.0243, places=4)
+
+    @override_settings(PROFILE_CLUSTER_CACHE_MAX_ZOOM=2)
+    def test_clusters_above_cache_max_zoom(self):
+        """
+        Above PROFILE_CLUSTER_CACHE_MAX_ZOOM, clusters inside bbox are aggregated in one query
+        """
+        with self.assertNumQueries(1):
+            clusters = clustering.get_clusters((95, -11, 141, 6), 4)
+        self.assertEquals(clusters, clustering.get_clusters((95, -11, 141, 6), 4))
+        self.assertEquals([count for lon, lat, count in clusters], [2])
+        self.assertAlmostEqual(clusters[0][0], 110.0143, places=4)
+        self.assertAlmostEqual(clusters[0][1], -7.7179, places=4)
+
+        # grid of the database matches cells computed in Python
+        grid = clustering.build_grid(4)
+        self.assertEquals(sorted(grid), sorted({clustering.lonlat_to_cell(lon, lat, 4)
+                                                for lon, lat in [(110.0093, -7.7129), (13.4050, 52.5200)]}))
+
+    def test_filtered_clusters(self):
+        """
+        Clusters of Profile with an Expertise only count those Profile
+        """
+        expertise = Expertise.objects.create(name='Cluster Expertise')
+        self.profile.expertise.add(expertise)
+        response = self.client.get(_('profile_clusters'), {'zoom': 0, 'expertise': str(expertise.pk)})
+        counts = [feature['properties']['count'] for feature in response.json()['features']]
+        self.assertEquals(counts, [1])
+
+    def test_clusters_updated_when_profile_deleted(self):
+        """
+        Deleted Profile is removed from cached clusters
+        """
+        clustering.get_clusters((-180, -90, 180, 90), 0)
+        Profile.objects.get(pk=self.profile.pk).delete()
+        clusters = clustering.get_clusters((-180, -90, 180, 90), 0)
+        self.assertEquals(sorted(count for lon, lat, count in clusters), [1, 1])
+
+    @override_settings(PROFILE_CLUSTER_MAX_ZOOM=10)
+    def test_clusters_zoom_above_max_zoom(self):
+        """
+        Above PROFILE_CLUSTER_MAX_ZOOM, map should use profile API instead
+        """
+        response = self.client.get(_('profile_clusters'), {'zoom': 11})
+        self.assertEquals(response.status_code, 400)
+
+
+
+@override_settings(PROFILE_TILE_CACHE_DIR=tempfile.mkdtemp())  # keep test tiles out of project tile cache
+class ProfileTileTests(TestCase):
+    """
+    TestCase for ProfileTileView and vector tile cache
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        setup_test_data(cls)
+        cls.profile.location = Point(110.0093, -7.7129, srid=4326)
+        cls.profile.save()
+        cls.tile = (5,) + tiles.lonlat_to_tile(110.0093, -7.7129, 5)
+
+    def get_tile(self, z, x, y):
+        return self.client.get(_('profile_tile', kwargs={'z': z, 'x': x, 'y': y}))
+
+    def test_tile_contains_profile(self):
+        """
+        Tile which contains a Profile is not empty
+        """
+        response = self.get_tile(*self.tile)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        self.assertTrue(len(response.content) > 0)
+
+    def test_empty_tile(self):
+        """
+        Tile without Profile is empty
+        """
+        response = self.get_tile(5, 0, 0)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(len(response.content), 0)
+
+    def test_invalid_tile(self):
+        """
+        Tile outside the world does not exist
+        """
+        response = self.get_tile(2, 4, 0)
+        self.assertEquals(response.status_code, 404)
+
+    def test_tile_zoom_too_large(self):
+        """
+        Zoom above the maximum map zoom does not exist, instead of failing to compute the tile size
+        """
+        self.assertEquals(self.get_tile(23, 0, 0).status_code, 404)
+        self.assertEquals(self.get_tile(1100, 0, 0).status_code, 404)
+
+    def test_backends_render_same_tile(self):
+        """
+        PostGIS and the Python encoder give the same features, with id as a property
+        """
+        if connection.vendor != 'postgresql':
+            self.skipTest('ST_AsMVT needs PostGIS')
+        self.profile.expertise.add(Expertise.objects.create(name='GIS'))
+        postgis = decode_tile(tiles.render_tile_postgis(*self.tile))['profiles']
+        python = decode_tile(tiles.render_tile_python(*self.tile))['profiles']
+
+        self.assertEquals([(feature_id, properties) for feature_id, point, properties in postgis],
+                          [(feature_id, properties) for feature_id, point, properties in python])
+        self.assertEquals(postgis[0][2]['id'], self.profile.pk)
+        for (postgis_x, postgis_y), (python_x, python_y) in zip([feature[1] for feature in postgis],
+                                                                [feature[1] for feature in python]):
+            self.assertLessEqual(abs(postgis_x - python_x), 1)
+            self.assertLessEqual(abs(postgis_y - python_y), 1)
+
+    def test_tile_cache_invalidated_on_save(self):
+        """
+        Cached tile is removed when a Profile inside it is saved
+        """
+        self.get_tile(*self.tile)
+        self.assertTrue(os.path.isfile(tiles.tile_path(*self.tile)))
+        profile = Profile.objects.get(pk=self.profile.pk)
+        profile.first_name = 'Budi'
+        profile.save()
+        self.assertFalse(os.path.isfile(tiles.tile_path(*self.tile)))
+
+    def test_tile_cache_invalidated_on_location_changed_in_place(self):
+        """
+        Moving a Profile by changing its location object still removes the tile it was in
+        """
+        profile = Profile.objects.get(pk=self.profile.pk)
+        profile.save()
+        self.get_tile(*self.tile)
+        profile.location.x, profile.location.y = 13.4050, 52.5200
+        profile.save()
+        self.assertFalse(os.path.isfile(tiles.tile_path(*self.tile)))
+
+
+
+class ProfileMapCacheTests(TestCase):
+    """
+    TestCase for ProfileTileGeoJSONView and its cache
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        setup_test_data(cls)
+        cls.profile.location = Point(110.0093, -7.7129, srid=4326)
+        cls.profile.save()
+        cls.tile = (16,) + tiles.lonlat_to_tile(110.0093, -7.7129, 16)
+
+    def setUp(self):
+        # cache is not rolled back between tests, so every test starts with empty cache
+        map_cache.get_cache().clear()
+
+    def get_tile(self):
+        z, x, y = self.tile
+        return self.client.get(_('profile_tile_geojson', kwargs={'z': z, 'x': x, 'y': y}))
+
+    def test_tile_contains_profile(self):
+        """
+        Tile document contains Profile inside it
+        """
+        features = self.get_tile().json()['features']
+        self.assertEquals(len(features), 1)
+        self.assertEquals(features[0]['id'], self.profile.pk)
+
+    def test_cached_tile_does_not_query_database(self):
+        """
+        Second request of the same tile is served from cache
+        """
+        self.get_tile()
+        with self.assertNumQueries(0):
+            self.get_tile()
+
+    def test_cached_tile_invalidated_on_save(self):
+        """
+        Cached tile is removed when a Profile inside it is saved
+        """
+        self.get_tile()
+        profile = Profile.objects.get(pk=self.profile.pk)
+        profile.first_name = 'Joko'
+        profile.last_name = 'Susilo'
+        profile.save()
+        self.assertEquals(self.get_tile().json()['features'][0]['properties']['name'], 'Joko Susilo')
+
+    def test_cached_tile_invalidated_on_expertise_change(self):
+        """
+        Cached tile is removed when Expertise of a Profile inside it changes
+        """
+        self.get_tile()
+        self.profile.expertise.add(Expertise.objects.create(name='Python'))
+        self.assertEquals(self.get_tile().json()['features'][0]['properties']['expertise'], 'Python')
+
+
+
+class ProfileNearbyTests(TestCase):
+    """
+    TestCase for proximity search, ProfileQuerySet.nearby and ProfileNearbyView
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        setup_test_data(cls)
+        cls.center = Point(110.0, -7.7, srid=4326)
+        cls.python = Expertise.objects.create(name='Python')
+        cls.profile.delete()
+
+        # Profile about 1 km, 5 km, and 50 km east of center
+        cls.profiles = []
+        for i, lon in enumerate([110.009, 110.045, 110.45]):
+            cls.profiles.append(create_profile('nearbyuser{}'.format(i), Point(lon, -7.7, srid=4326)))
+        cls.profiles[1].expertise.add(cls.python)
+
+    def nearby(self, **params):
+        params.update({'lat': self.center.y, 'lon': self.center.x})
+        return self.client.get(_('profile_nearby'), params)
+
+    def test_queryset_sorted_by_distance(self):
+        """
+        nearby() sorts Profile by distance and annotates the distance in metres
+        """
+        profiles = list(Profile.objects.nearby(self.center))
+        self.assertEquals([profile.pk for profile in profiles], [profile.pk for profile in self.profiles])
+        self.assertAlmostEqual(profiles[0].distance.m, 1000, delta=50)
+
+    def test_radius(self):
+        """
+        Only Profile within radius is returned
+        """
+        features = self.nearby(radius=10).json()['features']
+        self.assertEquals([feature['id'] for feature in features], [self.profiles[0].pk, self.profiles[1].pk])
+
+    def test_k_nearest(self):
+        """
+        Only K nearest Profile is returned
+        """
+        features = self.nearby(k=2).json()['features']
+        self.assertEquals([feature['id'] for feature in features], [self.profiles[0].pk, self.profiles[1].pk])
+        self.assertTrue(features[0]['properties']['distance'] < features[1]['properties']['distance'])
+
+    def test_expertise_filter(self):
+        """
+        Proximity search can be filtered by Expertise
+        """
+        features = self.nearby(k=2, expertise=self.python.pk).json()['features']
+        self.assertEquals([feature['id'] for feature in features], [self.profiles[1].pk])
+
+    def test_invalid_point(self):
+        """
+        Search without valid point returns bad request
+        """
+        response = self.client.get(_('profile_nearby'), {'lat': 'abc', 'lon': 110})
+        self.assertEquals(response.status_code, 400)
+
+
+
+class ExpertiseFacetTests(TestCase):
+    """
+    TestCase for ExpertiseCount maintenance and ExpertiseFacetView
+    """
+    indonesia = '95,-11,141,6'
+    germany = '5,47,15,55'
+
+    @classmethod
+    def setUpTestData(cls):
+        setup_test_data(cls)
+        cls.python = Expertise.objects.create(name='Python')
+        cls.django = Expertise.objects.create(name='Django')
+        cls.profile.location = Point(110.0093, -7.7129, srid=4326)
+        cls.profile.save()
+        cls.profile.expertise.add(cls.python, cls.django)
+
+        cls.profile2 = create_profile('facetuser', Point(110.3695, -7.7956, srid=4326))
+        cls.profile2.expertise.add(cls.python)
+
+    def facets(self, bbox):
+        response = self.client.get(_('expertise_facets'), {'bbox': bbox})
+        return {expertise['name']: expertise['count'] for expertise in response.json()['expertise']}
+
+    def test_facet_counts_follow_location_changed_in_place(self):
+        """
+        Counts move with a Profile whose location object is changed instead of replaced
+        """
+        profile = Profile.objects.get(pk=self.profile2.pk)
+        profile.location.x, profile.location.y = 13.4050, 52.5200
+        profile.save()
+        self.assertEquals(self.facets(self.indonesia), {'Python': 1, 'Django': 1})
+        self.assertEquals(self.facets(self.germany), {'Python': 1})
+
+    def test_facet_counts(self):
+        """
+        Facets count Profile per Expertise inside the viewport, most common first
+        """
+        response = self.client.get(_('expertise_facets'), {'bbox': self.indonesia})
+        self.assertEquals([expertise['name'] for expertise in response.json()['expertise']], ['Python', 'Django'])
+        self.assertEquals(self.facets(self.indonesia), {'Python': 2, 'Django': 1})
+        self.assertEquals(self.facets(self.germany), {})
+
+    def test_facet_counts_after_remove(self):
+        """
+        Removed Expertise is uncounted, from either side of the relation
+        """
+        self.profile.expertise.remove(self.django)
+        self.python.profile_set.remove(self.profile2)
+        self.assertEquals(self.facets(self.indonesia), {'Python': 1})
+
+    def test_facet_counts_after_clear(self):
+        """
+        Cleared Expertise is uncounted
+        """
+        self.profile.expertise.clear()
+        self.assertEquals(self.facets(self.indonesia), {'Python': 1})
+
+    def test_facet_counts_after_move(self):
+        """
+        Counts follow Profile when it moves
+        """
+        profile = Profile.objects.get(pk=self.profile.pk)
+        profile.location = Point(13.4050, 52.5200, srid=4326)
+        profile.save()
+        self.assertEquals(self.facets(self.indonesia), {'Python': 1})
+        self.assertEquals(self.facets(self.germany), {'Python': 1, 'Django': 1})
+
+    def test_facet_counts_after_delete(self):
+        """
+        Deleted Profile is uncounted
+        """
+        Profile.objects.get(pk=self.profile2.pk).delete()
+        self.assertEquals(self.facets(self.indonesia), {'Python': 1, 'Django': 1})
+
+    def test_rebuild_counts(self):
+        """
+        Rebuilt counts are the same as incrementally maintained counts
+        """
+        facets.rebuild_counts()
+        self.assertEquals(self.facets(self.indonesia), {'Python': 2, 'Django': 1})
+
+    def test_filter_map_by_expertise(self):
+        """
+        Map API returns only Profile which has the selected Expertise
+        """
+        response = self.client.get(_('profile_geojson'), {'expertise': self.django.pk})
+        self.assertEquals([feature['id'] for feature in response.json()['features']], [self.profile.pk])
+
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), JOB_QUEUE_EAGER=True)  # process photo without worker
+class ProfilePhotoThumbnailTests(TestCase):
+    """
+    TestCase for Profile photo derivatives
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        setup_test_data(cls)
+
+    def save_photo(self):
+        form = ProfileForm(files={'photo': self.photo}, data=self.data, instance=Profile.objects.get(pk=self.profile.pk))
+        return form.save()
+
+    def derivative_paths(self, photo):
+        return [photo.storage.path(thumbnails.thumbnail_name(photo.name, size, ext))
+                for size in (64, 210, 400) for ext, pil_format in thumbnails.available_formats()]
+
+    def test_derivatives_generated_on_upload(self):
+        """
+        Every derivative is generated when photo is uploaded
+        """
+        profile = self.save_photo()
+        for path in self.derivative_paths(profile.photo):
+            self.assertTrue(os.path.isfile(path), path)
+
+    def test_derivatives_deleted_with_profile(self):
+        """
+        Derivatives are deleted together with Profile
+        """
+        profile = self.save_photo()
+        paths = self.derivative_paths(profile.photo)
+        Profile.objects.get(pk=profile.pk).delete()
+        for path in paths:
+            self.assertFalse(os.path.isfile(path), path)
+
+    def test_profile_photo_tag(self):
+        """
+        profile_photo renders the derivative that fits the display width
+        """
+        profile = self.save_photo()
+        html = profile_photo(profile.photo, 200)
+        self.assertIn('photo_210.jpg', html)
+        self.assertIn('<picture>', html)
+        self.assertIn('images/avatar.png', profile_photo(None, 200))
+
+    def test_photo_processed_by_worker(self):
+        """
+        Without eager queue, uploaded photo is processed by a job and shown as placeholder until it is done
+        """
+        with self.settings(JOB_QUEUE_EAGER=False):
+            profile = self.save_photo()
+        self.assertEqual(profile.photo_status, Profile.PHOTO_PROCESSING)
+        self.assertIn('images/avatar.png', profile_photo(profile.photo, 200, status=profile.photo_status))
+
+        job = Job.objects.get(name='process_photo', status=Job.PENDING)
+        self.assertEqual(jobs.claim_jobs(10), [job.pk])
+        self.assertEqual(jobs.run_job(job.pk), Job.DONE)
+        self.assertEqual(Profile.objects.get(pk=profile.pk).photo_status, Profile.PHOTO_READY)
+        for path in self.derivative_paths(profile.photo):
+            self.assertTrue(os.path.isfile(path), path)
+
+    def test_exif_stripped_and_rotated(self):
+        """
+        Photo is rotated according to its EXIF orientation, and its EXIF is removed
+        """
+        image = Image.new('RGB', (40, 20), (255, 0, 0))
+        exif = image.getexif()
+        exif[0x0112] = 6  # orientation: rotate 90 degrees clockwise
+        content = BytesIO()
+        image.save(content, 'JPEG', exif=exif.tobytes())
+        photo = InMemoryUploadedFile(content, field_name='tempfile', name='exif.jpg', content_type='image/jpeg',
+                                     size=len(content.getvalue()), charset=None)
+
+        form = ProfileForm(files={'photo': photo}, data=self.data, instance=Profile.objects.get(pk=self.profile.pk))
+        profile = form.save()
+        with Image.open(profile.photo.path) as saved:
+            self.assertEqual(saved.size, (20, 40))
+            self.assertNotIn('exif', saved.info)
+
+    def exif_photo(self):
+        image = Image.new('RGB', (40, 20), (255, 0, 0))
+        exif = image.getexif()
+        exif[0x010F] = 'Phone'  # camera make, photo has EXIF like a phone photo
+        content = BytesIO()
+        image.save(content, 'JPEG', exif=exif.tobytes())
+        return InMemoryUploadedFile(content, field_name='tempfile', name='phone.jpg', content_type='image/jpeg',
+                                    size=len(content.getvalue()), charset=None)
+
+    def test_mpo_photo_saved_as_jpeg(self):
+        """
+        Phone photo opened as MPO, which Pillow can not save, is normalized as JPEG without EXIF
+        """
+        open_photo = thumbnails.open_photo
+
+        def open_as_mpo(photo):
+            image = open_photo(photo)
+            image.format = 'MPO'
+            return image
+
+        with mock.patch('portfolio.thumbnails.open_photo', side_effect=open_as_mpo):
+            form = ProfileForm(files={'photo': self.exif_photo()}, data=self.data,
+                               instance=Profile.objects.get(pk=self.profile.pk))
+            profile = form.save()
+        self.assertEqual(Profile.objects.get(pk=profile.pk).photo_status, Profile.PHOTO_READY)
+        with Image.open(profile.photo.path) as saved:
+            self.assertEqual(saved.format, 'JPEG')
+            self.assertNotIn('exif', saved.info)
+
+    @override_settings(JOB_MAX_ATTEMPTS=1)
+    def test_failed_photo_not_served(self):
+        """
+        Photo that can not be processed is deleted with its EXIF, and the placeholder is shown
+        """
+        with mock.patch('portfolio.thumbnails.generate_thumbnails', side_effect=IOError('cannot process')):
+            form = ProfileForm(files={'photo': self.exif_photo()}, data=self.data,
+                               instance=Profile.objects.get(pk=self.profile.pk))
+            path = form.save().photo.path
+        profile = Profile.objects.get(pk=self.profile.pk)
+        self.assertEqual(profile.photo_status, Profile.PHOTO_FAILED)
+        self.assertFalse(profile.photo)
+        self.assertFalse(os.path.isfile(path))
+        self.assertIn('images/avatar.png', profile_photo(profile.photo, 200, status=profile.photo_status))
+
+
+class JobTests(TestCase):
+    """
+    TestCase for background job queue
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.calls = []
+        jobs.register('test_job', on_failure=lambda fail: cls.calls.append('failed'))(cls.handler)
+
+    @classmethod
+    def tearDownClass(cls):
+        jobs.HANDLERS.pop('test_job')
+        super().tearDownClass()
+
+    @classmethod
+    def handler(cls, fail):
+        cls.calls.append('run')
+        if fail:
+            raise IOError('cannot process')
+
+    def setUp(self):
+        self.calls[:] = []
+
+    def test_job_done(self):
+        """
+        Claimed job is run once and marked as done
+        """
+        job = jobs.enqueue('test_job', fail=False)
+        self.assertEqual(jobs.claim_jobs(10), [job.pk])
+        self.assertEqual(jobs.claim_jobs(10), [])
+        self.assertEqual(jobs.run_job(job.pk), Job.DONE)
+        self.assertEqual(self.calls, ['run'])
+
+    def test_job_retried_until_max_attempts(self):
+        """
+        Failed job is retried later, and marked as failed after its last attempt
+        """
+        job = jobs.enqueue('test_job', max_attempts=2, fail=True)
+        jobs.claim_jobs(10)
+        self.assertEqual(jobs.run_job(job.pk), Job.PENDING)
+        job.refresh_from_db()
+        self.assertIn('cannot process', job.last_error)
+        # retry is not due yet
+        self.assertEqual(jobs.claim_jobs(10), [])
+
+        Job.objects.filter(pk=job.pk).update(run_after=job.created_at)
+        self.assertEqual(jobs.claim_jobs(10), [job.pk])
+        self.assertEqual(jobs.run_job(job.pk), Job.FAILED)
+        self.assertEqual(self.calls, ['run', 'run', 'failed'])
+
+    def test_unknown_job(self):
+        """
+        Only registered job can be enqueued
+        """
+        with self.assertRaises(ValueError):
+            jobs.enqueue('unknown_job')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())  # override settings for media dir to avoid consuming our disk
+class ProfileSignalQueryTests(TestCase):
+    """
+    TestCase for queries made by Profile signal receivers
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        setup_test_data(cls)
+
+    def profile_queries(self, queries):
+        return [query['sql'] for query in queries if Profile._meta.db_table in query['sql']]
+
+    def test_unchanged_profile_save(self):
+        """
+        Saving loaded Profile without changes only updates the Profile row
+        """
+        profile = Profile.objects.get(pk=self.profile.pk)
+        with self.assertNumQueries(1):
+            profile.save()
+
+    def test_name_change_updates_user_name_only(self):
+        """
+        User is saved with only the changed name
+        """
+        profile = Profile.objects.select_related('user').get(pk=self.profile.pk)
+        profile.first_name = 'Budi'
+        with CaptureQueriesContext(connection) as queries:
+            profile.save()
+
+        user_updates = [query['sql'] for query in queries
+                        if query['sql'].startswith('UPDATE') and get_user_model()._meta.db_table in query['sql']]
+        self.assertEqual(len(user_updates), 1)
+        self.assertIn('first_name', user_updates[0])
+        self.assertNotIn('password', user_updates[0])
+        self.assertEqual(get_user_model().objects.get(pk=self.user.pk).first_name, 'Budi')
+
+    def test_photo_change_does_not_fetch_profile(self):
+        """
+        Old photo is deleted using the loaded photo name, without fetching Profile again
+        """
+        profile = ProfileForm(files={'photo': self.photo}, data=self.data,
+                              instance=Profile.objects.get(pk=self.profile.pk)).save()
+        old_path = profile.photo.path
+
+        profile.photo = None
+        with CaptureQueriesContext(connection) as queries:
+            profile.save()
+        self.assertEqual(len([sql for sql in self.profile_queries(queries) if sql.startswith('SELECT')]), 0)
+        self.assertFalse(os.path.isfile(old_path))
+
+        with CaptureQueriesContext(connection) as queries:
+            profile.delete()
+        self.assertEqual(len([sql for sql in self.profile_queries(queries)
+                              if sql.startswith('SELECT') and 'photo' in sql]), 0)
+
+    def test_raw_save_skips_receivers(self):
+        """
+        Raw save, e.g. from loaddata, does not run the receivers
+        """
+        profile = Profile.objects.get(pk=self.profile.pk)
+        profile.first_name = 'Raw'
+        profile.save_base(raw=True)
+        self.assertEqual(get_user_model().objects.get(pk=self.user.pk).first_name, '')
+
+
+@override_settings(PROFILE_TILE_CACHE_DIR=tempfile.mkdtemp())  # keep test tiles out of project tile cache
+class ImportProfilesTests(TestCase):
+    """
+    TestCase for import_profiles command
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        setup_test_data(cls)
+
+    def write_file(self, content, suffix):
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def import_file(self, content, suffix):
+        stderr = StringIO()
+        call_command('import_profiles', self.write_file(content, suffix), batch_size=2, stdout=StringIO(),
+                     stderr=stderr)
+        return stderr.getvalue()
+
+    def test_import_csv(self):
+        """
+        Users, Profile, Expertise and permission are created from CSV, invalid record is reported and skipped
+        """
+        errors = self.import_file('email,first_name,last_name,expertise,lon,lat\n'
+                                  'budi@gmail.com,Budi,Istiadi,Python;Django,110.0093,-7.7129\n'
+                                  'not-an-email,Ani,,,,\n'
+                                  'ani@gmail.com,Ani,,Python,,\n', '.csv')
+        self.assertIn('Record 2', errors)
+
+        profile = Profile.objects.get(user__email='budi@gmail.com')
+        self.assertEqual(profile.first_name, 'Budi')
+        self.assertEqual(profile.user.first_name, 'Budi')
+        self.assertEqual(sorted(profile.expertise.values_list('name', flat=True)), ['Django', 'Python'])
+        self.assertAlmostEqual(profile.location.x, 110.0093)
+        self.assertTrue(profile.user.has_perm('portfolio.change_profile'))
+        self.assertIsNone(Profile.objects.get(user__email='ani@gmail.com').location)
+        self.assertEqual(Expertise.objects.filter(name='Python').count(), 1)
+
+    def test_import_upserts_on_email(self):
+        """
+        Importing a user that already exists updates their Profile instead of creating another user
+        """
+        users = get_user_model().objects.count()
+        self.import_file('email,address,expertise\n{},Purworejo,Python\n'.format(self.email), '.csv')
+        self.assertEqual(get_user_model().objects.count(), users)
+        profile = Profile.objects.get(pk=self.profile.pk)
+        self.assertEqual(profile.address, 'Purworejo')
+        self.assertEqual(list(profile.expertise.values_list('name', flat=True)), ['Python'])
+
+    def test_import_keeps_fields_missing_from_record(self):
+        """
+        Records with different fields in one batch only update their own fields on existing Profile
+        """
+        Profile.objects.filter(pk=self.profile.pk).update(address='Purworejo')
+        other = create_profile('testuser2', Point(13.4050, 52.5200, srid=4326))
+        importers.ProfileImporter().run([{'email': self.email, 'lon': '110.0093', 'lat': '-7.7129'},
+                                         {'email': other.user.email, 'address': 'Berlin'}])
+
+        profile, other = Profile.objects.get(pk=self.profile.pk), Profile.objects.get(pk=other.pk)
+        self.assertEqual(profile.address, 'Purworejo')
+        self.assertAlmostEqual(profile.location.x, 110.0093)
+        self.assertEqual(other.address, 'Berlin')
+        self.assertAlmostEqual(other.location.x, 13.4050)
+
+    def test_import_refreshes_after_failure(self):
+        """
+        Batches committed before the file turns out to be truncated are counted in Expertise facets
+        """
+        features = [{'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [110 + i / 10, -7.7]},
+                     'properties': {'email': 'geo{}@gmail.com'.format(i), 'expertise': ['GIS']}} for i in range(2)]
+        content = json.dumps({'type': 'FeatureCollection', 'features': features})
+        path = self.write_file(content[:content.rindex('}', 0, -2)], '.geojson')
+
+        with self.assertRaises(CommandError):
+            call_command('import_profiles', path, batch_size=1, stdout=StringIO())
+        self.assertEqual(Profile.objects.filter(user__email='geo0@gmail.com').count(), 1)
+        gis = Expertise.objects.get(name='GIS')
+        self.assertEqual(facets.get_counts((95, -11, 141, 6)), {gis.pk: 1})
+
+    def test_import_geojson_in_small_chunks(self):
+        """
+        GeoJSON Features are read one by one, even when a Feature is split across chunks
+        """
+        features = [{'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [110 + i / 10, -7.7]},
+                     'properties': {'email': 'geo{}@gmail.com'.format(i), 'expertise': ['GIS']}} for i in range(5)]
+        path = self.write_file(json.dumps({'type': 'FeatureCollection', 'features': features}), '.geojson')
+        records = list(importers.read_geojson(path, chunk_size=7))
+        self.assertEqual([record['email'] for record in records], ['geo{}@gmail.com'.format(i) for i in range(5)])
+
+        call_command('import_profiles', path, stdout=StringIO())
+        self.assertEqual(Profile.objects.filter(user__email__startswith='geo', expertise__name='GIS').count(), 5)
+
+
+class ProfileExportTests(TestCase):
+    """
+    TestCase for ProfileExportView and export_profiles command
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        setup_test_data(cls)
+        cls.python = Expertise.objects.create(name='Python')
+        cls.profile.location = Point(110.0093, -7.7129, srid=4326)
+        cls.profile.save()
+        cls.profile.expertise.add(cls.python)
+        cls.profile2 = create_profile('testuser2', Point(13.4050, 52.5200, srid=4326))
+        cls.admin = get_user_model().objects.create_superuser(username='admin', email='admin@gmail.com',
+                                                              password='secret')
+
+    def export(self, export_format, **params):
+        self.client.login(email='admin@gmail.com', password='secret')
+        response = self.client.get(_('profile_export', args=[export_format]), params)
+        self.assertEquals(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_export_requires_permission(self):
+        """
+        Only user who can view every Profile can export them
+        """
+        self.client.login(email=self.email, password=self.password)
+        self.assertEquals(self.client.get(_('profile_export', args=['geojson'])).status_code, 403)
+
+    def test_export_geojson_filtered(self):
+        """
+        GeoJSON export is a valid FeatureCollection, filtered by bbox and Expertise
+        """
+        self.assertEquals(len(json.loads(self.export('geojson').decode())['features']), 2)
+
+        features = json.loads(self.export('geojson', bbox='95,-11,141,6').decode())['features']
+        self.assertEquals([feature['id'] for feature in features], [self.profile.pk])
+        self.assertEquals(features[0]['properties']['expertise'], 'Python')
+
+        features = json.loads(self.export('geojson', expertise=str(self.python.pk)).decode())['features']
+        self.assertEquals([feature['id'] for feature in features], [self.profile.pk])
+
+    def test_export_csv(self):
+        """
+        CSV export has a header and one row per Profile
+        """
+        lines = self.export('csv').decode().splitlines()
+        self.assertEquals(lines[0], 'id,first_name,last_name,email,phone,address,expertise,lon,lat')
+        self.assertEquals(len(lines), 3)
+
+    def test_export_flatgeobuf(self):
+        """
+        FlatGeobuf export has the magic bytes, a header, a spatial index and every feature
+        """
+        content = self.export('fgb')
+        self.assertTrue(content.startswith(flatgeobuf.MAGIC))
+        header_size = struct.unpack('<I', content[8:12])[0]
+        index_size = 3 * flatgeobuf.NODE_ITEM.size  # 2 leaves and the root
+        features = content[12 + header_size + index_size:]
+        first_size = struct.unpack('<I', features[:4])[0]
+        second_size = struct.unpack('<I', features[4 + first_size:8 + first_size])[0]
+        self.assertEquals(len(features), 8 + first_size + second_size)
+
+    def test_rows_read_in_chunks(self):
+        """
+        Expertise names are the same whatever the chunk size is
+        """
+        rows = list(exporters.iter_rows(exporters.export_queryset(), chunk_size=1))
+        self.assertEquals([properties['expertise'] for lon, lat, properties in rows], ['Python', ''])
+
+    def test_export_command(self):
+        """
+        export_profiles writes the export to a file
+        """
+        fd, path = tempfile.mkstemp(suffix='.geojson')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        call_command('export_profiles', path, bbox='95,-11,141,6', stdout=StringIO())
+        with open(path) as f:
+            self.assertEquals(len(json.load(f)['features']), 1)
+
+
+class ProfileAdminTests(TestCase):
+    """
+    TestCase for Profile changelist and map in admin
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        setup_test_data(cls)
+        for i in range(5):
+            create_profile('admintest{}'.format(i), Point(110.0 + i, -7.0, srid=4326))
+        cls.admin = get_user_model().objects.create_superuser(username='admin', email='admin@gmail.com',
+                                                              password='secret')
+
+    def setUp(self):
+        self.client.login(email='admin@gmail.com', password='secret')
+
+    def changelist_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(_('admin:portfolio_profile_changelist'))
+        self.assertEquals(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        """
+        User email of every row is selected with Profile, without a query per row
+        """
+        count = self.changelist_queries()
+        create_profile('admintest9', Point(120.0, -7.0, srid=4326))
+        self.assertEquals(self.changelist_queries(), count)
+
+    def test_keyset_pagination(self):
+        """
+        Next page is the Profile with id below the last id of the current page
+        """
+        with mock.patch.object(ProfileAdmin, 'list_per_page', 4):
+            response = self.client.get(_('admin:portfolio_profile_changelist'))
+            page = list(response.context['cl'].result_list)
+            self.assertEquals(len(page), 4)
+            next_cursor = response.context['cl'].next_cursor
+            self.assertEquals(next_cursor, page[-1].pk)
+            self.assertContains(response, '?after={}'.format(next_cursor))
+            result_count = response.context['cl'].result_count
+            self.assertEquals(result_count, Profile.objects.count())
+
+            response = self.client.get(_('admin:portfolio_profile_changelist'), {'after': next_cursor})
+            self.assertEquals([profile.pk for profile in response.context['cl'].result_list],
+                              list(Profile.objects.filter(pk__lt=next_cursor).order_by('-pk')
+                                   .values_list('pk', flat=True)[:4]))
+            # every page shows the count of every Profile, not only the ones after the cursor
+            self.assertEquals(response.context['cl'].result_count, result_count)
+
+    def test_search_by_email(self):
+        """
+        Searching user email finds the Profile without duplicate rows
+        """
+        response = self.client.get(_('admin:portfolio_profile_changelist'), {'q': 'admintest3@gmail'})
+        self.assertEquals([profile.user.email for profile in response.context['cl'].result_list],
+                          ['admintest3@gmail.com'])
+
+    def test_map_view(self):
+        """
+        Admin map loads Profile from the map API
+        """
+        response = self.client.get(_('admin:portfolio_profile_map'))
+        self.assertEquals(response.status_code, 200)
+        self.assertContains(response, str(_('profile_geojson')))
+
+
+class ProfileSearchTests(TestCase):
+    """
+    TestCase for ProfileSearchView and Profile search vector
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        setup_test_data(cls)
+        cls.python = Expertise.objects.create(name='Python')
+        cls.profile.first_name, cls.profile.last_name, cls.profile.address = 'Budi', 'Istiadi', 'Purworejo'
+        cls.profile.location = Point(110.0093, -7.7129, srid=4326)
+        cls.profile.save()
+        cls.profile.expertise.add(cls.python)
+        cls.profile2 = create_profile('testuser2', Point(13.4050, 52.5200, srid=4326))
+        cls.profile2.first_name, cls.profile2.last_name = 'Budiman', 'Schmidt'
+        cls.profile2.save()
+        cls.profile3 = create_profile('testuser3', None)
+        cls.profile3.first_name, cls.profile3.last_name = 'Siti', 'Rahma'
+        cls.profile3.save()
+
+    def search(self, **params):
+        response = self.client.get(_('profile_search'), params)
+        self.assertEquals(response.status_code, 200)
+        return response.json()
+
+    def ids(self, **params):
+        return [feature['id'] for feature in self.search(**params)['features']]
+
+    def test_search_by_name_prefix(self):
+        """
+        Search words match the beginning of name, ranked by how well they match
+        """
+        self.assertEquals(self.ids(q='budi'), [self.profile.pk, self.profile2.pk])
+        self.assertEquals(self.ids(q='budi istiadi'), [self.profile.pk])
+
+    def test_search_by_expertise_email_and_address(self):
+        """
+        Expertise names, user email and address are searched too
+        """
+        self.assertEquals(self.ids(q='python'), [self.profile.pk])
+        self.assertEquals(self.ids(q='testuser3@gmail.com'), [self.profile3.pk])
+        self.assertEquals(self.ids(q='purworejo'), [self.profile.pk])
+
+    def test_search_with_typo(self):
+        """
+        Name with a typo is found by trigram similarity
+        """
+        self.assertIn(self.profile2.pk, self.ids(q='Schmitd'))
+
+    def test_search_in_bbox(self):
+        """
+        Search can be limited to a bbox, Profile without location have null geometry
+        """
+        self.assertEquals(self.ids(q='budi', bbox='95,-11,141,6'), [self.profile.pk])
+        self.assertIsNone(self.search(q='siti')['features'][0]['geometry'])
+
+    def test_keyset_pagination(self):
+        """
+        Pages follow each other through the cursor, without repeating Profile
+        """
+        first_page = self.search(q='budi', limit=1)
+        self.assertEquals(len(first_page['features']), 1)
+        second_page = self.search(q='budi', limit=1, cursor=first_page['next'])
+        self.assertEquals([feature['id'] for feature in first_page['features'] + second_page['features']],
+                          [self.profile.pk, self.profile2.pk])
+        self.assertIsNone(second_page['next'])
+
+    def test_search_vector_follows_changes(self):
+        """
+        Search vector is rebuilt when name, Expertise or Expertise name change
+        """
+        self.profile3.first_name = 'Dewi'
+        self.profile3.save()
+        self.assertEquals(self.ids(q='dewi'), [self.profile3.pk])
+
+        self.profile3.expertise.add(self.python)
+        self.assertEquals(sorted(self.ids(q='python')), sorted([self.profile.pk, self.profile3.pk]))
+
+        self.python.name = 'Django'
+        self.python.save()
+        self.assertEquals(self.ids(q='python'), [])
+        self.assertEquals(len(self.ids(q='django')), 2)
+
+    def test_stale_instance_keeps_search_vector(self):
+        """
+        Saving a Profile loaded before its vector was rebuilt in SQL does not write the old vector back
+        """
+        stale = Profile.objects.get(pk=self.profile3.pk)
+        self.profile3.expertise.add(self.python)
+        stale.phone = ''
+        stale.save()
+        self.assertIn(self.profile3.pk, self.ids(q='python'))
+
+    def test_save_deleted_profile(self):
+        """
+        Saving a loaded Profile whose row was deleted meanwhile inserts it again, like the default save
+        """
+        stale = Profile.objects.get(pk=self.profile3.pk)
+        Profile.objects.filter(pk=self.profile3.pk).delete()
+        stale.save()
+        self.assertTrue(Profile.objects.filter(pk=self.profile3.pk).exists())
+        self.assertEquals(self.ids(q='siti'), [self.profile3.pk])
+
+    def test_search_not_available(self):
+        """
+        Databases without full text search leave vectors alone, and search answers it is not available
+        """
+        with mock.patch('portfolio.search.is_available', return_value=False):
+            self.assertEquals(search.update_search_vectors(Profile.objects.all()), 0)
+            self.assertEquals(self.client.get(_('profile_search'), {'q': 'budi'}).status_code, 501)
+
+    def test_invalid_parameters(self):
+        """
+        Missing search words and invalid cursor are rejected
+        """
+        self.assertEquals(self.client.get(_('profile_search')).status_code, 400)
+        self.assertEquals(self.client.get(_('profile_search'), {'q': '!!'}).status_code, 400)
+        self.assertEquals(self.client.get(_('profile_search'), {'q': 'budi', 'cursor': 'x'}).status_code, 400)
+
+    def test_rebuild_command(self):
+        """
+        rebuild_search_vectors fills vectors of Profile created without signals
+        """
+        Profile.objects.update(search_vector=None)
+        self.assertEquals(self.ids(q='purworejo'), [])
+        call_command('rebuild_search_vectors', batch_size=1, stdout=StringIO())
+        self.assertEquals(self.ids(q='purworejo'), [self.profile.pk])
+
+
+class ReplicaRouterTests(TestCase):
+    """
+    TestCase for read replica routing
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        setup_test_data(cls)
+
+    def setUp(self):
+        self.router = db_router.ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def db_for_read(self, request):
+        with db_router.read_from_replica(request):
+            return self.router.db_for_read(Profile)
+
+    @override_settings(DATABASE_REPLICAS=['replica_0'])
+    def test_safe_request_reads_from_healthy_replica(self):
+        """
+        GET reads from a healthy replica, POST and reads outside of replica views use the primary
+        """
+        with mock.patch('project.db_router.is_healthy', return_value=True):
+            self.assertEquals(self.db_for_read(self.factory.get('/')), 'replica_0')
+            self.assertEquals(self.db_for_read(self.factory.post('/')), 'default')
+            self.assertEquals(self.router.db_for_read(Profile), 'default')
+        with mock.patch('project.db_router.is_healthy', return_value=False):
+            self.assertEquals(self.db_for_read(self.factory.get('/')), 'default')
+
+    @override_settings(DATABASE_REPLICAS=['replica_0'])
+    def test_pinned_client_reads_from_primary(self):
+        """
+        After a client saves its Profile, its reads go to the primary until the pin expires
+        """
+        self.client.login(email=self.email, password=self.password)
+        response = self.client.post(_('profile_edit'), data={'first_name': 'Budi', 'last_name': 'Istiadi'})
+        self.assertEquals(response.status_code, 302)
+        self.assertIn(db_router.PIN_COOKIE, response.cookies)
+
+        request = self.factory.get('/')
+        request.COOKIES[db_router.PIN_COOKIE] = response.cookies[db_router.PIN_COOKIE].value
+        with mock.patch('project.db_router.is_healthy', return_value=True):
+            self.assertEquals(self.db_for_read(request), 'default')
+            request.COOKIES[db_router.PIN_COOKIE] = '0'
+            self.assertEquals(self.db_for_read(request), 'replica_0')
+
+    @override_settings(DATABASE_REPLICAS=['replica_0'])
+    def test_cache_fill_reads_from_primary(self):
+        """
+        Map payload cached for every client is rendered from the primary, even inside a replica view
+        """
+        map_cache.get_cache().clear()
+        self.addCleanup(map_cache.get_cache().clear)
+        with mock.patch('project.db_router.is_healthy', return_value=True):
+            with db_router.read_from_replica(self.factory.get('/')):
+                document = map_cache.get_tile(0, 0, 0, lambda: self.router.db_for_read(Profile))
+                self.assertEquals(self.router.db_for_read(Profile), 'replica_0')
+        self.assertEquals(document, 'default')
+
+    @override_settings(REPLICA_HEALTH_CHECK_INTERVAL=60)
+    def test_health_is_checked_once_per_interval(self):
+        """
+        Replica health is cached between checks
+        """
+        db_router.health.clear()
+        self.addCleanup(db_router.health.clear)
+        with mock.patch('project.db_router.check_replica', return_value=True) as check_replica:
+            self.assertTrue(db_router.is_healthy('replica_0'))
+            self.assertTrue(db_router.is_healthy('replica_0'))
+        self.assertEquals(check_replica.call_count, 1)
+
+    def test_primary_used_without_replicas(self):
+        """
+        Without DATABASE_REPLICAS, replica views read from the primary
+        """
+        self.assertEquals(self.db_for_read(self.factory.get('/')), 'default')
+
+
+class InstrumentationTests(TestCase):
+    """
+    TestCase for request instrumentation and metrics endpoint
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        setup_test_data(cls)
+
+    def setUp(self):
+        instrumentation.registry.clear()
+        self.addCleanup(instrumentation.registry.clear)
+
+    def test_request_is_recorded_by_view(self):
+        """
+        Latency, queries, render time and response size are recorded under the view name
+        """
+        self.client.login(username=self.username, password=self.password)
+        response = self.client.get(_('profile'))
+        stats = instrumentation.registry.snapshot()['profile']
+        self.assertEquals(stats.count, 1)
+        self.assertEquals(sum(stats.buckets), 1)
+        self.assertGreater(stats.queries, 0)
+        self.assertGreater(stats.render_duration, 0)
+        self.assertEquals(stats.response_bytes, len(response.content))
+        self.assertEquals(stats.statuses, {200: 1})
+
+    def test_metrics_endpoint(self):
+        """
+        Metrics are served in Prometheus text format, only to METRICS_ALLOWED_IPS
+        """
+        self.client.get(_('home'))
+        response = self.client.get(_('metrics'))
+        self.assertEquals(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        content = response.content.decode()
+        self.assertIn('django_request_duration_seconds_bucket{view="home",le="+Inf"} 1', content)
+        self.assertIn('django_requests_total{view="home",status="200"} 1', content)
+        self.assertIn('# TYPE login_throttle_total counter', content)
+
+        response = self.client.get(_('metrics'), REMOTE_ADDR='10.0.0.1')
+        self.assertEquals(response.status_code, 404)
+
+    @override_settings(SLOW_REQUEST_THRESHOLD=0)
+    def test_slow_request_is_logged_with_queries(self):
+        """
+        Request slower than SLOW_REQUEST_THRESHOLD is logged with its queries
+        """
+        self.client.login(username=self.username, password=self.password)
+        with self.assertLogs('project.instrumentation', 'WARNING') as logs:
+            self.client.get(_('profile'))
+        self.assertIn('Slow request GET /profile (profile)', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    def test_label_is_escaped(self):
+        """
+        Quotes and backslashes in view names do not break the metrics format
+        """
+        instrumentation.registry.record('a"b\\c', 200, 0.001, 0, 0, 0, 0)
+        content = instrumentation.render_metrics(instrumentation.registry.snapshot())
+        self.assertIn('django_requests_total{view="a\\"b\\\\c",status="200"} 1', content)
+
+
+class BenchmarkTests(TestCase):
+    """
+    TestCase for synthetic data generator and bench command
+    """
+
+    def test_synthetic_records_are_reproducible_and_clustered(self):
+        """
+        Same seed gives the same records, most of them near a city
+        """
+        records = list(benchmarks.synthetic_records(0, 200, seed=3))
+        self.assertEquals(records, list(benchmarks.synthetic_records(0, 200, seed=3)))
+        self.assertNotEqual(records, list(benchmarks.synthetic_records(0, 200, seed=4)))
+
+        located = [record for record in records if 'lon' in record]
+        near_city = [record for record in located
+                     if any(abs(record['lon'] - lon) < 3 and abs(record['lat'] - lat) < 3
+                            for name, lon, lat, spread, weight in benchmarks.CITIES)]
+        self.assertGreater(len(near_city), len(located) * 0.8)
+        for record in records:
+            importers.clean_record(record)
+
+    def test_bench_command(self):
+        """
+        bench seeds missing rows, writes JSON results and removes bench rows on cleanup
+        """
+        out = StringIO()
+        call_command('bench', sizes='5,10', requests=2, scenarios=['home', 'profile', 'login'], interactive=False,
+                     stdout=out, stderr=StringIO())
+        result = json.loads(out.getvalue())
+        self.assertEquals([run['rows'] for run in result['runs']], [5, 10])
+        self.assertEquals(set(result['runs'][0]['scenarios']), {'home', 'profile', 'login'})
+        self.assertGreater(result['runs'][1]['scenarios']['profile']['queries']['max'], 0)
+        self.assertEquals(benchmarks.bench_users().count(), 10)
+        self.assertTrue(Profile.objects.filter(user__email=benchmarks.email(9)).exists())
+
+        call_command('bench', cleanup=True, stdout=StringIO())
+        self.assertFalse(get_user_model().objects.filter(email__endswith=benchmarks.EMAIL_DOMAIN).exists())
+
+    def test_compare_finds_regressions(self):
+        """
+        More queries, or p95 latency above tolerance, are regressions
+        """
+        def run(p95, queries):
+            return {'runs': [{'rows': 1000, 'scenarios': {'home': {'latency_ms': {'p95': p95},
+                                                                   'queries': {'max': queries}}}}]}
+
+        self.assertEquals(benchmarks.compare(run(10, 3), run(11, 3), tolerance=0.2), [])
+        self.assertEquals(len(benchmarks.compare(run(10, 3), run(13, 4), tolerance=0.2)), 2)
+
+
+class SettingsProfileTests(TestCase):
+    """
+    TestCase for settings profiles and startup report
+    """
+
+    def test_dev_apps_are_not_loaded_in_tests(self):
+        """
+        Tests run with 'test' profile, without debug toolbar app, middleware and URLs
+        """
+        self.assertEquals(settings.SETTINGS_PROFILE, 'test')
+        for app in settings.DEV_APPS:
+            self.assertNotIn(app, settings.INSTALLED_APPS)
+        for middleware in settings.DEV_MIDDLEWARE:
+            self.assertNotIn(middleware, settings.MIDDLEWARE)
+        self.assertFalse(any(str(pattern.pattern).startswith('__debug__') for pattern in get_resolver().url_patterns))
+
+    def test_local_map_cache_warned_in_prod(self):
+        """
+        'prod' profile warns that a local memory map cache is not invalidated in other processes
+        """
+        with self.settings(SETTINGS_PROFILE='prod', PROFILE_MAP_CACHE_LOCAL=True):
+            self.assertEquals([warning.id for warning in checks.check_map_cache(None)], ['portfolio.W001'])
+        with self.settings(SETTINGS_PROFILE='prod', PROFILE_MAP_CACHE_LOCAL=False):
+            self.assertEquals(checks.check_map_cache(None), [])
+
+    def test_startup_report(self):
+        """
+        startup_report measures every installed app in a new process
+        """
+        out = StringIO()
+        call_command('startup_report', profiles=['prod'], repeat=1, json=True, stdout=out)
+        report = json.loads(out.getvalue())[0]
+        self.assertEquals(report['profile'], 'prod')
+        self.assertEquals({app['app'] for app in report['apps']}, set(settings.INSTALLED_APPS))
+        self.assertGreater(report['setup_ms'], 0)
+
+
+@override_settings(STATIC_ROOT=tempfile.mkdtemp(),
+                   STATICFILES_STORAGE='project.staticfiles.CompressedManifestStaticFilesStorage')
+class StaticFilesTests(TestCase):
+    """
+    TestCase for hashed and compressed static files and their WSGI handler
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        call_command('collectstatic', interactive=False, verbosity=0)
+        cls.manifest = json.load(open(os.path.join(settings.STATIC_ROOT, 'staticfiles.json')))['paths']
+
+    def request(self, handler, path, **environ):
+        environ = dict({'PATH_INFO': path, 'REQUEST_METHOD': 'GET'}, **environ)
+        response = {}
+
+        def start_response(status, headers):
+            response['status'], response['headers'] = status, dict(headers)
+
+        body = b''.join(handler(environ, start_response))
+        return response['status'], response['headers'], body
+
+    def test_collectstatic_writes_hashed_and_compressed_files(self):
+        """
+        Files get hashed names, CSS links hashed images, and text files get a gzip variant
+        """
+        css = self.manifest['css/leaflet.fullscreen.css']
+        self.assertNotEqual(css, 'css/leaflet.fullscreen.css')
+        path = os.path.join(settings.STATIC_ROOT, css)
+        with open(path) as f:
+            self.assertIn(os.path.basename(self.manifest['images/fullscreen.png']), f.read())
+        self.assertTrue(os.path.exists(path + '.gz'))
+        self.assertFalse(os.path.exists(os.path.join(settings.STATIC_ROOT, self.manifest['images/avatar.png']) + '.gz'))
+
+    def test_handler_serves_compressed_immutable_files(self):
+        """
+        Hashed files are served compressed when accepted, with immutable cache, and revalidated with ETag
+        """
+        handler = StaticFileHandler(lambda environ, start_response: [b'django'])
+        path = settings.STATIC_URL + self.manifest['css/leaflet.fullscreen.css']
+
+        status, headers, body = self.request(handler, path, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEquals(status, '200 OK')
+        self.assertEquals(headers['Content-Encoding'], 'gzip')
+        self.assertEquals(headers['Cache-Control'], staticfiles.IMMUTABLE)
+        self.assertEquals(headers['Vary'], 'Accept-Encoding')
+        self.assertIn(b'leaflet-control-fullscreen', gzip.decompress(body))
+
+        status, headers, body = self.request(handler, path)
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEquals(int(headers['Content-Length']), len(body))
+
+        status, headers, body = self.request(handler, path, HTTP_IF_NONE_MATCH=headers['ETag'])
+        self.assertEquals(status, '304 Not Modified')
+        self.assertEquals(body, b'')
+
+        status, headers, body = self.request(handler, settings.STATIC_URL + 'css/leaflet.fullscreen.css')
+        self.assertEquals(headers['Cache-Control'], 'public, max-age={}'.format(settings.STATIC_MAX_AGE))
+
+    def test_handler_passes_other_requests(self):
+        """
+        Paths outside of STATIC_URL, and missing static files, are answered by Django
+        """
+        handler = StaticFileHandler(lambda environ, start_response: [b'django'])
+        self.assertEquals(b''.join(handler({'PATH_INFO': '/', 'REQUEST_METHOD': 'GET'}, None)), b'django')
+        self.assertEquals(b''.join(handler({'PATH_INFO': settings.STATIC_URL + 'missing.css',
+                                            'REQUEST_METHOD': 'GET'}, None)), b'django')
+
+    def test_map_has_no_remote_assets(self):
+        """
+        Home page map loads its plugins from hashed static files
+        """
+        response = self.client.get(_('home'))
+        self.assertNotContains(response, 'api.mapbox.com')
+        self.assertContains(response, settings.STATIC_URL + self.manifest['js/Leaflet.fullscreen.min.js'])
+
+
+class ASGIHandlerTests(TestCase):
+    """
+    TestCase for ASGI entry point running the WSGI application in a thread pool
+    """
+
+    def call(self, application, path, query=b'', threads=2):
+        """
+        :return: list of messages sent by the ASGI handler
+        """
+        handler = WSGIToASGIHandler(application, threads)
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = dict(benchmarks.request_scope(path), query_string=query)
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(handler(scope, receive, send))
+        finally:
+            handler.get_executor().shutdown()
+            loop.close()
+        return messages
+
+    def test_build_environ(self):
+        """
+        ASGI scope is translated to WSGI environ, repeated headers are joined
+        """
+        scope = dict(benchmarks.request_scope('/api/profiles.geojson', 'bbox=1,2,3,4'),
+                     headers=[(b'content-type', b'text/plain'), (b'x-tag', b'a'), (b'x-tag', b'b')])
+        environ = asgi_handler.build_environ(scope, BytesIO(b'body'))
+        self.assertEquals(environ['PATH_INFO'], '/api/profiles.geojson')
+        self.assertEquals(environ['QUERY_STRING'], 'bbox=1,2,3,4')
+        self.assertEquals(environ['REMOTE_ADDR'], '127.0.0.1')
+        self.assertEquals(environ['CONTENT_TYPE'], 'text/plain')
+        self.assertEquals(environ['HTTP_X_TAG'], 'a,b')
+        self.assertEquals(environ['wsgi.input'].read(), b'body')
+
+    def test_django_response(self):
+        """
+        Django responses are built in the pool and sent in one message
+        """
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            messages = self.call(WSGIHandler(), str(_('metrics')))
+        self.assertEquals(messages[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/plain; version=0.0.4; charset=utf-8'), messages[0]['headers'])
+        self.assertIn(b'django_request_duration_seconds', messages[1]['body'])
+        self.assertEquals(len(messages), 2)
+
+    def test_streaming_response(self):
+        """
+        Streaming responses are sent chunk by chunk, and closed at the end
+        """
+        response = StreamingHttpResponse(iter([b'a', b'b', b'c']))
+        response.close = mock.Mock()
+
+        def application(environ, start_response):
+            start_response('200 OK', list(response.items()))
+            return response
+
+        messages = self.call(application, '/')
+        self.assertEquals([message.get('body') for message in messages[1:]], [b'a', b'b', b'c', b''])
+        self.assertTrue(response.close.called)
+
+    def test_bench_concurrency_command(self):
+        """
+        bench_concurrency reports both WSGI and ASGI runs
+        """
+        out = StringIO()
+        call_command('bench_concurrency', clients=5, workers=2, threads=2, download_time=0, url=str(_('metrics')),
+                     query='', stdout=out, stderr=StringIO())
+        result = json.loads(out.getvalue())
+        self.assertEquals(result['wsgi']['requests'], 5)
+        self.assertEquals(result['asgi']['requests'], 5)
+        self.assertEquals(result['asgi']['threads'], 2)
+
+
 # Base64 image for testing Profile photo
 TEST_IMAGE = '''
 iVBORw0KGgoAAAANSUhEUgAAABAAAAAQCAYAAAAf8/9hAAAABmJLR0QA/wD/AP+gvaeTAAAACXBI
@@ -0,0 +1,198 @@
+"""
+Resized derivatives of Profile photo.
+
+Every photo gets one derivative per width in PROFILE_PHOTO_SIZES and per format (WebP and JPEG),
+stored next to the original, e.g. `username/photo.png` has `username/photo_210.webp` and
+`username/photo_210.jpg`.
+
+Photo is processed by a background job (see portfolio.jobs), so uploading a big photo does not slow down
+the request. Until the job is done, Profile.photo_status is 'processing' and a placeholder is shown.
+A photo whose job fails is deleted, because its EXIF may not have been stripped.
+"""
+import os
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import features, Image, ImageOps
+
+from portfolio import jobs, map_cache, page_cache
+
+FORMATS = (('webp', 'WEBP'), ('jpg', 'JPEG'))
+QUALITY = 85
+
+
+def available_formats():
+    """
+    WebP support depends on how Pillow is built
+    """
+    return [(ext, pil_format) for ext, pil_format in FORMATS if ext != 'webp' or features.check('webp')]
+
+
+def thumbnail_name(name, size, ext):
+    """
+    Get derivative file name of a photo
+    :param name: photo file name in storage
+    :param size: derivative width
+    :param ext: derivative extension, 'webp' or 'jpg'
+    """
+    root, _ = os.path.splitext(name)
+    return '{}_{}.{}'.format(root, size, ext)
+
+
+def pick_size(width):
+    """
+    Get the smallest derivative width that is not smaller than display width
+    """
+    sizes = sorted(settings.PROFILE_PHOTO_SIZES)
+    for size in sizes:
+        if size >= width:
+            return size
+    return sizes[-1]
+
+
+def thumbnail_url(photo, width, ext='jpg'):
+    """
+    Get URL of the derivative to display a photo at a width
+    :param photo: FieldFile of Profile photo
+    :param width: display width in pixel
+    :param ext: derivative extension, 'webp' or 'jpg'
+    """
+    return photo.storage.url(thumbnail_name(photo.name, pick_size(width), ext))
+
+
+def photo_urls(photo, status, width):
+    """
+    Get URLs to display a photo at a width, depending on its processing status
+    :param photo: FieldFile of Profile photo
+    :param status: Profile photo_status
+    :param width: display width in pixel
+    :return: tuple of (JPEG URL, WebP URL). Both are None if there is no photo, it is still processed or
+             it failed to be processed, so a placeholder is shown.
+    """
+    Profile = apps.get_model('portfolio', 'Profile')
+    if not photo or status in (Profile.PHOTO_PROCESSING, Profile.PHOTO_FAILED):
+        return None, None
+    return thumbnail_url(photo, width), thumbnail_url(photo, width, 'webp')
+
+
+def resize(image, size):
+    """
+    Resize image to a width, keeping aspect ratio. Image smaller than the width is not enlarged.
+    """
+    if image.width <= size:
+        return image.copy()
+    height = max(int(round(image.height * size / image.width)), 1)
+    return image.resize((size, height), Image.LANCZOS)
+
+
+def open_photo(photo):
+    with photo.storage.open(photo.name, 'rb') as f:
+        image = Image.open(f)
+        image.load()
+    return image
+
+
+def normalize_photo(photo):
+    """
+    Rotate photo according to its EXIF orientation and strip its EXIF, which may contain the GPS location
+    where the photo was taken. Photo without EXIF is not re-encoded.
+    :param photo: FieldFile of Profile photo
+    :return: PIL Image of the normalized photo
+    """
+    image = open_photo(photo)
+    if 'exif' not in image.info:
+        return image
+
+    # Many phone cameras write JPEG with extra images (MPO), which Pillow can open but not save
+    pil_format = 'JPEG' if image.format == 'MPO' else image.format
+    image = ImageOps.exif_transpose(image)
+    # Pillow writes EXIF from image info for some formats, e.g. PNG
+    image.info.pop('exif', None)
+    output = BytesIO()
+    image.save(output, pil_format, **({'quality': QUALITY} if pil_format == 'JPEG' else {}))
+    photo.storage.delete(photo.name)
+    photo.storage.save(photo.name, ContentFile(output.getvalue()))
+    return image
+
+
+def generate_thumbnails(photo, image=None):
+    """
+    Generate every derivative of a photo, replacing the existing ones
+    :param photo: FieldFile of Profile photo
+    :param image: PIL Image of the photo, opened from storage if not given
+    """
+    if image is None:
+        image = open_photo(photo)
+
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+
+    for size in settings.PROFILE_PHOTO_SIZES:
+        resized = resize(image, size)
+        for ext, pil_format in available_formats():
+            derivative = resized
+            if pil_format == 'JPEG' and derivative.mode == 'RGBA':
+                # JPEG has no transparency, put the photo on white background
+                derivative = Image.new('RGB', resized.size, (255, 255, 255))
+                derivative.paste(resized, mask=resized.split()[-1])
+
+            output = BytesIO()
+            derivative.save(output, pil_format, quality=QUALITY)
+            name = thumbnail_name(photo.name, size, ext)
+            photo.storage.delete(name)
+            photo.storage.save(name, ContentFile(output.getvalue()))
+
+
+def delete_thumbnails(photo):
+    """
+    Delete every derivative of a photo
+    :param photo: FieldFile of Profile photo
+    """
+    for size in settings.PROFILE_PHOTO_SIZES:
+        for ext, pil_format in FORMATS:
+            photo.storage.delete(thumbnail_name(photo.name, size, ext))
+
+
+def set_photo_status(profile_id, status):
+    """
+    Update photo status without sending signals, and remove cached profile page and map popup
+    which show the old status
+    """
+    Profile = apps.get_model('portfolio', 'Profile')
+    Profile.objects.filter(pk=profile_id).update(photo_status=status)
+    for user_id, location in Profile.objects.filter(pk=profile_id).values_list('user_id', 'location'):
+        page_cache.invalidate_profile(user_id)
+        if location is not None:
+            map_cache.invalidate_location(location)
+
+
+def photo_failed(profile_id, name):
+    """
+    Delete a photo that could not be processed, instead of serving it with its EXIF, e.g. GPS location
+    """
+    Profile = apps.get_model('portfolio', 'Profile')
+    profile = Profile.objects.filter(pk=profile_id).only('photo').first()
+    if profile is not None and profile.photo.name == name:
+        delete_thumbnails(profile.photo)
+        profile.photo.storage.delete(name)
+        Profile.objects.filter(pk=profile_id, photo=name).update(photo='')
+    set_photo_status(profile_id, Profile.PHOTO_FAILED)
+
+
+@jobs.register('process_photo', on_failure=photo_failed)
+def process_photo(profile_id, name):
+    """
+    Job that normalizes an uploaded photo and generates its derivatives
+    :param profile_id: id of Profile
+    :param name: photo file name when the job was enqueued
+    """
+    Profile = apps.get_model('portfolio', 'Profile')
+    profile = Profile.objects.filter(pk=profile_id).only('photo').first()
+    if profile is None or profile.photo.name != name:
+        # Profile is deleted, or its photo removed, before the job runs
+        return
+
+    generate_thumbnails(profile.photo, normalize_photo(profile.photo))
+    set_photo_status(profile_id, Profile.PHOTO_READY)
@@ -0,0 +1,196 @@
+"""
+Mapbox Vector Tile of Profile location, with on-disk tile cache.
+
+Tiles are rendered by PostGIS with ST_AsMVT, or by portfolio.mvt on other spatial databases. Both give the same
+features, with id, name and expertise properties and without feature id, which ST_AsMVT only writes on PostGIS 3.
+Rendered tiles up to PROFILE_TILE_CACHE_MAX_ZOOM are saved in PROFILE_TILE_CACHE_DIR and removed
+when a Profile inside them is saved or deleted.
+"""
+import math
+import os
+import shutil
+import tempfile
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, router
+
+from portfolio import mvt
+from portfolio.geo import MAX_ZOOM, bbox_to_polygon
+from project.db_router import read_from_primary
+
+LAYER_NAME = 'profiles'
+# Half of Web Mercator (EPSG:3857) world width, in metres
+ORIGIN_SHIFT = 20037508.342789244
+MAX_LATITUDE = 85.0511287798
+
+
+def tile_exists(z, x, y):
+    """
+    Check if tile coordinate is valid. Zoom is limited to MAX_ZOOM, a larger one is not a map zoom level
+    and its tile size can not be computed.
+    """
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def tile_bounds(z, x, y):
+    """
+    Get bounds of a tile in Web Mercator
+    :return: tuple of (minx, miny, maxx, maxy) in metres
+    """
+    size = 2 * ORIGIN_SHIFT / (2 ** z)
+    minx = -ORIGIN_SHIFT + x * size
+    maxy = ORIGIN_SHIFT - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def tile_lonlat_bounds(z, x, y):
+    """
+    Get bounds of a tile in longitude and latitude
+    :return: tuple of (west, south, east, north)
+    """
+    minx, miny, maxx, maxy = tile_bounds(z, x, y)
+    return mercator_to_lonlat(minx, miny) + mercator_to_lonlat(maxx, maxy)
+
+
+def lonlat_to_mercator(lon, lat):
+    lat = max(min(lat, MAX_LATITUDE), -MAX_LATITUDE)
+    x = lon * ORIGIN_SHIFT / 180.0
+    y = math.log(math.tan((90 + lat) * math.pi / 360.0)) * ORIGIN_SHIFT / math.pi
+    return x, y
+
+
+def mercator_to_lonlat(x, y):
+    lon = x * 180.0 / ORIGIN_SHIFT
+    lat = math.degrees(2 * math.atan(math.exp(y * math.pi / ORIGIN_SHIFT)) - math.pi / 2)
+    return lon, lat
+
+
+def lonlat_to_tile(lon, lat, z):
+    """
+    Get tile which contains a coordinate
+    :return: tuple of (x, y) tile coordinate
+    """
+    x, y = lonlat_to_mercator(lon, lat)
+    tiles = 2 ** z
+    column = int((x + ORIGIN_SHIFT) / (2 * ORIGIN_SHIFT) * tiles)
+    row = int((ORIGIN_SHIFT - y) / (2 * ORIGIN_SHIFT) * tiles)
+    return min(max(column, 0), tiles - 1), min(max(row, 0), tiles - 1)
+
+
+def render_tile(z, x, y):
+    """
+    Render Profile tile from database
+    :return: tile as bytes, empty if there is no Profile inside the tile
+    """
+    if connections[router.db_for_read(apps.get_model('portfolio', 'Profile'))].vendor == 'postgresql':
+        return render_tile_postgis(z, x, y)
+    return render_tile_python(z, x, y)
+
+
+def render_tile_postgis(z, x, y):
+    Profile = apps.get_model('portfolio', 'Profile')
+    through = Profile.expertise.through
+    # raw SQL does not go through database routers, so choose the database like a Profile query would
+    connection = connections[router.db_for_read(Profile)]
+    sql = """
+        SELECT ST_AsMVT(tile, %s, %s, 'geom') FROM (
+            SELECT p.id,
+                   concat_ws(' ', p.first_name, p.last_name) AS name,
+                   COALESCE((SELECT string_agg(pe.{expertise}::text, ',' ORDER BY pe.{expertise})
+                             FROM {through} pe WHERE pe.{profile} = p.id), '') AS expertise,
+                   ST_AsMVTGeom(ST_Transform(p.location, 3857), ST_MakeEnvelope(%s, %s, %s, %s, 3857),
+                                %s, 0, true) AS geom
+            FROM {table} p
+            WHERE p.location && ST_MakeEnvelope(%s, %s, %s, %s, 4326)
+        ) AS tile
+    """.format(
+        table=connection.ops.quote_name(Profile._meta.db_table),
+        through=connection.ops.quote_name(through._meta.db_table),
+        profile=connection.ops.quote_name(through._meta.get_field('profile').column),
+        expertise=connection.ops.quote_name(through._meta.get_field('expertise').column),
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [LAYER_NAME, mvt.EXTENT] + list(tile_bounds(z, x, y)) + [mvt.EXTENT] +
+                       list(tile_lonlat_bounds(z, x, y)))
+        tile = cursor.fetchone()[0]
+    return bytes(tile) if tile else b''
+
+
+def render_tile_python(z, x, y):
+    Profile = apps.get_model('portfolio', 'Profile')
+    profiles = list(Profile.objects.filter(location__intersects=bbox_to_polygon(tile_lonlat_bounds(z, x, y)))
+                    .values_list('id', 'first_name', 'last_name', 'location'))
+
+    expertise = defaultdict(list)
+    for profile_id, expertise_id in (Profile.expertise.through.objects
+                                     .filter(profile_id__in=[profile[0] for profile in profiles])
+                                     .order_by('expertise_id').values_list('profile_id', 'expertise_id')):
+        expertise[profile_id].append(str(expertise_id))
+
+    minx, miny, maxx, maxy = tile_bounds(z, x, y)
+    features = []
+    for profile_id, first_name, last_name, location in profiles:
+        mx, my = lonlat_to_mercator(location.x, location.y)
+        features.append((
+            None,
+            (mx - minx) / (maxx - minx) * mvt.EXTENT,
+            (maxy - my) / (maxy - miny) * mvt.EXTENT,
+            {'id': profile_id, 'name': '{} {}'.format(first_name, last_name).strip(),
+             'expertise': ','.join(expertise[profile_id])},
+        ))
+    return mvt.encode_layer(LAYER_NAME, features)
+
+
+def tile_path(z, x, y):
+    return os.path.join(settings.PROFILE_TILE_CACHE_DIR, LAYER_NAME, str(z), str(x), '{}.pbf'.format(y))
+
+
+def get_tile(z, x, y):
+    """
+    Get Profile tile from tile cache, render and cache it if it does not exist yet
+    :return: tile as bytes
+    """
+    if z > settings.PROFILE_TILE_CACHE_MAX_ZOOM:
+        return render_tile(z, x, y)
+
+    path = tile_path(z, x, y)
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+
+    # the tile is shared by every client, so it must not come from a lagging replica
+    with read_from_primary():
+        tile = render_tile(z, x, y)
+
+    # Write to temporary file first, so other process never reads half-written tile
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(tile)
+    os.replace(temp_path, path)
+    return tile
+
+
+def invalidate_tiles(location):
+    """
+    Remove cached tiles that contain a location
+    :param location: Point in EPSG:4326
+    """
+    for z in range(settings.PROFILE_TILE_CACHE_MAX_ZOOM + 1):
+        x, y = lonlat_to_tile(location.x, location.y, z)
+        try:
+            os.remove(tile_path(z, x, y))
+        except FileNotFoundError:
+            pass
+
+
+def clear_tiles():
+    """
+    Remove every cached tile, e.g. after Profile is changed in bulk without sending signals
+    """
+    shutil.rmtree(os.path.join(settings.PROFILE_TILE_CACHE_DIR, LAYER_NAME), ignore_errors=True)
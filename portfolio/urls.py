@@ -1,10 +1,28 @@
 from django.urls import path
-from django.contrib.auth.decorators import login_required
+from django.contrib.auth.decorators import login_required, permission_required
+from django.views.decorators.gzip import gzip_page
 
-from .views import HomePageView, ProfileView, ProfileEditView
+from project.db_router import use_replica
+
+from .views import (ExpertiseFacetView, HomePageView, ProfileClusterView, ProfileExportView, ProfileGeoJSONView,
+                    ProfileNearbyView, ProfileSearchView, ProfileTileGeoJSONView, ProfileTileView, ProfileView,
+                    ProfileEditView)
 
 urlpatterns = [
-    path('', HomePageView.as_view(), name='home'),
+    path('', use_replica(HomePageView.as_view()), name='home'),
     path('profile', login_required(ProfileView.as_view()), name='profile'),
     path('profile/edit', login_required(ProfileEditView.as_view()), name='profile_edit'),
+    path('api/profiles.geojson', use_replica(gzip_page(ProfileGeoJSONView.as_view())), name='profile_geojson'),
+    path('api/profiles/<int:z>/<int:x>/<int:y>.geojson', use_replica(gzip_page(ProfileTileGeoJSONView.as_view())),
+         name='profile_tile_geojson'),
+    path('api/profiles/nearby.geojson', use_replica(gzip_page(ProfileNearbyView.as_view())), name='profile_nearby'),
+    path('api/profiles/search.geojson', use_replica(gzip_page(ProfileSearchView.as_view())), name='profile_search'),
+    path('api/clusters.geojson', use_replica(gzip_page(ProfileClusterView.as_view())), name='profile_clusters'),
+    path('api/expertise/facets.json', use_replica(gzip_page(ExpertiseFacetView.as_view())), name='expertise_facets'),
+    # Export contains every Profile, so it is limited to user who can view all of them
+    path('api/profiles/export.<slug:export_format>',
+         gzip_page(permission_required('portfolio.view_profile', raise_exception=True)(ProfileExportView.as_view())),
+         name='profile_export'),
+    path('tiles/profiles/<int:z>/<int:x>/<int:y>.pbf', use_replica(gzip_page(ProfileTileView.as_view())),
+         name='profile_tile'),
 ]
\ No newline at end of file
@@ -1,51 +1,345 @@
-from django.views.generic import DetailView, ListView, TemplateView, UpdateView
+import json
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import D
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import router
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.generic import DetailView, TemplateView, UpdateView, View
 from django.forms.models import model_to_dict
-from portfolio.models import Profile
+from portfolio import clustering, exporters, facets, map_cache, page_cache, search, tiles
+from portfolio.geo import bbox_to_polygon, parse_bbox, parse_expertise, parse_zoom
+from portfolio.models import Expertise, Profile
 from portfolio.forms import ProfileForm
+from portfolio.serializers import cluster_to_feature, feature_collection, profile_to_feature
 from django.urls import reverse_lazy
 
-class HomePageView(ListView):
+class HomePageView(TemplateView):
     """
     Views for Home and User List, which shows other user's profile in full map.
+    Profiles are not rendered here, the map fetches them from ProfileGeoJSONView as the user pans.
     """
     template_name = 'portfolio/profile_list.html'
-    model = Profile
-    queryset = Profile.objects.all().prefetch_related('expertise','user')
     extra_context = dict()
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data(**kwargs)
         context['menu_page'] = 'home' # variable to indicate which page the user is in
+        context['cluster_max_zoom'] = settings.PROFILE_CLUSTER_MAX_ZOOM # above this zoom, map shows each Profile
 
         return context
 
 
+class ProfileGeoJSONView(View):
+    """
+    API for Home map, returns Profile inside the map viewport as GeoJSON FeatureCollection.
+    Query parameters:
+        bbox  -- 'west,south,east,north' of current map viewport, default is the whole world
+        zoom  -- current map zoom level
+        limit -- maximum number of returned Profile, capped by PROFILE_MAP_MAX_FEATURES
+        expertise -- comma-separated Expertise id, only return Profile which has any of them
+    """
+
+    def get(self, request, *args, **kwargs):
+        try:
+            bbox = parse_bbox(request.GET.get('bbox'))
+            zoom = parse_zoom(request.GET.get('zoom'))
+            limit = self.get_limit(request.GET.get('limit'))
+            expertise = parse_expertise(request.GET.get('expertise'))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        queryset = Profile.objects.filter(location__intersects=bbox_to_polygon(bbox))
+        if expertise:
+            queryset = queryset.with_expertise(expertise)
+        queryset = queryset.map_listing()[:limit]
+
+        return JsonResponse(feature_collection((profile_to_feature(profile) for profile in queryset),
+                                               bbox=bbox, zoom=zoom))
+
+    def get_limit(self, value):
+        """
+        Get number of Profile that will be returned, client can only lower the limit
+        :param value: limit query parameter
+        :return: limit as integer
+        """
+        max_features = settings.PROFILE_MAP_MAX_FEATURES
+        if not value:
+            return max_features
+
+        try:
+            limit = int(value)
+        except ValueError:
+            raise ValueError('limit must be an integer')
+
+        if limit < 1:
+            raise ValueError('limit must be a positive integer')
+        return min(limit, max_features)
+
+
+class ProfileTileGeoJSONView(View):
+    """
+    API for Home map, returns Profile inside a map tile as GeoJSON FeatureCollection.
+    Unlike ProfileGeoJSONView, the document of each tile is cached until a Profile inside it changes.
+    Query parameters:
+        expertise -- comma-separated Expertise id, only return Profile which has any of them.
+                     Filtered tiles are not cached.
+    """
+
+    def get(self, request, z, x, y, *args, **kwargs):
+        if not tiles.tile_exists(z, x, y):
+            raise Http404('Tile does not exist')
+
+        try:
+            expertise = parse_expertise(request.GET.get('expertise'))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        if expertise:
+            document = self.render_tile(z, x, y, expertise)
+        else:
+            document = map_cache.get_tile(z, x, y, lambda: self.render_tile(z, x, y))
+        return HttpResponse(document, content_type='application/json')
+
+    def render_tile(self, z, x, y, expertise=None):
+        """
+        Render JSON document of a tile from database
+        """
+        bbox = tiles.tile_lonlat_bounds(z, x, y)
+        queryset = Profile.objects.filter(location__intersects=bbox_to_polygon(bbox))
+        if expertise:
+            queryset = queryset.with_expertise(expertise)
+        queryset = queryset.map_listing()[:settings.PROFILE_MAP_MAX_FEATURES]
+
+        return json.dumps(feature_collection((profile_to_feature(profile) for profile in queryset),
+                                             bbox=bbox, zoom=z), cls=DjangoJSONEncoder)
+
+
+class ProfileClusterView(View):
+    """
+    API for Home map, returns clusters of Profile inside the map viewport as GeoJSON FeatureCollection.
+    Each Feature is the centroid of a cluster, with the number of Profile in `count` property.
+    Query parameters:
+        bbox -- 'west,south,east,north' of current map viewport, default is the whole world
+        zoom -- current map zoom level, up to PROFILE_CLUSTER_MAX_ZOOM
+        expertise -- comma-separated Expertise id, only cluster Profile which has any of them.
+                     Filtered clusters are aggregated by database on every request.
+    """
+
+    def get(self, request, *args, **kwargs):
+        try:
+            bbox = parse_bbox(request.GET.get('bbox'))
+            zoom = parse_zoom(request.GET.get('zoom'))
+            expertise = parse_expertise(request.GET.get('expertise'))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        if zoom > settings.PROFILE_CLUSTER_MAX_ZOOM:
+            return JsonResponse({'error': 'zoom must not be greater than {}, use profile API instead'.format(
+                settings.PROFILE_CLUSTER_MAX_ZOOM)}, status=400)
+
+        queryset = None
+        if expertise:
+            queryset = Profile.objects.with_expertise(expertise)
+        clusters = clustering.get_clusters(bbox, zoom, queryset)
+        return JsonResponse(feature_collection((cluster_to_feature(*cluster) for cluster in clusters),
+                                               bbox=bbox, zoom=zoom))
+
+
+class ExpertiseFacetView(View):
+    """
+    API for Home map, returns number of Profile per Expertise inside the map viewport, most common first.
+    Counts come from ExpertiseCount, see portfolio.facets.
+    Query parameters:
+        bbox -- 'west,south,east,north' of current map viewport, default is the whole world
+    """
+
+    def get(self, request, *args, **kwargs):
+        try:
+            bbox = parse_bbox(request.GET.get('bbox'))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        counts = facets.get_counts(bbox)
+        expertises = Expertise.objects.filter(pk__in=counts.keys()).values_list('pk', 'name')
+        return JsonResponse({
+            'bbox': bbox,
+            'expertise': sorted(({'id': pk, 'name': name, 'count': counts[pk]} for pk, name in expertises),
+                                key=lambda expertise: (-expertise['count'], expertise['name'])),
+        })
+
+
+class ProfileTileView(View):
+    """
+    Mapbox Vector Tile of Profile location, with id, name and expertise (comma-separated Expertise id) attributes.
+    """
+
+    def get(self, request, z, x, y, *args, **kwargs):
+        if not tiles.tile_exists(z, x, y):
+            raise Http404('Tile does not exist')
+
+        return HttpResponse(tiles.get_tile(z, x, y), content_type='application/vnd.mapbox-vector-tile')
+
+
+class ProfileNearbyView(View):
+    """
+    API for proximity search, returns Profile sorted by distance from a point as GeoJSON FeatureCollection,
+    with the distance in metres in `distance` property.
+    Query parameters:
+        lat, lon  -- the point
+        radius    -- only return Profile within this distance, in kilometres
+        k         -- only return K nearest Profile, capped by PROFILE_MAP_MAX_FEATURES
+        expertise -- comma-separated Expertise id, only return Profile which has any of them
+    """
+
+    def get(self, request, *args, **kwargs):
+        try:
+            point = self.get_point(request.GET.get('lat'), request.GET.get('lon'))
+            radius = self.get_positive_number(request.GET.get('radius'), 'radius', float)
+            k = self.get_positive_number(request.GET.get('k'), 'k', int)
+            expertise = parse_expertise(request.GET.get('expertise'))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        k = min(k or settings.PROFILE_MAP_MAX_FEATURES, settings.PROFILE_MAP_MAX_FEATURES)
+        queryset = Profile.objects.all()
+        if expertise:
+            queryset = queryset.with_expertise(expertise)
+        queryset = queryset.nearby(point, distance=D(km=radius) if radius else None, nearest=k)
+        queryset = queryset.map_listing()[:k]
+
+        features = []
+        for profile in queryset:
+            feature = profile_to_feature(profile)
+            feature['properties']['distance'] = profile.distance.m
+            features.append(feature)
+        return JsonResponse(feature_collection(features))
+
+    def get_point(self, lat, lon):
+        try:
+            point = Point(float(lon), float(lat), srid=4326)
+        except (TypeError, ValueError):
+            raise ValueError('lat and lon must be numbers')
+
+        if not (-180 <= point.x <= 180 and -90 <= point.y <= 90):
+            raise ValueError('lat and lon must be valid coordinate')
+        return point
+
+    def get_positive_number(self, value, name, cast):
+        if not value:
+            return None
+
+        try:
+            number = cast(value)
+        except ValueError:
+            raise ValueError('{} must be a number'.format(name))
+
+        if number <= 0:
+            raise ValueError('{} must be a positive number'.format(name))
+        return number
+
+
+class ProfileSearchView(View):
+    """
+    API for Profile search, returns matching Profile sorted by rank as GeoJSON FeatureCollection,
+    with the rank in `rank` property. Profile without location has null geometry.
+    Query parameters:
+        q      -- search words, matched against name, email, Expertise and address
+        bbox   -- 'west,south,east,north', only return Profile inside it
+        limit  -- number of returned Profile, capped by PROFILE_SEARCH_PAGE_SIZE
+        cursor -- `next` member of the previous response, to get the next page
+    """
+
+    def get(self, request, *args, **kwargs):
+        try:
+            words = search.parse_query(request.GET.get('q'))
+            bbox = parse_bbox(request.GET.get('bbox')) if request.GET.get('bbox') else None
+            limit = self.get_limit(request.GET.get('limit'))
+            cursor = search.parse_cursor(request.GET.get('cursor'))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        if not search.is_available(router.db_for_read(Profile)):
+            return JsonResponse({'error': 'search is only available on PostgreSQL'}, status=501)
+
+        # fetch one more Profile to know whether there is a next page
+        profiles = list(search.search(words, bbox, cursor)[:limit + 1])
+        next_cursor = search.next_cursor(profiles[limit - 1]) if len(profiles) > limit else None
+
+        features = []
+        for profile in profiles[:limit]:
+            feature = profile_to_feature(profile)
+            feature['properties']['rank'] = float(profile.rank)
+            features.append(feature)
+        return JsonResponse(feature_collection(features, next=next_cursor))
+
+    def get_limit(self, value):
+        page_size = settings.PROFILE_SEARCH_PAGE_SIZE
+        if not value:
+            return page_size
+
+        try:
+            limit = int(value)
+        except ValueError:
+            raise ValueError('limit must be an integer')
+
+        if limit < 1:
+            raise ValueError('limit must be a positive integer')
+        return min(limit, page_size)
+
+
+class ProfileExportView(View):
+    """
+    Export of every Profile with location, streamed so it does not have to fit in memory.
+    URL parameter:
+        export_format -- 'geojson', 'csv' or 'fgb' (FlatGeobuf with spatial index)
+    Query parameters:
+        bbox      -- 'west,south,east,north', only export Profile inside it
+        expertise -- comma-separated Expertise id, only export Profile which has any of them
+    """
+
+    def get(self, request, export_format, *args, **kwargs):
+        if export_format not in exporters.FORMATS:
+            raise Http404('Unknown export format')
+
+        try:
+            bbox = parse_bbox(request.GET.get('bbox')) if request.GET.get('bbox') else None
+            expertise = parse_expertise(request.GET.get('expertise'))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        response = StreamingHttpResponse(exporters.export(export_format, bbox, expertise),
+                                         content_type=exporters.FORMATS[export_format])
+        response['Content-Disposition'] = 'attachment; filename="profiles.{}"'.format(export_format)
+        return response
+
+
 class ProfileView(DetailView):
     """
     Views for User Profile.
+    Profile is read once per request, and cached until it changes, see portfolio.page_cache.
     """
     template_name = 'portfolio/profile.html'
     model = Profile
-    extra_context = dict()
 
     def get_object(self, queryset=None):
-        # get profile if profile exists, create profile if profile does not exist
-        obj, created = self.model.objects.get_or_create(user=self.request.user, first_name=self.request.user.first_name,
-                                                        last_name=self.request.user.last_name)
-        return obj
+        return page_cache.get_profile(self.request.user, self.request.session)
 
     def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
         # field that will be rendered using loop, so we don't have to render it manually
-        self.extra_context['loop_fields'] = model_to_dict(self.get_object(),
-                                                          exclude=('id', 'user', 'first_name', 'last_name'))
+        context['loop_fields'] = model_to_dict(self.object, exclude=('id', 'user', 'first_name', 'last_name'))
 
         # other field that will be rendered without using loop
-        self.extra_context['profile'] = model_to_dict(self.get_object(), fields=('first_name', 'last_name',
-                                                                                 'expertise', 'location', 'photo'))
+        context['profile'] = model_to_dict(self.object, fields=('first_name', 'last_name',
+                                                                'expertise', 'location', 'photo'))
+        # photo is shown as placeholder while it is processed by background worker
+        context['photo_status'] = self.object.photo_status
 
-        self.extra_context['menu_page'] = 'profile' # variable to indicate which page the user is in
+        context['menu_page'] = 'profile' # variable to indicate which page the user is in
 
-        return super().get_context_data(**kwargs)
+        return context
 
 class ProfileEditView(UpdateView):
     """
@@ -59,3 +353,9 @@ class ProfileEditView(UpdateView):
     def get_object(self, queryset=None):
         obj = self.form_class.Meta.model.objects.get(user=self.request.user)
         return obj
+
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        # other processes may still cache the old page, make sure the user gets the saved Profile
+        page_cache.invalidate_profile(self.request.user.pk, self.request.session)
+        return response
@@ -0,0 +1,13 @@
+"""
+ASGI config for project project.
+
+It exposes the ASGI callable as a module-level variable named ``application``, to be run by an ASGI server,
+e.g. `uvicorn project.asgi:application`. project/wsgi.py is still the entry point of WSGI servers, and its
+application is run by the ASGI handler, see project.asgi_handler.
+"""
+
+from project.asgi_handler import WSGIToASGIHandler
+# sets DJANGO_SETTINGS_MODULE and Django up, like for WSGI servers
+from project.wsgi import application as wsgi_application
+
+application = WSGIToASGIHandler(wsgi_application)
@@ -0,0 +1,190 @@
+"""
+ASGI handler of project.asgi.
+
+Django 2.2 views are synchronous, so WSGIToASGIHandler runs the same WSGI application (Django and the static file
+handler) in a pool of ASGI_THREADS threads. Database work of a request happens in one pool thread, which is
+released as soon as the response is built. The response is then sent by the event loop, so a slow client
+downloading tiles or GeoJSON holds a socket instead of a worker, and requests beyond the pool size wait without
+holding one either. Streaming responses (export) are generated lazily from database, so their thread is held
+until they are sent.
+"""
+import asyncio
+import logging
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.http import HttpResponseBase
+
+logger = logging.getLogger(__name__)
+
+# Number of chunks of a streaming response buffered while the client is receiving
+STREAM_QUEUE_SIZE = 8
+
+
+def build_environ(scope, body):
+    """
+    Build WSGI environ of an ASGI HTTP request
+    :param scope: ASGI connection scope
+    :param body: file containing request body
+    """
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        # WSGI strings are bytes decoded as latin-1
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        environ[name] = environ[name] + ',' + value if name in environ else value
+    return environ
+
+
+def close(iterable):
+    if hasattr(iterable, 'close'):
+        iterable.close()
+
+
+class WSGIToASGIHandler(object):
+    """
+    ASGI application running a WSGI application in a bounded thread pool
+    """
+
+    def __init__(self, application, threads=None):
+        self.application = application
+        self.threads = threads or settings.ASGI_THREADS
+        self.executor = None
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='asgi')
+        return self.executor
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.handle(scope, receive, send)
+        else:
+            raise ValueError('{} connections are not supported'.format(scope['type']))
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.executor is not None:
+                    await asyncio.get_event_loop().run_in_executor(None, self.executor.shutdown)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read_body(self, receive):
+        """
+        :return: file with request body, or None if client disconnected
+        """
+        body = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE, mode='w+b')
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            body.write(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+        body.seek(0)
+        return body
+
+    def run(self, environ):
+        """
+        Call the WSGI application, in a pool thread
+        :return: tuple of (status, headers, body), body is bytes, or the iterable of a streaming response
+        """
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'], response['headers'] = status, headers
+
+        iterable = self.application(environ, start_response)
+        if isinstance(iterable, HttpResponseBase) and iterable.streaming:
+            return response['status'], response['headers'], iterable
+        try:
+            # the content of other Django responses is already in memory
+            return response['status'], response['headers'], b''.join(iterable)
+        finally:
+            close(iterable)
+
+    def stream(self, iterable, queue, loop, cancelled):
+        """
+        Generate a streaming response into a queue, in a pool thread. Blocks while the queue is full.
+        """
+        try:
+            for chunk in iterable:
+                if cancelled.is_set():
+                    break
+                if chunk:
+                    asyncio.run_coroutine_threadsafe(queue.put(chunk), loop).result()
+        except Exception:
+            logger.exception('Streaming response failed')
+        finally:
+            close(iterable)
+            asyncio.run_coroutine_threadsafe(queue.put(None), loop).result()
+
+    async def handle(self, scope, receive, send):
+        body = await self.read_body(receive)
+        if body is None:
+            return
+
+        loop = asyncio.get_event_loop()
+        try:
+            status, headers, content = await loop.run_in_executor(self.get_executor(), self.run,
+                                                                  build_environ(scope, body))
+        finally:
+            body.close()
+
+        await send({
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        })
+        if isinstance(content, bytes):
+            await send({'type': 'http.response.body', 'body': content})
+            return
+
+        queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        cancelled = threading.Event()
+        loop.run_in_executor(self.get_executor(), self.stream, content, queue, loop, cancelled)
+        chunk = b''
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if chunk is not None:
+                # client went away, let the thread stop and finish the queue
+                cancelled.set()
+                while await queue.get() is not None:
+                    pass
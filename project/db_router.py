@@ -0,0 +1,151 @@
+"""
+Read replica routing.
+
+Views wrapped with use_replica (map, listing, search and tile APIs, admin changelists) read from one of the
+DATABASE_REPLICAS on GET and HEAD requests. Everything else, and every write, uses the primary `default` database.
+
+Replicas lag behind the primary, so a client that has just written something (e.g. saved its Profile) reads from
+the primary for REPLICA_PIN_SECONDS: ReplicaPinMiddleware sets a cookie on responses of requests that wrote to
+database. Results that are stored in a cache shared by every client (map tiles, cluster grids) are read from the
+primary with read_from_primary(), otherwise a lagging replica could fill the cache with data older than the write
+that has just invalidated it. A replica that can not be reached, or lags more than REPLICA_MAX_LAG seconds, is skipped until it is
+checked again REPLICA_HEALTH_CHECK_INTERVAL seconds later. When no replica is healthy, reads go to the primary.
+"""
+import functools
+import logging
+import random
+import time
+from contextlib import contextmanager
+from threading import local
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = 'db_pin'
+
+# Routing state of the request handled by the current thread
+state = local()
+# {alias: (time of the last check, healthy)}
+health = {}
+
+
+def is_pinned(request):
+    """
+    :return: True if the client wrote to database in the last REPLICA_PIN_SECONDS
+    """
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+@contextmanager
+def read_from_replica(request):
+    """
+    Read from a replica inside the block, if request is safe and its client is not pinned to the primary
+    """
+    previous = getattr(state, 'replica', False)
+    state.replica = request.method in ('GET', 'HEAD') and not is_pinned(request)
+    try:
+        yield
+    finally:
+        state.replica = previous
+
+
+@contextmanager
+def read_from_primary():
+    """
+    Read from the primary inside the block, e.g. to render something that is cached for every client
+    """
+    previous = getattr(state, 'replica', False)
+    state.replica = False
+    try:
+        yield
+    finally:
+        state.replica = previous
+
+
+def use_replica(view):
+    """
+    Decorator for views whose reads can go to a replica
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with read_from_replica(request):
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+def check_replica(alias):
+    """
+    :return: True if the replica answers and its replication lag is below REPLICA_MAX_LAG
+    """
+    try:
+        with connections[alias].cursor() as cursor:
+            if connections[alias].vendor != 'postgresql':
+                cursor.execute('SELECT 1')
+                return True
+            # NULL when the database is not replaying WAL, e.g. it is a mirror of the primary in tests
+            cursor.execute('SELECT EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())')
+            lag = cursor.fetchone()[0]
+    except DatabaseError:
+        logger.warning('Replica %s is not reachable, reading from primary', alias, exc_info=True)
+        connections[alias].close()
+        return False
+
+    if lag is not None and lag > settings.REPLICA_MAX_LAG:
+        logger.warning('Replica %s lags %s seconds behind primary', alias, lag)
+        return False
+    return True
+
+
+def is_healthy(alias):
+    checked_at, healthy = health.get(alias, (None, False))
+    now = time.monotonic()
+    if checked_at is None or now - checked_at >= settings.REPLICA_HEALTH_CHECK_INTERVAL:
+        healthy = check_replica(alias)
+        health[alias] = (now, healthy)
+    return healthy
+
+
+class ReplicaRouter(object):
+    """
+    Route reads of use_replica views to a healthy replica, and everything else to the primary
+    """
+
+    def db_for_read(self, model, **hints):
+        if getattr(state, 'replica', False):
+            replicas = [alias for alias in settings.DATABASE_REPLICAS if is_healthy(alias)]
+            if replicas:
+                return random.choice(replicas)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas have the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+class ReplicaPinMiddleware(object):
+    """
+    Pin client to the primary for REPLICA_PIN_SECONDS after a request of it writes to database
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state.replica, state.wrote = False, False
+        response = self.get_response(request)
+        if state.wrote and settings.DATABASE_REPLICAS:
+            response.set_cookie(PIN_COOKIE, str(time.time() + settings.REPLICA_PIN_SECONDS),
+                                max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,221 @@
+"""
+Request instrumentation.
+
+InstrumentationMiddleware records, per view: a latency histogram, number and total time of SQL queries, template
+render time and response size. They are kept in process memory and exposed in Prometheus text format by
+metrics_view, so each worker process is scraped on its own. Requests slower than SLOW_REQUEST_THRESHOLD
+milliseconds are logged with their slowest queries.
+
+Recording a request costs a few timer calls and one locked dictionary update, plus a timer call per SQL query.
+"""
+import logging
+import threading
+from contextlib import ExitStack
+from time import perf_counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import Http404, HttpResponse
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Number of queries written in slow request log
+SLOW_QUERIES_LOGGED = 5
+
+
+class ViewStats(object):
+    """
+    Totals of the requests handled by a view
+    """
+    __slots__ = ('buckets', 'count', 'duration', 'queries', 'sql_duration', 'render_duration', 'response_bytes',
+                 'statuses')
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.duration = 0.0
+        self.queries = 0
+        self.sql_duration = 0.0
+        self.render_duration = 0.0
+        self.response_bytes = 0
+        self.statuses = {}
+
+
+class Registry(object):
+    """
+    Thread-safe store of ViewStats by view name
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def record(self, view, status, duration, queries, sql_duration, render_duration, response_bytes):
+        with self.lock:
+            stats = self.views.get(view)
+            if stats is None:
+                stats = self.views[view] = ViewStats()
+            for i, bound in enumerate(BUCKETS):
+                if duration <= bound:
+                    stats.buckets[i] += 1
+                    break
+            stats.count += 1
+            stats.duration += duration
+            stats.queries += queries
+            stats.sql_duration += sql_duration
+            stats.render_duration += render_duration
+            stats.response_bytes += response_bytes
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+
+    def snapshot(self):
+        """
+        :return: dictionary of {view name: copy of ViewStats}
+        """
+        with self.lock:
+            views = {}
+            for view, stats in self.views.items():
+                copy = views[view] = ViewStats()
+                for name in ViewStats.__slots__:
+                    value = getattr(stats, name)
+                    setattr(copy, name, list(value) if name == 'buckets' else
+                            dict(value) if name == 'statuses' else value)
+            return views
+
+    def clear(self):
+        with self.lock:
+            self.views.clear()
+
+
+registry = Registry()
+
+
+class QueryRecorder(object):
+    """
+    Database execute wrapper that counts and times queries
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = perf_counter() - start
+            self.count += 1
+            self.duration += duration
+            self.queries.append((duration, sql))
+
+
+class InstrumentationMiddleware(object):
+    """
+    Record metrics of every request. Put it first in MIDDLEWARE, so the latency includes every other middleware.
+    """
+
+    def __init__(self, get_response):
+        if not settings.INSTRUMENTATION_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = perf_counter()
+        recorder = QueryRecorder()
+        request._render_duration = 0.0
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(recorder))
+            response = self.get_response(request)
+        duration = perf_counter() - start
+
+        match = request.resolver_match
+        view = (match.view_name or match.url_name or match._func_path) if match is not None else 'unresolved'
+        response_bytes = 0 if response.streaming else len(response.content)
+        registry.record(view, response.status_code, duration, recorder.count, recorder.duration,
+                        request._render_duration, response_bytes)
+
+        if duration * 1000 >= settings.SLOW_REQUEST_THRESHOLD:
+            slowest = sorted(recorder.queries, key=lambda query: query[0], reverse=True)[:SLOW_QUERIES_LOGGED]
+            logger.warning('Slow request %s %s (%s): %.0f ms, %s queries in %.0f ms, render %.0f ms%s',
+                           request.method, request.path, view, duration * 1000, recorder.count,
+                           recorder.duration * 1000, request._render_duration * 1000,
+                           ''.join('\n  {:.1f} ms: {}'.format(query_duration * 1000, sql)
+                                   for query_duration, sql in slowest))
+        return response
+
+    def process_template_response(self, request, response):
+        # template is rendered right after the last process_template_response, which is this one
+        start = perf_counter()
+
+        def rendered(response):
+            request._render_duration += perf_counter() - start
+
+        response.add_post_render_callback(rendered)
+        return response
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_metrics(views, extra_counters=None):
+    """
+    Format metrics in Prometheus text exposition format
+    :param views: dictionary of {view name: ViewStats}
+    :param extra_counters: list of (name, help, {label value: count}) of other counters, labelled by `event`
+    """
+    lines = []
+
+    def header(name, metric_type, help_text):
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, metric_type))
+
+    header('django_request_duration_seconds', 'histogram', 'Request latency by view.')
+    for view, stats in sorted(views.items()):
+        label = 'view="{}"'.format(escape_label(view))
+        cumulative = 0
+        for bound, count in zip(BUCKETS, stats.buckets):
+            cumulative += count
+            lines.append('django_request_duration_seconds_bucket{{{},le="{}"}} {}'.format(label, bound, cumulative))
+        lines.append('django_request_duration_seconds_bucket{{{},le="+Inf"}} {}'.format(label, stats.count))
+        lines.append('django_request_duration_seconds_sum{{{}}} {}'.format(label, stats.duration))
+        lines.append('django_request_duration_seconds_count{{{}}} {}'.format(label, stats.count))
+
+    header('django_requests_total', 'counter', 'Requests by view and response status.')
+    for view, stats in sorted(views.items()):
+        for status, count in sorted(stats.statuses.items()):
+            lines.append('django_requests_total{{view="{}",status="{}"}} {}'.format(escape_label(view), status, count))
+
+    for name, help_text, attribute in (
+            ('django_request_queries_total', 'SQL queries by view.', 'queries'),
+            ('django_request_sql_seconds_total', 'Time spent in SQL queries by view.', 'sql_duration'),
+            ('django_request_render_seconds_total', 'Time spent rendering templates by view.', 'render_duration'),
+            ('django_response_bytes_total', 'Response body size by view.', 'response_bytes')):
+        header(name, 'counter', help_text)
+        for view, stats in sorted(views.items()):
+            lines.append('{}{{view="{}"}} {}'.format(name, escape_label(view), getattr(stats, attribute)))
+
+    for name, help_text, counts in extra_counters or []:
+        header(name, 'counter', help_text)
+        for event, count in sorted(counts.items()):
+            lines.append('{}{{event="{}"}} {}'.format(name, escape_label(event), count))
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """
+    Metrics of this process in Prometheus text format. Only answers requests from METRICS_ALLOWED_IPS.
+    """
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        raise Http404
+
+    from users import throttle
+
+    extra_counters = [('login_throttle_total', 'Checked, blocked and failed logins.', throttle.get_metrics())]
+    return HttpResponse(render_metrics(registry.snapshot(), extra_counters),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import sys
 from decouple import config, Csv
 import dj_database_url
 
@@ -28,6 +29,14 @@ SECRET_KEY = config('SECRET_KEY')
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = config('DEBUG', default=False, cast=bool)
 
+# Settings profile: 'dev' loads DEV_APPS and DEV_MIDDLEWARE (debug toolbar), 'test' uses a fast password hasher,
+# 'prod' loads neither. Default is 'test' for `manage.py test`, otherwise 'dev' when DEBUG is on and 'prod' when off.
+SETTINGS_PROFILES = ('dev', 'test', 'prod')
+SETTINGS_PROFILE = config('SETTINGS_PROFILE',
+                          default='test' if sys.argv[1:2] == ['test'] else 'dev' if DEBUG else 'prod')
+if SETTINGS_PROFILE not in SETTINGS_PROFILES:
+    raise ValueError('SETTINGS_PROFILE must be one of {}'.format(', '.join(SETTINGS_PROFILES)))
+
 # Put ALLOWED_HOST in .env file
 ALLOWED_HOSTS = config('ALLOWED_HOSTS', default=['localhost','0.0.0.0','127.0.0.01'], cast=Csv())
 
@@ -39,6 +48,7 @@ INSTALLED_APPS = [
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.gis',
+    'django.contrib.postgres',
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
@@ -48,7 +58,6 @@ INSTALLED_APPS = [
     'allauth',
     'allauth.account',
     'crispy_forms',
-    'debug_toolbar',
     'leaflet',
 
     # Local
@@ -57,16 +66,27 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'project.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'users.throttle.LoginThrottleMiddleware',
+    'project.db_router.ReplicaPinMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Only loaded by 'dev' profile, so other processes neither import them nor run their middleware
+DEV_APPS = ['debug_toolbar']
+DEV_MIDDLEWARE = ['debug_toolbar.middleware.DebugToolbarMiddleware']
+if SETTINGS_PROFILE == 'dev':
+    INSTALLED_APPS += DEV_APPS
+    # right after CommonMiddleware, where debug toolbar expects to be
+    index = MIDDLEWARE.index('django.middleware.common.CommonMiddleware') + 1
+    MIDDLEWARE[index:index] = DEV_MIDDLEWARE
+
 ROOT_URLCONF = 'project.urls'
 
 TEMPLATES = [
@@ -86,6 +106,9 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'project.wsgi.application'
+# Requests served by project.asgi run in a pool of ASGI_THREADS threads per process, which bounds the number of
+# database connections. Responses are sent after the thread is released.
+ASGI_THREADS = config('ASGI_THREADS', default=16, cast=int)
 
 
 # Database
@@ -98,6 +121,35 @@ DATABASES = {
     )
 }
 
+# Read replicas, as comma-separated database URLs in DATABASE_REPLICAS. Map, listing, search and tile APIs and
+# admin changelists read from them, see project/db_router.py.
+DATABASE_REPLICAS = []
+for index, url in enumerate(config('DATABASE_REPLICAS', default='', cast=Csv())):
+    alias = 'replica_{}'.format(index)
+    DATABASES[alias] = dj_database_url.parse(url)
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['project.db_router.ReplicaRouter']
+# Client reads from the primary for REPLICA_PIN_SECONDS after it writes, so it sees its own changes
+REPLICA_PIN_SECONDS = config('REPLICA_PIN_SECONDS', default=10, cast=int)
+# Replica is skipped when it lags more than REPLICA_MAX_LAG seconds or can not be reached,
+# until it is checked again REPLICA_HEALTH_CHECK_INTERVAL seconds later
+REPLICA_MAX_LAG = config('REPLICA_MAX_LAG', default=30, cast=int)
+REPLICA_HEALTH_CHECK_INTERVAL = config('REPLICA_HEALTH_CHECK_INTERVAL', default=5, cast=int)
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+# Local memory cache by default. Use file-based cache or a shared cache server (memcached or redis) when
+# running more than one process, see .env_example for example.
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -117,6 +169,10 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Tests create many users, a slow password hash only makes them slower
+if SETTINGS_PROFILE == 'test':
+    PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/2.2/topics/i18n/
@@ -140,9 +196,52 @@ STATIC_ROOT = os.path.join(os.path.dirname(BASE_DIR), 'static')
 STATICFILES_DIRS = [
     os.path.join(BASE_DIR, "static")
 ]
+# In 'prod' profile, collectstatic writes files under hashed names with gzip/brotli variants, and the WSGI
+# application serves them itself (see project.staticfiles). Hashed files are cached by clients forever, other
+# files for STATIC_MAX_AGE seconds.
+if SETTINGS_PROFILE == 'prod':
+    STATICFILES_STORAGE = 'project.staticfiles.CompressedManifestStaticFilesStorage'
+STATIC_HANDLER = config('STATIC_HANDLER', default=SETTINGS_PROFILE == 'prod', cast=bool)
+STATIC_MAX_AGE = config('STATIC_MAX_AGE', default=60, cast=int)
 # Media files (Profile Photo)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Widths of resized Profile photo, generated in WebP and JPEG next to the original
+PROFILE_PHOTO_SIZES = (64, 210, 400)
+
+# Background jobs, run by `manage.py run_worker`
+# With JOB_QUEUE_EAGER, jobs are run right away in the process that enqueues them, without worker
+JOB_QUEUE_EAGER = config('JOB_QUEUE_EAGER', default=False, cast=bool)
+# Failed job is tried again after JOB_RETRY_DELAY seconds, doubled after every attempt
+JOB_MAX_ATTEMPTS = config('JOB_MAX_ATTEMPTS', default=3, cast=int)
+JOB_RETRY_DELAY = config('JOB_RETRY_DELAY', default=30, cast=int)
+
+# Login, logout and failed login LogEntry are buffered and written in bulk, when there are
+# AUDIT_LOG_BATCH_SIZE entries or the oldest entry is AUDIT_LOG_FLUSH_INTERVAL seconds old.
+# Entries that can not be written to database are kept in AUDIT_LOG_SPOOL until the next write.
+AUDIT_LOG_BATCH_SIZE = config('AUDIT_LOG_BATCH_SIZE', default=100, cast=int)
+AUDIT_LOG_FLUSH_INTERVAL = config('AUDIT_LOG_FLUSH_INTERVAL', default=2, cast=float)
+AUDIT_LOG_SPOOL = config('AUDIT_LOG_SPOOL', default=os.path.join(BASE_DIR, 'audit_spool.jsonl'))
+# LogEntry older than AUDIT_LOG_RETENTION_DAYS are rolled up and removed by `manage.py prune_log_entries`
+AUDIT_LOG_RETENTION_DAYS = config('AUDIT_LOG_RETENTION_DAYS', default=365, cast=int)
+# LogEntry admin searches only look at the last AUDIT_LOG_SEARCH_DAYS days, unless another window is chosen
+AUDIT_LOG_SEARCH_DAYS = config('AUDIT_LOG_SEARCH_DAYS', default=7, cast=int)
+
+# Login is rejected with 429 after LOGIN_THROTTLE_IP_LIMIT failures from an IP address, or LOGIN_THROTTLE_EMAIL_LIMIT
+# failures for an email, in the last LOGIN_THROTTLE_WINDOW seconds.
+# Use users.throttle.CacheStore with a shared LOGIN_THROTTLE_CACHE (e.g. memcached) when running several workers.
+LOGIN_THROTTLE_STORE = config('LOGIN_THROTTLE_STORE', default='users.throttle.LocalMemoryStore')
+LOGIN_THROTTLE_CACHE = config('LOGIN_THROTTLE_CACHE', default='default')
+LOGIN_THROTTLE_WINDOW = config('LOGIN_THROTTLE_WINDOW', default=300, cast=int)
+LOGIN_THROTTLE_IP_LIMIT = config('LOGIN_THROTTLE_IP_LIMIT', default=20, cast=int)
+LOGIN_THROTTLE_EMAIL_LIMIT = config('LOGIN_THROTTLE_EMAIL_LIMIT', default=5, cast=int)
+
+# Latency, SQL, template render time and response size of every request are recorded per view, and served in
+# Prometheus text format at /metrics to METRICS_ALLOWED_IPS. Requests slower than SLOW_REQUEST_THRESHOLD
+# milliseconds are logged with their slowest queries.
+INSTRUMENTATION_ENABLED = config('INSTRUMENTATION_ENABLED', default=True, cast=bool)
+METRICS_ALLOWED_IPS = config('METRICS_ALLOWED_IPS', default='127.0.0.1', cast=Csv())
+SLOW_REQUEST_THRESHOLD = config('SLOW_REQUEST_THRESHOLD', default=500, cast=int)
 
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
@@ -179,4 +278,34 @@ LEAFLET_CONFIG = {
     'DEFAULT_CENTER': (-4.9212,6.2748),
     'DEFAULT_ZOOM': 2,
     'MAX_ZOOM': 18,
-}
\ No newline at end of file
+}
+
+# Home map API
+# Maximum number of Profile returned by one request of the map API, client can only lower it
+PROFILE_MAP_MAX_FEATURES = config('PROFILE_MAP_MAX_FEATURES', default=1000, cast=int)
+# Profile is clustered on the server up to this zoom level, above it the map shows each Profile
+PROFILE_CLUSTER_MAX_ZOOM = config('PROFILE_CLUSTER_MAX_ZOOM', default=15, cast=int)
+# Size of cluster grid cell, in pixel
+PROFILE_CLUSTER_CELL_SIZE = config('PROFILE_CLUSTER_CELL_SIZE', default=64, cast=int)
+# Cluster grids are cached up to this zoom level, higher zoom levels are aggregated inside the map viewport
+PROFILE_CLUSTER_CACHE_MAX_ZOOM = config('PROFILE_CLUSTER_CACHE_MAX_ZOOM', default=5, cast=int)
+# Rendered Profile vector tiles up to PROFILE_TILE_CACHE_MAX_ZOOM are cached in this directory
+PROFILE_TILE_CACHE_DIR = config('PROFILE_TILE_CACHE_DIR', default=os.path.join(BASE_DIR, 'tile_cache'))
+PROFILE_TILE_CACHE_MAX_ZOOM = config('PROFILE_TILE_CACHE_MAX_ZOOM', default=16, cast=int)
+# Text search configuration of Profile search vector. 'simple' does not stem words, as names are in any language.
+# Run `manage.py rebuild_search_vectors` after changing it.
+PROFILE_SEARCH_CONFIG = config('PROFILE_SEARCH_CONFIG', default='simple')
+# Maximum number of Profile returned by one request of the search API
+PROFILE_SEARCH_PAGE_SIZE = config('PROFILE_SEARCH_PAGE_SIZE', default=20, cast=int)
+# Cache alias for home map payload, clusters and profile page, and how long they are cached, in seconds.
+# Signal receivers only invalidate a local memory cache in the process that handled the write, so other
+# processes would keep the old map and profile page until they expire. Entries of a local memory cache
+# expire after a minute by default, and the 'prod' profile warns about it, see portfolio.checks.
+PROFILE_MAP_CACHE = config('PROFILE_MAP_CACHE', default='default')
+PROFILE_MAP_CACHE_LOCAL = CACHES.get(PROFILE_MAP_CACHE, {}).get('BACKEND', '').endswith('.LocMemCache')
+PROFILE_MAP_CACHE_TIMEOUT = config('PROFILE_MAP_CACHE_TIMEOUT', default=60 if PROFILE_MAP_CACHE_LOCAL else 24 * 60 * 60,
+                                   cast=int)
+# Profile per Expertise is counted in map tiles of these zoom levels, and the finest level which covers
+# the viewport with at most PROFILE_FACET_MAX_CELLS tiles is used to count Expertise of the viewport
+PROFILE_FACET_ZOOMS = (0, 4, 8, 12)
+PROFILE_FACET_MAX_CELLS = config('PROFILE_FACET_MAX_CELLS', default=256, cast=int)
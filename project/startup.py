@@ -0,0 +1,99 @@
+"""
+Startup cost of a worker process, reported by `manage.py startup_report`.
+
+measure() must run in a fresh interpreter, before Django is set up, so the command runs this module with
+`python -m project.startup`, which prints the measurements as JSON. Each app is timed while Django imports its
+module, imports its models and runs its ready(), then the middleware and URLconf are loaded like on the first request.
+"""
+import json
+import os
+import resource
+import sys
+from time import perf_counter
+
+
+def max_rss():
+    """
+    :return: peak resident memory of this process in kilobytes (Linux reports kilobytes, macOS bytes)
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+class Timer(object):
+    """
+    Accumulate time and number of new modules of the phases of each app
+    """
+
+    def __init__(self):
+        self.apps = {}
+
+    def time(self, app, phase, function, *args):
+        start, modules = perf_counter(), len(sys.modules)
+        try:
+            return function(*args)
+        finally:
+            stats = self.apps.setdefault(app, {'import': 0.0, 'models': 0.0, 'ready': 0.0, 'modules': 0})
+            stats[phase] += (perf_counter() - start) * 1000
+            stats['modules'] += len(sys.modules) - modules
+
+
+def measure():
+    """
+    Set up Django and load the request handler, timing every step
+    :return: dictionary of timings in milliseconds, module counts and memory
+    """
+    start, modules, rss = perf_counter(), len(sys.modules), max_rss()
+    import django
+    from django.apps import AppConfig
+    from django.conf import settings
+
+    timer = Timer()
+    create = AppConfig.create.__func__
+
+    def timed_create(cls, entry):
+        app_config = timer.time(entry, 'import', create, cls, entry)
+        for phase, method in (('models', app_config.import_models), ('ready', app_config.ready)):
+            # bind phase and method now, they change in the loop
+            setattr(app_config, method.__name__,
+                    lambda phase=phase, method=method: timer.time(entry, phase, method))
+        return app_config
+
+    AppConfig.create = classmethod(timed_create)
+    settings_start = perf_counter()
+    settings.INSTALLED_APPS
+    settings_time = perf_counter() - settings_start
+
+    setup_start = perf_counter()
+    django.setup(set_prefix=False)
+    setup_time = perf_counter() - setup_start
+
+    from django.core.handlers.wsgi import WSGIHandler
+    from django.urls import get_resolver
+
+    middleware_start = perf_counter()
+    WSGIHandler()
+    middleware_time = perf_counter() - middleware_start
+
+    urlconf_start = perf_counter()
+    get_resolver().url_patterns
+    urlconf_time = perf_counter() - urlconf_start
+
+    return {
+        'profile': settings.SETTINGS_PROFILE,
+        'total_ms': round((perf_counter() - start) * 1000, 1),
+        'settings_ms': round(settings_time * 1000, 1),
+        'setup_ms': round(setup_time * 1000, 1),
+        'middleware_ms': round(middleware_time * 1000, 1),
+        'urlconf_ms': round(urlconf_time * 1000, 1),
+        'modules': len(sys.modules) - modules,
+        'max_rss_kb': max_rss(),
+        'rss_growth_kb': max_rss() - rss,
+        'apps': [dict(app=app, **{key: round(value, 1) for key, value in stats.items()})
+                 for app, stats in timer.apps.items()],
+    }
+
+
+if __name__ == '__main__':
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+    print(json.dumps(measure()))
@@ -0,0 +1,172 @@
+"""
+Static files for production.
+
+CompressedManifestStaticFilesStorage is used by `manage.py collectstatic` in 'prod' settings profile. Like
+ManifestStaticFilesStorage, it copies every file under a name that contains the hash of its content, e.g.
+`css/base.55e7cbb9ba48.css`, and `{% static %}` links to that name. Then text files are compressed once with gzip,
+and with brotli if the Brotli package is installed, next to the original, e.g. `css/base.55e7cbb9ba48.css.gz`.
+
+StaticFileHandler serves STATIC_ROOT in front of the Django WSGI application, without going through middleware.
+It picks the compressed file the client accepts, and lets clients cache hashed files forever, because a changed
+file gets a new name. Files are listed when the process starts, so run collectstatic before starting workers.
+"""
+import gzip
+import mimetypes
+import os
+from wsgiref.util import FileWrapper
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.utils.http import http_date
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Extensions of files that are worth compressing, images and fonts other than these are already compressed
+COMPRESSIBLE = ('.css', '.js', '.json', '.map', '.svg', '.txt', '.html', '.xml', '.ico', '.ttf', '.eot')
+# Compressed file is only kept if it is smaller than this ratio of the original
+MIN_COMPRESSION_RATIO = 0.95
+# Encoding name in Accept-Encoding, and extension of the compressed file, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+# Cache-Control of files with hashed name
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def compress(content):
+    """
+    :param content: file content in bytes
+    :return: dictionary of {file extension: compressed content} of the encodings that make content smaller
+    """
+    variants = {'.gz': gzip.compress(content, compresslevel=9)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(content)
+    return {ext: compressed for ext, compressed in variants.items()
+            if len(compressed) < len(content) * MIN_COMPRESSION_RATIO}
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Manifest storage that also writes gzip and brotli variants of text files
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+
+        names = set(paths) | set(self.hashed_files.values())
+        for name in sorted(names):
+            if os.path.splitext(name)[1].lower() in COMPRESSIBLE and self.exists(name):
+                with self.open(name) as f:
+                    content = f.read()
+                for ext, compressed in compress(content).items():
+                    with open(self.path(name) + ext, 'wb') as f:
+                        f.write(compressed)
+
+
+class StaticFile(object):
+    """
+    File under STATIC_ROOT with its headers, prepared once when the handler starts
+    """
+    __slots__ = ('path', 'content_type', 'cache_control', 'last_modified', 'etag', 'size', 'variants')
+
+    def __init__(self, path, cache_control):
+        stat = os.stat(path)
+        content_type, encoding = mimetypes.guess_type(path)
+        content_type = content_type or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type in ('application/javascript', 'application/json'):
+            content_type += '; charset=utf-8'
+
+        self.path = path
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.last_modified = http_date(stat.st_mtime)
+        self.etag = '"{:x}-{:x}"'.format(int(stat.st_mtime), stat.st_size)
+        self.size = stat.st_size
+        # [(encoding, path, size)] of compressed files, in order of preference
+        self.variants = [(encoding, path + ext, os.path.getsize(path + ext))
+                         for encoding, ext in ENCODINGS if os.path.isfile(path + ext)]
+
+    def choose(self, accept_encoding):
+        """
+        :return: tuple of (encoding or None, path, size) of the preferred file the client accepts
+        """
+        accepted = set()
+        for value in accept_encoding.split(','):
+            encoding, _, params = value.strip().partition(';')
+            if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+                accepted.add(encoding.strip().lower())
+        for encoding, path, size in self.variants:
+            if encoding in accepted:
+                return encoding, path, size
+        return None, self.path, self.size
+
+
+def list_files(root, prefix):
+    """
+    :param root: STATIC_ROOT
+    :param prefix: URL path of STATIC_URL
+    :return: dictionary of {URL path: StaticFile}
+    """
+    try:
+        # the storage reads the manifest written by collectstatic
+        hashed = set(CompressedManifestStaticFilesStorage(location=root).hashed_files.values())
+    except ValueError:
+        hashed = set()
+
+    files = {}
+    for directory, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.endswith(tuple(ext for encoding, ext in ENCODINGS)):
+                continue
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, root).replace(os.sep, '/')
+            cache_control = IMMUTABLE if name in hashed else 'public, max-age={}'.format(settings.STATIC_MAX_AGE)
+            files[prefix + name] = StaticFile(path, cache_control)
+    return files
+
+
+class StaticFileHandler(object):
+    """
+    WSGI application that serves STATIC_URL from STATIC_ROOT, and passes other requests to the wrapped application
+    """
+
+    def __init__(self, application, root=None, url=None):
+        self.application = application
+        root = root or settings.STATIC_ROOT
+        self.prefix = url or settings.STATIC_URL
+        self.files = list_files(root, self.prefix) if os.path.isdir(root) else {}
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if not path.startswith(self.prefix):
+            return self.application(environ, start_response)
+
+        static_file = self.files.get(path)
+        if static_file is None:
+            # e.g. media or a file added after start, Django answers it as before
+            return self.application(environ, start_response)
+        if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            start_response('405 Method Not Allowed', [('Allow', 'GET, HEAD'), ('Content-Length', '0')])
+            return []
+
+        encoding, file_path, size = static_file.choose(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        etag = static_file.etag if encoding is None else static_file.etag[:-1] + '-' + encoding + '"'
+        headers = [('Cache-Control', static_file.cache_control), ('ETag', etag),
+                   ('Last-Modified', static_file.last_modified)]
+        if static_file.variants:
+            headers.append(('Vary', 'Accept-Encoding'))
+
+        if etag in [value.strip() for value in environ.get('HTTP_IF_NONE_MATCH', '').split(',')]:
+            start_response('304 Not Modified', headers)
+            return []
+
+        headers += [('Content-Type', static_file.content_type), ('Content-Length', str(size))]
+        if encoding is not None:
+            headers.append(('Content-Encoding', encoding))
+        start_response('200 OK', headers)
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        return environ.get('wsgi.file_wrapper', FileWrapper)(open(file_path, 'rb'), 64 * 1024)
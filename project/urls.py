@@ -3,15 +3,22 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf.urls.static import static
 
+from project.instrumentation import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('users/', include('django.contrib.auth.urls')),
     path('accounts/', include('allauth.urls')),
+    path('metrics', metrics_view, name='metrics'),
     path('', include('portfolio.urls')),
 ]
 
 if settings.DEBUG:
+    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+
+# debug toolbar is only installed by 'dev' settings profile
+if 'debug_toolbar' in settings.INSTALLED_APPS:
     import debug_toolbar
     urlpatterns = [
         path('__debug__/', include(debug_toolbar.urls)),
-] + urlpatterns + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    ] + urlpatterns
\ No newline at end of file
@@ -9,8 +9,13 @@ https://docs.djangoproject.com/en/2.1/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
 
 application = get_wsgi_application()
+
+if settings.STATIC_HANDLER:
+    from project.staticfiles import StaticFileHandler
+    application = StaticFileHandler(application)
@@ -1,7 +1,14 @@
+import ipaddress
+from datetime import timedelta
+
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from django.utils import timezone
+from project.db_router import read_from_replica
 from .forms import CustomUserCreationForm, CustomUserChangeForm
-from .models import CustomUser, LogEntry
+from .models import CustomUser, LogEntry, LogEntrySummary
+from .paginators import EstimatedCountPaginator
 
 @admin.register(CustomUser)
 class CustomUserAdmin(UserAdmin):
@@ -10,8 +17,90 @@ class CustomUserAdmin(UserAdmin):
     model = CustomUser
     list_display = ['email', 'username',]
 
+class CreatedWithinFilter(admin.SimpleListFilter):
+    """
+    Filter LogEntry by how recently they were created. Searches are limited to the last
+    AUDIT_LOG_SEARCH_DAYS days unless another window is chosen.
+    """
+    title = 'created within'
+    parameter_name = 'within'
+    WINDOWS = {
+        '1h': timedelta(hours=1),
+        '24h': timedelta(days=1),
+        '7d': timedelta(days=7),
+        '30d': timedelta(days=30),
+        '365d': timedelta(days=365),
+    }
+
+    def lookups(self, request, model_admin):
+        return (
+            ('1h', 'Last hour'),
+            ('24h', 'Last 24 hours'),
+            ('7d', 'Last 7 days'),
+            ('30d', 'Last 30 days'),
+            ('365d', 'Last year'),
+            ('all', 'All'),
+        )
+
+    def queryset(self, request, queryset):
+        window = self.WINDOWS.get(self.value())
+        if self.value() is None and request.GET.get('q'):
+            window = timedelta(days=settings.AUDIT_LOG_SEARCH_DAYS)
+        if window is not None:
+            return queryset.filter(created_at__gte=timezone.now() - window)
+        return queryset
+
+
+class ActionFilter(admin.SimpleListFilter):
+    """
+    Filter LogEntry by action. The actions are listed here, because listing the distinct values of the
+    column would scan every partition of the table on every changelist load.
+    """
+    title = 'action'
+    parameter_name = 'action'
+
+    def lookups(self, request, model_admin):
+        return (
+            ('user_logged_in', 'user_logged_in'),
+            ('user_logged_out', 'user_logged_out'),
+            ('user_login_failed', 'user_login_failed'),
+        )
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(action=self.value())
+        return queryset
+
+
 @admin.register(LogEntry)
 class LogEntryAdmin(admin.ModelAdmin):
-    list_display = ['action', 'email', 'ip',]
+    list_display = ['action', 'email', 'ip', 'created_at',]
+    list_filter = [CreatedWithinFilter, ActionFilter,]
+    search_fields = ['=email', '=ip',]
+    ordering = ['-created_at',]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def changelist_view(self, request, extra_context=None):
+        with read_from_replica(request):
+            return super().changelist_view(request, extra_context)
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Search by exact IP address or email, so the lookup uses their index instead of scanning the table
+        """
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        try:
+            ipaddress.ip_address(search_term)
+        except ValueError:
+            return queryset.filter(email=search_term), False
+        return queryset.filter(ip=search_term), False
+
+
+@admin.register(LogEntrySummary)
+class LogEntrySummaryAdmin(admin.ModelAdmin):
+    list_display = ['date', 'action', 'count',]
     list_filter = ['action',]
-    search_fields = ['action', 'email', 'ip',]
\ No newline at end of file
+    date_hierarchy = 'date'
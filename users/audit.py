@@ -0,0 +1,211 @@
+"""
+Buffered writer of LogEntry.
+
+Login, logout and failed login are recorded in an in-process buffer instead of being inserted one by one
+inside the auth request. The buffer is written with one bulk_create when it reaches AUDIT_LOG_BATCH_SIZE
+entries, or when its first entry is older than AUDIT_LOG_FLUSH_INTERVAL seconds (checked whenever an entry
+is added or a request finishes), and when the process exits.
+
+If the database can not be written, entries are appended to the spool file AUDIT_LOG_SPOOL as JSON lines,
+and written to the database by the next successful flush. A replay renames the spool to a `.replay` file and
+locks it, so a replay that is interrupted (crash, database error) leaves a file that the next flush of any
+process replays again. Lines that can not be decoded, e.g. the last line of a crashed spool write, are moved
+to `<AUDIT_LOG_SPOOL>.rejected`.
+"""
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from django.apps import apps
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+
+class AuditBuffer(object):
+    """
+    Thread-safe buffer of LogEntry values
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = []
+        self.first_added = None
+
+    def add(self, action, ip, email):
+        """
+        Add an entry, flushing the buffer if it is full or old enough
+        """
+        entry = {'action': action, 'ip': ip, 'email': email, 'created_at': timezone.now()}
+        with self.lock:
+            if not self.entries:
+                self.first_added = time.monotonic()
+            self.entries.append(entry)
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        """
+        Flush the buffer if it reaches AUDIT_LOG_BATCH_SIZE or its first entry is older than
+        AUDIT_LOG_FLUSH_INTERVAL. Also called when a request finishes, so entries do not wait
+        for the next auth event.
+        """
+        if self.entries and (len(self.entries) >= settings.AUDIT_LOG_BATCH_SIZE or
+                             time.monotonic() - self.first_added >= settings.AUDIT_LOG_FLUSH_INTERVAL):
+            self.flush()
+
+    def flush(self):
+        """
+        Write buffered entries to database, or to the spool file if database can not be written
+        """
+        with self.lock:
+            entries, self.entries = self.entries, []
+        if not entries:
+            return
+
+        try:
+            # savepoint, so a failure does not break the transaction of the caller
+            with transaction.atomic():
+                write_entries(entries)
+        except DatabaseError:
+            logger.exception('Could not write %s audit log entries, spooling them to %s',
+                             len(entries), settings.AUDIT_LOG_SPOOL)
+            spool_entries(entries)
+        else:
+            replay_spool()
+
+
+def write_entries(entries):
+    LogEntry = apps.get_model('users', 'LogEntry')
+    LogEntry.objects.bulk_create([LogEntry(**entry) for entry in entries])
+
+
+def spool_entries(entries):
+    """
+    Append entries to the spool file, synced to disk so they survive a crash
+    """
+    with open(settings.AUDIT_LOG_SPOOL, 'a') as f:
+        f.write(''.join(json.dumps(dict(entry, created_at=entry['created_at'].isoformat())) + '\n'
+                        for entry in entries))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def replay_spool():
+    """
+    Write spooled entries to database. The spool file is renamed first, so entries spooled meanwhile
+    by other processes go to a new spool file. Replay files left by an earlier replay are written too.
+    """
+    path = settings.AUDIT_LOG_SPOOL
+    if os.path.exists(path):
+        try:
+            os.replace(path, '{}.{}.replay'.format(path, uuid.uuid4().hex))
+        except FileNotFoundError:
+            # another process has just renamed it
+            pass
+
+    for replay_path in sorted(glob.glob(glob.escape(path) + '.*.replay')):
+        replay_file(replay_path)
+
+
+def replay_file(replay_path):
+    """
+    Write entries of a replay file to database, and remove it. Nothing is done if another process is
+    replaying it. The file is kept if database fails, to be replayed by a later flush.
+    """
+    try:
+        f = open(replay_path)
+    except FileNotFoundError:
+        return
+
+    with f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        try:
+            if os.stat(replay_path).st_ino != os.fstat(f.fileno()).st_ino:
+                return
+        except FileNotFoundError:
+            # replayed and removed by the process that held the lock
+            return
+
+        rejected = []
+        try:
+            # all or nothing, so a failed replay can be tried again without duplicating entries
+            with transaction.atomic():
+                entries = []
+                for entry in read_spooled_entries(f, rejected):
+                    entries.append(entry)
+                    if len(entries) >= settings.AUDIT_LOG_BATCH_SIZE:
+                        write_entries(entries)
+                        entries = []
+                if entries:
+                    write_entries(entries)
+        except DatabaseError:
+            logger.exception('Could not replay audit log spool %s', replay_path)
+            return
+        if rejected:
+            reject_lines(rejected)
+        # removed while it is locked, so no other process can open and replay it again
+        os.remove(replay_path)
+
+
+def read_spooled_entries(lines, rejected):
+    """
+    Decode spooled entries
+    :param lines: lines of a spool file
+    :param rejected: list to which lines that can not be decoded are appended
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+            entry['created_at'] = parse_datetime(entry['created_at'])
+            if entry['created_at'] is None:
+                raise ValueError('created_at is missing')
+        except (ValueError, TypeError, KeyError):
+            rejected.append(line.rstrip('\n'))
+            continue
+        yield entry
+
+
+def reject_lines(lines):
+    """
+    Keep spooled lines that can not be decoded for inspection, instead of failing every replay
+    """
+    rejected_path = settings.AUDIT_LOG_SPOOL + '.rejected'
+    logger.warning('Could not decode %s audit log spool lines, moving them to %s', len(lines), rejected_path)
+    with open(rejected_path, 'a') as f:
+        f.write(''.join(line + '\n' for line in lines))
+
+
+buffer = AuditBuffer()
+atexit.register(buffer.flush)
+
+
+def flush_finished_request(sender, **kwargs):
+    buffer.flush_if_due()
+
+
+request_finished.connect(flush_finished_request, dispatch_uid='audit_log_flush')
+
+
+def log(action, ip, email):
+    """
+    Record an auth event
+    :param action: 'user_logged_in', 'user_logged_out' or 'user_login_failed'
+    :param ip: IP address of the request
+    :param email: email of the user
+    """
+    buffer.add(action, ip, email)
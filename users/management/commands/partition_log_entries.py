@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from users import partitions
+
+
+class Command(BaseCommand):
+    """
+    Convert LogEntry table into monthly partitions on PostgreSQL 11 or newer. Existing rows are copied,
+    so run it once during a maintenance window, then run prune_log_entries daily to keep partitions ahead.
+    """
+    help = 'Partition LogEntry table by month (PostgreSQL only)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=3,
+                            help='Number of future monthly partitions to create')
+
+    def handle(self, *args, **options):
+        if not partitions.supports_partitions():
+            raise CommandError('LogEntry can only be partitioned on PostgreSQL 11 or newer')
+        if partitions.is_partitioned():
+            self.stdout.write('LogEntry is already partitioned')
+            return
+
+        partitions.partition_table(options['months_ahead'])
+        self.stdout.write(self.style.SUCCESS('LogEntry partitioned into {} monthly partitions'.format(
+            len(partitions.list_partitions()))))
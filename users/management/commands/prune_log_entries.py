@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from users import partitions
+
+
+class Command(BaseCommand):
+    """
+    Roll up LogEntry older than the retention period into daily LogEntrySummary, then remove them.
+    On partitioned table, whole expired months are dropped and upcoming monthly partitions are created,
+    so run it daily.
+    """
+    help = 'Roll up and remove expired LogEntry'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.AUDIT_LOG_RETENTION_DAYS,
+                            help='Keep LogEntry created in the last DAYS days')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Number of rows per DELETE')
+        parser.add_argument('--months-ahead', type=int, default=3,
+                            help='Number of future monthly partitions to create')
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['days'])
+        dropped, deleted = partitions.prune(before, options['batch_size'])
+        if partitions.is_partitioned():
+            partitions.create_partitions(timezone.now(), options['months_ahead'])
+
+        self.stdout.write(self.style.SUCCESS('Dropped {} partitions and deleted {} LogEntry created before {}'.format(
+            len(dropped), deleted, before.date())))
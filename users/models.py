@@ -1,9 +1,10 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
-from django.contrib.auth.models import Permission
 from django.db.models.signals import post_save
 from django.contrib.auth.signals import user_logged_in, user_logged_out, user_login_failed
 from django.dispatch import receiver
+from django.utils import timezone
+from users import audit, permissions, throttle
 
 class CustomUser(AbstractUser):
     """
@@ -26,6 +27,7 @@ class LogEntry(models.Model):
     action = models.CharField(max_length=64)
     ip = models.GenericIPAddressField(null=True, verbose_name='IP')
     email = models.CharField(max_length=256, null=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
 
     def __unicode__(self):
         return '{0} - {1} - {2}'.format(self.action, self.email, self.ip)
@@ -37,45 +39,72 @@ class LogEntry(models.Model):
         ordering = ('-id',)
         verbose_name_plural = 'Log Entries'
         verbose_name = 'Log Entry'
+        indexes = [
+            models.Index(fields=['action', 'created_at']),
+            models.Index(fields=['email']),
+            models.Index(fields=['ip']),
+        ]
+
+
+class LogEntrySummary(models.Model):
+    """
+    Daily number of LogEntry per action, kept after LogEntry expire
+    """
+
+    date = models.DateField()
+    action = models.CharField(max_length=64)
+    count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return '{0} - {1} - {2}'.format(self.date, self.action, self.count)
+
+    class Meta:
+        ordering = ('-date', 'action')
+        unique_together = ('date', 'action')
+        verbose_name_plural = 'Log Entry Summaries'
+        verbose_name = 'Log Entry Summary'
 
 
 @receiver(post_save, sender=CustomUser)
-def add_default_permission(sender, instance, **kwargs):
+def add_default_permission(sender, instance, created, raw=False, **kwargs):
     """
-    Give default permission 'Can change profile' to saved CustomUser object
+    Give default permission 'Can change profile' to created CustomUser object
     :param sender: CustomUser Class
     :param instance: CustomUser object that is being saved
+    :param created: True if CustomUser object is created
     """
-    if instance.is_superuser == False:
-        can_change_profile = Permission.objects.get(name='Can change profile')
-        instance.user_permissions.add(can_change_profile)
+    if created and not raw and not instance.is_superuser:
+        permissions.add_default_permission([instance.pk])
 
 
 @receiver(user_logged_in)
 def user_logged_in_callback(sender, request, user, **kwargs):
     """
     Called everytime user performed login successfully.
-    LogEntry objects will be created, with 'user_logged_in' as action
+    LogEntry objects will be created in batch, with 'user_logged_in' as action
     """
     ip = request.META.get('REMOTE_ADDR')
-    LogEntry.objects.create(action='user_logged_in', ip=ip, email=user.email)
+    audit.log('user_logged_in', ip, user.email)
+    throttle.reset_email(user.email)
 
 
 @receiver(user_logged_out)
 def user_logged_out_callback(sender, request, user, **kwargs):
     """
     Called everytime user performed logout successfully.
-    LogEntry objects will be created, with 'user_logged_out' as action
+    LogEntry objects will be created in batch, with 'user_logged_out' as action
     """
     ip = request.META.get('REMOTE_ADDR')
-    LogEntry.objects.create(action='user_logged_out', ip=ip, email=user.email)
+    audit.log('user_logged_out', ip, user.email)
 
 
 @receiver(user_login_failed)
 def user_login_failed_callback(sender, request, credentials, **kwargs):
     """
     Called everytime user failed to login.
-    LogEntry objects will be created, with 'user_login_failed' as action
+    LogEntry objects will be created in batch, with 'user_login_failed' as action,
+    and the failure is counted by the login throttle
     """
-    ip = request.META.get('REMOTE_ADDR')
-    LogEntry.objects.create(action='user_login_failed', ip=ip, email=credentials.get('email', None))
\ No newline at end of file
+    ip = request.META.get('REMOTE_ADDR') if request is not None else None
+    audit.log('user_login_failed', ip, credentials.get('email', None))
+    throttle.record_failure(ip, credentials.get('email') or credentials.get('username'))
\ No newline at end of file
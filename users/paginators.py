@@ -0,0 +1,37 @@
+import json
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that uses PostgreSQL planner estimate instead of COUNT(*) for big QuerySet.
+    When the estimate is below EXACT_COUNT_LIMIT, or on other databases, rows are counted.
+    """
+    EXACT_COUNT_LIMIT = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if getattr(queryset, 'db', None) is None or connections[queryset.db].vendor != 'postgresql':
+            return super().count
+
+        estimate = estimate_count(queryset)
+        if estimate < self.EXACT_COUNT_LIMIT:
+            return queryset.count()
+        return estimate
+
+
+def estimate_count(queryset):
+    """
+    :return: number of rows of a QuerySet estimated by PostgreSQL planner
+    """
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) {}'.format(sql), params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
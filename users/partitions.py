@@ -0,0 +1,179 @@
+"""
+Monthly partitions of LogEntry table by created_at.
+
+On PostgreSQL, `manage.py partition_log_entries` turns users_logentry into a natively partitioned table,
+with one partition per month named users_logentry_pYYYY_MM and a default partition for rows outside of them.
+Expired months are then removed by dropping their partition instead of deleting rows one by one.
+
+Other databases keep a single table, and expired rows are deleted in batches using the created_at index.
+"""
+import re
+from datetime import datetime
+
+from django.apps import apps
+from django.db import connection, transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+PARTITION_NAME = re.compile(r'_p(\d{4})_(\d{2})$')
+
+
+def table_name():
+    return apps.get_model('users', 'LogEntry')._meta.db_table
+
+
+def supports_partitions():
+    return connection.vendor == 'postgresql' and connection.pg_version >= 110000
+
+
+def is_partitioned():
+    """
+    :return: True if LogEntry table is a partitioned table
+    """
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass', [table_name()])
+        return cursor.fetchone() is not None
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def next_month(value):
+    return datetime(value.year + value.month // 12, value.month % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(month):
+    return '{}_p{:%Y_%m}'.format(table_name(), month)
+
+
+def list_partitions():
+    """
+    :return: list of (partition table name, first day of its month), sorted by month
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+                       'WHERE i.inhparent = %s::regclass', [table_name()])
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = []
+    for name in names:
+        match = PARTITION_NAME.search(name)
+        if match:
+            partitions.append((name, datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def create_partitions(start, months_ahead=3):
+    """
+    Create missing monthly partitions from the month of start until months_ahead months from now
+    """
+    qn = connection.ops.quote_name
+    month = month_start(start)
+    end = month_start(timezone.now())
+    for _ in range(months_ahead):
+        end = next_month(end)
+
+    with connection.cursor() as cursor:
+        while month <= end:
+            cursor.execute('CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)'.format(
+                qn(partition_name(month)), qn(table_name())), [month, next_month(month)])
+            month = next_month(month)
+
+
+def partition_table(months_ahead=3):
+    """
+    Convert LogEntry table into a partitioned table. Rows are copied, so this is done once,
+    during a maintenance window.
+    """
+    qn = connection.ops.quote_name
+    table = table_name()
+    old_table = '{}_old'.format(table)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s AND indexname <> %s",
+                       [table, '{}_pkey'.format(table)])
+        indexes = cursor.fetchall()
+        cursor.execute('SELECT pg_get_serial_sequence(%s, %s), MIN(created_at) FROM {}'.format(qn(table)),
+                       [table, 'id'])
+        sequence, first_created = cursor.fetchone()
+
+        cursor.execute('ALTER TABLE {} RENAME TO {}'.format(qn(table), qn(old_table)))
+        for name, definition in indexes:
+            cursor.execute('ALTER INDEX {} RENAME TO {}'.format(qn(name), qn('{}_old'.format(name)[-63:])))
+
+        # primary key of partitioned table must contain the partition key
+        cursor.execute('CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)'.format(
+            qn(table), qn(old_table)))
+        cursor.execute('ALTER TABLE {} ADD PRIMARY KEY (id, created_at)'.format(qn(table)))
+        # keep the id sequence when the old table is dropped
+        cursor.execute('ALTER SEQUENCE {} OWNED BY {}.id'.format(sequence, qn(table)))
+        cursor.execute('CREATE TABLE {} PARTITION OF {} DEFAULT'.format(
+            qn('{}_default'.format(table)), qn(table)))
+        create_partitions(first_created or timezone.now(), months_ahead)
+        for name, definition in indexes:
+            cursor.execute(definition)
+
+        cursor.execute('INSERT INTO {} SELECT * FROM {}'.format(qn(table), qn(old_table)))
+        cursor.execute('DROP TABLE {}'.format(qn(old_table)))
+
+
+def drop_partitions(before):
+    """
+    Drop monthly partitions that only contain rows created before a date
+    :return: list of dropped partition names
+    """
+    dropped = []
+    with connection.cursor() as cursor:
+        for name, month in list_partitions():
+            if next_month(month) > before:
+                break
+            cursor.execute('DROP TABLE {}'.format(connection.ops.quote_name(name)))
+            dropped.append(name)
+    return dropped
+
+
+def rollup(before):
+    """
+    Add number of LogEntry created before a date to LogEntrySummary, per day and action
+    """
+    LogEntry = apps.get_model('users', 'LogEntry')
+    LogEntrySummary = apps.get_model('users', 'LogEntrySummary')
+    rows = (LogEntry.objects.filter(created_at__lt=before).annotate(date=TruncDate('created_at'))
+            .values('date', 'action').annotate(count=Count('id')).order_by())
+
+    summaries = {(summary.date, summary.action): summary
+                 for summary in LogEntrySummary.objects.filter(date__in={row['date'] for row in rows})}
+    new_summaries = []
+    for row in rows:
+        summary = summaries.get((row['date'], row['action']))
+        if summary is None:
+            new_summaries.append(LogEntrySummary(**row))
+        else:
+            LogEntrySummary.objects.filter(pk=summary.pk).update(count=F('count') + row['count'])
+    LogEntrySummary.objects.bulk_create(new_summaries)
+
+
+def prune(before, batch_size=10000):
+    """
+    Roll up and remove LogEntry created before a date
+    :param before: datetime, LogEntry created before it are removed
+    :param batch_size: number of rows deleted per query, for rows that are not in a dropped partition
+    :return: tuple of (list of dropped partition names, number of deleted rows)
+    """
+    LogEntry = apps.get_model('users', 'LogEntry')
+    with transaction.atomic():
+        rollup(before)
+        dropped = drop_partitions(before) if is_partitioned() else []
+
+        deleted = 0
+        expired = LogEntry.objects.filter(created_at__lt=before)
+        while True:
+            ids = list(expired.values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            deleted += LogEntry.objects.filter(created_at__lt=before, id__in=ids).delete()[0]
+    return dropped, deleted
@@ -0,0 +1,47 @@
+"""
+Default permission of signed-up users.
+
+The permission is looked up by codename once per process and assigned by inserting rows into the
+user-permission join table directly, so assigning it takes one query for any number of users.
+"""
+from django.contrib.auth.models import Permission
+from django.db.models.signals import post_delete, post_migrate
+from django.dispatch import receiver
+
+# (app label, codename) of the permission given to every non-superuser
+DEFAULT_PERMISSION = ('portfolio', 'change_profile')
+
+permission_ids = {}
+
+
+def get_default_permission_id():
+    """
+    :return: id of the default Permission, cached after the first call
+    """
+    if DEFAULT_PERMISSION not in permission_ids:
+        app_label, codename = DEFAULT_PERMISSION
+        permission_ids[DEFAULT_PERMISSION] = Permission.objects.values_list('pk', flat=True).get(
+            content_type__app_label=app_label, codename=codename)
+    return permission_ids[DEFAULT_PERMISSION]
+
+
+def add_default_permission(user_ids):
+    """
+    Give the default permission to users that do not have it yet
+    :param user_ids: iterable of CustomUser id
+    """
+    from users.models import CustomUser
+
+    through = CustomUser.user_permissions.through
+    permission_id = get_default_permission_id()
+    through.objects.bulk_create([through(customuser_id=user_id, permission_id=permission_id)
+                                 for user_id in user_ids], ignore_conflicts=True)
+
+
+@receiver(post_migrate)
+@receiver(post_delete, sender=Permission)
+def clear_permission_ids(**kwargs):
+    """
+    Permissions may be recreated with other id by migrate or flush
+    """
+    permission_ids.clear()
@@ -1,10 +1,23 @@
 from django.urls import resolve, reverse_lazy as _
 from django.contrib.auth import get_user_model
 from django.contrib.admin.sites import AdminSite
-from django.test import TestCase, RequestFactory
+from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
+from django.test import TestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 from portfolio.admin import ProfileAdmin
 from portfolio.models import Profile
-from users.models import LogEntry
+from users import audit, permissions, throttle
+from users.admin import LogEntryAdmin
+from users.models import LogEntry, LogEntrySummary
+from users.paginators import EstimatedCountPaginator
+from datetime import timedelta
+from django.utils import timezone
+from io import StringIO
+from unittest import mock
+import json
+import os
+import tempfile
 
 
 def setup_test_data(cls):
@@ -19,8 +32,7 @@ def setup_test_data(cls):
     # Create user that mimics signed-up user
     cls.user = get_user_model().objects.create_user(username=cls.username, email=cls.email,
                                                     password=cls.password, is_staff=True)
-    cls.profile = Profile.objects.create(user=cls.user, first_name=cls.user.first_name,
-                                         last_name=cls.user.last_name)
+    cls.profile = Profile.objects.get(user=cls.user)  # created on signup
 
     # user with superuser status
     cls.credentials2 = {
@@ -33,8 +45,7 @@ def setup_test_data(cls):
     # Create user that mimics signed-up user
     cls.user2 = get_user_model().objects.create_user(username=cls.username2, email=cls.email2,
                                                      password=cls.password2, is_superuser=True)
-    cls.profile2 = Profile.objects.create(user=cls.user2, first_name=cls.user2.first_name,
-                                          last_name=cls.user2.last_name)
+    cls.profile2 = Profile.objects.get(user=cls.user2)  # created on signup
 
 class CustomUsertest(TestCase):
     """
@@ -62,6 +73,29 @@ class CustomUsertest(TestCase):
         self.assertEquals(True, self.user.has_perm('portfolio.change_profile'))
         self.assertEquals(1, self.user.user_permissions.all().count())
 
+    def test_save_does_not_query_permission(self):
+        """
+        Saving existing User, e.g. name update on Profile save, should only update the User row
+        """
+        user = get_user_model().objects.get(pk=self.user.pk)
+        user.first_name = 'Budi'
+        with self.assertNumQueries(1):
+            user.save(update_fields=['first_name'])
+
+    def test_bulk_default_permission(self):
+        """
+        Default permission should be given to many users at once, skipping users that have it
+        """
+        get_user_model().objects.bulk_create([
+            get_user_model()(username='bulk{}'.format(i), email='bulk{}@gmail.com'.format(i)) for i in range(3)])
+        user_ids = get_user_model().objects.filter(username__startswith='bulk').values_list('pk', flat=True)
+        permissions.get_default_permission_id()
+        with self.assertNumQueries(1):
+            permissions.add_default_permission(list(user_ids) + [self.user.pk])
+        for user in get_user_model().objects.filter(pk__in=user_ids):
+            self.assertEquals(True, user.has_perm('portfolio.change_profile'))
+        self.assertEquals(1, self.user.user_permissions.all().count())
+
     def test_staff_status(self):
         """
         Signed-up User should have staff status
@@ -129,9 +163,10 @@ class CustomUsertest(TestCase):
         qs = profile_admin.get_queryset(request)
         self.assertEquals(qs.count(), 2)
 
+@override_settings(AUDIT_LOG_BATCH_SIZE=1)
 class LogEntryTest(TestCase):
     """
-    TestCase for LogEntry
+    TestCase for LogEntry, written as soon as they are logged
     """
 
     @classmethod
@@ -190,4 +225,214 @@ class LogEntryTest(TestCase):
         log = LogEntry.objects.all().first()
 
         self.assertEquals(log.action, 'user_logged_out')
-        self.assertEquals(log.email, self.email2)
\ No newline at end of file
+        self.assertEquals(log.email, self.email2)
+
+
+class AuditBufferTest(TestCase):
+    """
+    TestCase for batched LogEntry writes
+    """
+
+    def setUp(self):
+        audit.buffer.flush()
+        self.spool = os.path.join(tempfile.mkdtemp(), 'audit_spool.jsonl')
+
+    @override_settings(AUDIT_LOG_BATCH_SIZE=3, AUDIT_LOG_FLUSH_INTERVAL=60)
+    def test_entries_written_in_batch(self):
+        """
+        LogEntry should only be written when the buffer is full, in one query
+        """
+        audit.log('user_login_failed', '127.0.0.1', 'a@gmail.com')
+        audit.log('user_login_failed', '127.0.0.1', 'b@gmail.com')
+        self.assertEquals(LogEntry.objects.count(), 0)
+        with self.assertNumQueries(1):
+            audit.log('user_logged_in', '127.0.0.1', 'c@gmail.com')
+        self.assertEquals(list(LogEntry.objects.values_list('email', flat=True)),
+                          ['c@gmail.com', 'b@gmail.com', 'a@gmail.com'])
+
+    @override_settings(AUDIT_LOG_BATCH_SIZE=100, AUDIT_LOG_FLUSH_INTERVAL=0)
+    def test_entries_written_after_interval(self):
+        """
+        LogEntry should be written when the oldest buffered entry is older than the flush interval
+        """
+        audit.log('user_logged_out', '127.0.0.1', 'a@gmail.com')
+        self.assertEquals(LogEntry.objects.count(), 1)
+        self.assertIsNotNone(LogEntry.objects.first().created_at)
+
+    @override_settings(AUDIT_LOG_BATCH_SIZE=2)
+    def test_entries_spooled_when_database_fails(self):
+        """
+        Entries that can not be written should be spooled, then written by the next successful flush
+        """
+        with self.settings(AUDIT_LOG_SPOOL=self.spool), \
+                mock.patch.object(LogEntry.objects, 'bulk_create', side_effect=DatabaseError):
+            audit.log('user_login_failed', '127.0.0.1', 'a@gmail.com')
+            audit.log('user_login_failed', '127.0.0.1', 'b@gmail.com')
+        self.assertEquals(LogEntry.objects.count(), 0)
+        self.assertTrue(os.path.exists(self.spool))
+
+        with self.settings(AUDIT_LOG_SPOOL=self.spool):
+            audit.log('user_logged_in', '127.0.0.1', 'c@gmail.com')
+            audit.log('user_logged_in', '127.0.0.1', 'd@gmail.com')
+        self.assertEquals(LogEntry.objects.count(), 4)
+        self.assertFalse(os.path.exists(self.spool))
+
+
+    @override_settings(AUDIT_LOG_BATCH_SIZE=1)
+    def test_spool_left_by_crash_is_replayed(self):
+        """
+        Replay file of a process that crashed is written by the next flush, and a line cut by a crash is
+        moved to the rejected file instead of failing the replay
+        """
+        with open(self.spool + '.12345.replay', 'w') as f:
+            f.write(json.dumps({'action': 'user_logged_in', 'ip': '127.0.0.1', 'email': 'a@gmail.com',
+                                'created_at': timezone.now().isoformat()}) + '\n')
+            f.write('{"action": "user_logged_in", "ip": "127.0.0.1", "ema')
+
+        with self.settings(AUDIT_LOG_SPOOL=self.spool):
+            audit.log('user_logged_in', '127.0.0.1', 'b@gmail.com')
+        self.assertEquals(sorted(LogEntry.objects.values_list('email', flat=True)), ['a@gmail.com', 'b@gmail.com'])
+        self.assertEquals(os.listdir(os.path.dirname(self.spool)), ['audit_spool.jsonl.rejected'])
+        with open(self.spool + '.rejected') as f:
+            self.assertTrue(f.read().startswith('{"action": "user_logged_in", "ip": "127.0.0.1", "ema'))
+
+    @override_settings(AUDIT_LOG_BATCH_SIZE=1)
+    def test_failed_flush_keeps_outer_transaction(self):
+        """
+        A failed write only rolls back its own savepoint, so the transaction of the caller can still be used
+        """
+        def fail(*args, **kwargs):
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT * FROM missing_audit_table')
+
+        with self.settings(AUDIT_LOG_SPOOL=self.spool), transaction.atomic(), \
+                mock.patch.object(LogEntry.objects, 'bulk_create', side_effect=fail):
+            audit.log('user_login_failed', '127.0.0.1', 'a@gmail.com')
+            self.assertEquals(LogEntry.objects.count(), 0)
+        self.assertTrue(os.path.exists(self.spool))
+
+
+class LogEntryRetentionTest(TestCase):
+    """
+    TestCase for LogEntry rollup, retention and admin queries
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        audit.buffer.flush()
+        setup_test_data(cls)
+        now = timezone.now()
+        LogEntry.objects.bulk_create([
+            LogEntry(action='user_logged_in', ip='10.0.0.1', email=cls.email, created_at=now - timedelta(days=400)),
+            LogEntry(action='user_logged_in', ip='10.0.0.1', email=cls.email, created_at=now - timedelta(days=400)),
+            LogEntry(action='user_login_failed', ip='10.0.0.2', email=cls.email2,
+                     created_at=now - timedelta(days=30)),
+            LogEntry(action='user_logged_in', ip='10.0.0.2', email=cls.email2, created_at=now - timedelta(hours=1)),
+        ])
+
+    def test_prune_log_entries(self):
+        """
+        LogEntry older than retention period should be removed and counted in LogEntrySummary
+        """
+        call_command('prune_log_entries', days=365, stdout=StringIO())
+        self.assertEquals(LogEntry.objects.filter(email__in=[self.email, self.email2]).count(), 2)
+        summary = LogEntrySummary.objects.get()
+        self.assertEquals((summary.action, summary.count), ('user_logged_in', 2))
+
+        # running again should not count removed LogEntry twice
+        call_command('prune_log_entries', days=365, stdout=StringIO())
+        self.assertEquals(LogEntrySummary.objects.get().count, 2)
+
+    def get_changelist_queryset(self, **params):
+        request = RequestFactory().get('/admin/users/logentry/', params)
+        request.user = self.user2
+        return LogEntryAdmin(LogEntry, AdminSite()).get_changelist_instance(request).get_queryset(request)
+
+    def test_admin_search_exact_match_in_window(self):
+        """
+        Admin search should match exact email or IP, created in the last AUDIT_LOG_SEARCH_DAYS days by default
+        """
+        self.assertEquals(self.get_changelist_queryset(q='10.0.0.2').count(), 1)
+        self.assertEquals(self.get_changelist_queryset(q='10.0.0.2', within='all').count(), 2)
+        self.assertEquals(self.get_changelist_queryset(q=self.email, within='all').count(), 2)
+        self.assertEquals(self.get_changelist_queryset(q='testuser1', within='all').count(), 0)
+
+    def test_admin_action_filter(self):
+        """
+        Action filter lists known actions without querying distinct actions
+        """
+        with CaptureQueriesContext(connection) as queries:
+            queryset = self.get_changelist_queryset(action='user_login_failed', within='all')
+        self.assertFalse([query for query in queries.captured_queries if 'DISTINCT' in query['sql'].upper()])
+        self.assertEquals(list(queryset.values_list('ip', flat=True)), ['10.0.0.2'])
+
+    def test_paginator_count(self):
+        """
+        Paginator count should be exact for small tables
+        """
+        paginator = EstimatedCountPaginator(LogEntry.objects.all(), 10)
+        self.assertEquals(paginator.count, LogEntry.objects.count())
+
+
+@override_settings(LOGIN_THROTTLE_IP_LIMIT=5, LOGIN_THROTTLE_EMAIL_LIMIT=3, LOGIN_THROTTLE_WINDOW=300)
+class LoginThrottleTest(TestCase):
+    """
+    TestCase for failed login throttling
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        setup_test_data(cls)
+
+    def setUp(self):
+        throttle.get_store().clear()
+
+    def login(self, email, password='wrong', ip='10.0.0.1'):
+        return self.client.post(_('account_login'), {'login': email, 'password': password}, REMOTE_ADDR=ip)
+
+    def test_email_throttled_before_password_check(self):
+        """
+        After LOGIN_THROTTLE_EMAIL_LIMIT failures, login of the email should be rejected without checking password
+        """
+        for i in range(3):
+            self.assertEquals(self.login(self.email).status_code, 200)
+
+        with mock.patch('users.models.CustomUser.check_password') as check_password:
+            response = self.login(self.email, self.password)
+        self.assertEquals(response.status_code, 429)
+        self.assertEquals(response['Retry-After'], '300')
+        check_password.assert_not_called()
+        # other email from another IP address can still login
+        self.assertEquals(self.login(self.email2, self.password2, ip='10.0.0.2').status_code, 302)
+
+    def test_ip_throttled(self):
+        """
+        After LOGIN_THROTTLE_IP_LIMIT failures, every login from the IP address should be rejected
+        """
+        for i in range(5):
+            self.login('user{}@gmail.com'.format(i))
+        self.assertEquals(self.login(self.email2, self.password2).status_code, 429)
+        self.assertEquals(self.login(self.email2, self.password2, ip='10.0.0.2').status_code, 302)
+
+    def test_successful_login_resets_email(self):
+        """
+        Successful login should forget previous failures of the email
+        """
+        self.login(self.email)
+        self.login(self.email)
+        self.assertEquals(self.login(self.email, self.password).status_code, 302)
+        self.assertFalse(throttle.is_blocked(None, self.email))
+
+    def test_cache_store_sliding_window(self):
+        """
+        CacheStore should count hits in the current and previous window
+        """
+        store = throttle.CacheStore()
+        store.clear()
+        with mock.patch('users.throttle.time.time', return_value=1000.0):
+            store.hit('ip:10.0.0.3', 100)
+            store.hit('ip:10.0.0.3', 100)
+        with mock.patch('users.throttle.time.time', return_value=1150.0):
+            store.hit('ip:10.0.0.3', 100)
+            # half of the previous window still overlaps the sliding window
+            self.assertEquals(store.count('ip:10.0.0.3', 100), 2)
@@ -0,0 +1,205 @@
+"""
+Failed login throttling.
+
+Failed logins are counted per IP address and per email in a sliding window of LOGIN_THROTTLE_WINDOW seconds.
+LoginThrottleMiddleware answers login POST with 429 Too Many Requests once a limit is reached, before the
+form is validated, so blocked attempts cost no password hash and no database query.
+
+The window is approximated from two fixed windows: failures of the previous window are weighted by how much of
+it still overlaps the sliding window. Counters are kept by a store, LocalMemoryStore for a single process or
+CacheStore to share them between workers through a Django cache.
+"""
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+# Number of checked, blocked and failed logins since the process started
+METRICS = Counter()
+metrics_lock = threading.Lock()
+
+
+def increment(metric):
+    with metrics_lock:
+        METRICS[metric] += 1
+
+
+def get_metrics():
+    """
+    :return: dictionary of throttle metrics
+    """
+    with metrics_lock:
+        return dict(METRICS)
+
+
+def sliding_count(previous, current, elapsed, window):
+    """
+    :param previous: count of the previous fixed window
+    :param current: count of the current fixed window
+    :param elapsed: seconds since the current fixed window started
+    """
+    return previous * (window - elapsed) / window + current
+
+
+class LocalMemoryStore(object):
+    """
+    Counters in process memory
+    """
+    # Counters of expired windows are removed when there are more keys than this
+    MAX_KEYS = 100000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def hit(self, key, window):
+        bucket = int(time.time() // window)
+        with self.lock:
+            counters = self.counters.setdefault(key, {})
+            counters[bucket] = counters.get(bucket, 0) + 1
+            for old_bucket in [b for b in counters if b < bucket - 1]:
+                del counters[old_bucket]
+            if len(self.counters) > self.MAX_KEYS:
+                self.remove_expired(bucket)
+
+    def count(self, key, window):
+        now = time.time()
+        bucket = int(now // window)
+        with self.lock:
+            counters = self.counters.get(key, {})
+            return sliding_count(counters.get(bucket - 1, 0), counters.get(bucket, 0), now % window, window)
+
+    def reset(self, key):
+        with self.lock:
+            self.counters.pop(key, None)
+
+    def remove_expired(self, bucket):
+        for key in [key for key, counters in self.counters.items() if max(counters) < bucket - 1]:
+            del self.counters[key]
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+
+
+class CacheStore(object):
+    """
+    Counters in the LOGIN_THROTTLE_CACHE cache, shared by every worker using it
+    """
+
+    def __init__(self):
+        self.cache = caches[settings.LOGIN_THROTTLE_CACHE]
+
+    def bucket_key(self, key, bucket):
+        return 'login-throttle:{}:{}'.format(key, bucket)
+
+    def hit(self, key, window):
+        bucket_key = self.bucket_key(key, int(time.time() // window))
+        # add() does nothing if the key exists, incr() is atomic on memcached and redis
+        self.cache.add(bucket_key, 0, timeout=window * 2)
+        try:
+            self.cache.incr(bucket_key)
+        except ValueError:
+            # expired between add() and incr()
+            self.cache.set(bucket_key, 1, timeout=window * 2)
+
+    def count(self, key, window):
+        now = time.time()
+        bucket = int(now // window)
+        values = self.cache.get_many([self.bucket_key(key, bucket - 1), self.bucket_key(key, bucket)])
+        return sliding_count(values.get(self.bucket_key(key, bucket - 1), 0),
+                             values.get(self.bucket_key(key, bucket), 0), now % window, window)
+
+    def reset(self, key):
+        bucket = int(time.time() // settings.LOGIN_THROTTLE_WINDOW)
+        self.cache.delete_many([self.bucket_key(key, bucket - 1), self.bucket_key(key, bucket)])
+
+    def clear(self):
+        # clears every key of the cache, so LOGIN_THROTTLE_CACHE should be dedicated to throttling
+        self.cache.clear()
+
+
+STORES = {}
+
+
+def get_store():
+    """
+    :return: instance of the LOGIN_THROTTLE_STORE class, one per process
+    """
+    path = settings.LOGIN_THROTTLE_STORE
+    if path not in STORES:
+        STORES[path] = import_string(path)()
+    return STORES[path]
+
+
+def throttle_keys(ip, email):
+    keys = []
+    if ip:
+        keys.append(('ip:{}'.format(ip), settings.LOGIN_THROTTLE_IP_LIMIT))
+    if email:
+        keys.append(('email:{}'.format(email.strip().lower()), settings.LOGIN_THROTTLE_EMAIL_LIMIT))
+    return keys
+
+
+def record_failure(ip, email):
+    """
+    Count a failed login of an IP address and email
+    """
+    store = get_store()
+    for key, limit in throttle_keys(ip, email):
+        store.hit(key, settings.LOGIN_THROTTLE_WINDOW)
+    increment('failed')
+
+
+def reset_email(email):
+    """
+    Forget failed logins of an email, after it logs in successfully
+    """
+    if email:
+        get_store().reset('email:{}'.format(email.strip().lower()))
+
+
+def is_blocked(ip, email):
+    """
+    :return: True if the IP address or email has reached its failed login limit
+    """
+    store = get_store()
+    return any(store.count(key, settings.LOGIN_THROTTLE_WINDOW) >= limit for key, limit in throttle_keys(ip, email))
+
+
+class LoginThrottleMiddleware(object):
+    """
+    Reject login POST of IP address or email that failed to login too many times
+    """
+    # Names of login views, and the POST field that contains the email
+    LOGIN_URLS = (
+        ('account_login', 'login'),
+        ('login', 'username'),
+        ('admin:login', 'username'),
+    )
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.login_paths = None
+
+    def get_login_paths(self):
+        if self.login_paths is None:
+            self.login_paths = {reverse(name): field for name, field in self.LOGIN_URLS}
+        return self.login_paths
+
+    def __call__(self, request):
+        if request.method == 'POST' and request.path in self.get_login_paths():
+            increment('checked')
+            email = request.POST.get(self.get_login_paths()[request.path])
+            if is_blocked(request.META.get('REMOTE_ADDR'), email):
+                increment('blocked')
+                response = HttpResponse('Too many failed login attempts, please try again later.', status=429,
+                                        content_type='text/plain')
+                response['Retry-After'] = settings.LOGIN_THROTTLE_WINDOW
+                return response
+        return self.get_response(request)